@@ -0,0 +1,177 @@
+"""
+Semantic answer cache for Charak Samhita AI
+
+Near-duplicate questions ("What does Charak say about Vata dosha?" /
+"what does charaka say about vata") retrieve the same chunks and get the
+same answer, so there is no need to pay for another Groq round-trip.
+
+An entry is reused only when
+  * the new question retrieved exactly the same chunk IDs, and
+  * the cosine similarity of the two question embeddings is >= threshold.
+
+Entries are evicted LRU once `max_entries` is reached and expire after
+`ttl` seconds. Passing `path` keeps a SQLite copy so the cache survives
+restarts.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _unit(embedding):
+    vec = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def _chunk_key(chunk_ids, namespace=""):
+    return namespace + "\x1f" + "\x1f".join(sorted(chunk_ids))
+
+
+class AnswerCache:
+    def __init__(self, threshold=0.92, max_entries=512, ttl=7 * 24 * 3600, path=None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # entry id -> entry dict, LRU order
+        self._by_chunks = {}            # chunk key -> set of entry ids
+        self._next_id = 0
+        self._db = None
+
+        if path:
+            self._open_db(path)
+
+    # -- persistence ---------------------------------------------------
+    def _open_db(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chunk_key TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._db.execute("DELETE FROM answers WHERE created < ?", (time.time() - self.ttl,))
+        self._db.commit()
+
+        rows = self._db.execute(
+            "SELECT id, chunk_key, embedding, answer, sources, created, last_used "
+            "FROM answers ORDER BY last_used DESC LIMIT ?", (self.max_entries,)
+        ).fetchall()
+        for row in reversed(rows):
+            entry_id, chunk_key, blob, answer, sources, created, last_used = row
+            self._add(entry_id, {
+                "chunk_key": chunk_key,
+                "embedding": np.frombuffer(blob, dtype=np.float32),
+                "answer": answer,
+                "sources": json.loads(sources),
+                "created": created,
+                "last_used": last_used,
+            })
+            self._next_id = max(self._next_id, entry_id + 1)
+
+        # Rows beyond max_entries were never loaded; drop them from disk too
+        self._db.execute(
+            "DELETE FROM answers WHERE id NOT IN "
+            "(SELECT id FROM answers ORDER BY last_used DESC LIMIT ?)", (self.max_entries,)
+        )
+        self._db.commit()
+
+    # -- in-memory bookkeeping -----------------------------------------
+    def _add(self, entry_id, entry):
+        self._entries[entry_id] = entry
+        self._by_chunks.setdefault(entry["chunk_key"], set()).add(entry_id)
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        ids = self._by_chunks[entry["chunk_key"]]
+        ids.discard(entry_id)
+        if not ids:
+            del self._by_chunks[entry["chunk_key"]]
+        if self._db is not None:
+            self._db.execute("DELETE FROM answers WHERE id = ?", (entry_id,))
+
+    # -- public API ----------------------------------------------------
+    def lookup(self, embedding, chunk_ids, namespace=""):
+        """Return (entry, similarity) for the closest cached answer, or None"""
+        query = _unit(embedding)
+        key = _chunk_key(chunk_ids, namespace)
+        now = time.time()
+
+        with self._lock:
+            best_id, best_sim = None, -1.0
+            for entry_id in list(self._by_chunks.get(key, ())):
+                entry = self._entries[entry_id]
+                if now - entry["created"] > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                sim = float(np.dot(query, entry["embedding"]))
+                if sim > best_sim:
+                    best_id, best_sim = entry_id, sim
+
+            if best_id is None or best_sim < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry = self._entries[best_id]
+            entry["last_used"] = now
+            self._entries.move_to_end(best_id)
+            if self._db is not None:
+                self._db.execute("UPDATE answers SET last_used = ? WHERE id = ?", (now, best_id))
+                self._db.commit()
+            return entry, best_sim
+
+    def store(self, embedding, chunk_ids, answer, sources, namespace=""):
+        vec = _unit(embedding)
+        now = time.time()
+        entry = {
+            "chunk_key": _chunk_key(chunk_ids, namespace),
+            "embedding": vec,
+            "answer": answer,
+            "sources": list(sources),
+            "created": now,
+            "last_used": now,
+        }
+
+        with self._lock:
+            if self._db is not None:
+                # SQLite picks the id: other processes may share this file
+                entry_id = self._db.execute(
+                    "INSERT INTO answers (chunk_key, embedding, answer, sources, created, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (entry["chunk_key"], vec.tobytes(), answer,
+                     json.dumps(entry["sources"], ensure_ascii=False), now, now)
+                ).lastrowid
+            else:
+                entry_id = self._next_id
+                self._next_id += 1
+            self._add(entry_id, entry)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            if self._db is not None:
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_chunks.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM answers")
+                self._db.commit()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,18 +1,18 @@
-import os
-import zipfile
-
-# Unzip charak_db BEFORE importing rag_engine
-if not os.path.exists("./charak_db"):
-    if os.path.exists("charak_db.zip"):
-        print("Unzipping charak_db.zip...")
-        with zipfile.ZipFile("charak_db.zip", "r") as z:
-            z.extractall(".")
-        print("Done unzipping!")
-    else:
-        print("WARNING: charak_db.zip not found!")
-
 import streamlit as st
-from rag_engine import ask_charak
+from metrics import REGISTRY
+from rag_engine import get_engine
+from sections import STHANAS
+
+PAGE_TYPES = {"adhyaya": "Chapters", "sthana": "Sthana overviews", "other": "Topic pages"}
+
+
+@st.cache_resource(show_spinner=False)
+def load_engine():
+    """One engine per process, warmed in the background so the page renders first"""
+    engine = get_engine()
+    engine.warm_up(background=True)
+    return engine
+
 
 # --- Page Config ---
 st.set_page_config(
@@ -273,6 +273,8 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+engine = load_engine()
+
 # ── SESSION STATE ─────────────────────────────────────────────────────
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -296,16 +298,20 @@ if not st.session_state.messages:
     st.markdown('<div class="om-divider">· · ॐ · ·</div>', unsafe_allow_html=True)
 
 # ── CHAT HISTORY ──────────────────────────────────────────────────────
+def answer_card(answer, sources):
+    answer_html = answer.replace("\n", "<br>")
+    sources_html = ""
+    if sources:
+        chips = "".join([f'<span class="source-chip">{s}</span>' for s in sources])
+        sources_html = f'<div class="sources-row"><span class="sources-label">📚 Sources</span>{chips}</div>'
+    return f'<div class="answer-card">{answer_html}{sources_html}</div>'
+
+
 for msg in st.session_state.messages:
     if msg["role"] == "user":
         st.markdown(f'<div class="user-bubble">🙏 {msg["content"]}</div>', unsafe_allow_html=True)
     else:
-        answer_html = msg["content"].replace("\n", "<br>")
-        sources_html = ""
-        if "sources" in msg and msg["sources"]:
-            chips = "".join([f'<span class="source-chip">{s}</span>' for s in msg["sources"]])
-            sources_html = f'<div class="sources-row"><span class="sources-label">📚 Sources</span>{chips}</div>'
-        st.markdown(f'<div class="answer-card">{answer_html}{sources_html}</div>', unsafe_allow_html=True)
+        st.markdown(answer_card(msg["content"], msg.get("sources")), unsafe_allow_html=True)
 
 # ── PREFILL HANDLER ───────────────────────────────────────────────────
 prefill = st.session_state.pop("prefill", "")
@@ -313,29 +319,45 @@ prefill = st.session_state.pop("prefill", "")
 # ── CHAT INPUT ────────────────────────────────────────────────────────
 question = st.chat_input("Ask anything from Charak Samhita...") or prefill
 
-if question:
-    st.session_state.messages.append({"role": "user", "content": question})
-    st.markdown(f'<div class="user-bubble">🙏 {question}</div>', unsafe_allow_html=True)
 
-    with st.spinner("🌿 Searching ancient wisdom..."):
-        try:
-            result = ask_charak(question)
-            answer = result["answer"]
-            sources = result["sources"]
+def search_filters():
+    """Scope chosen in the sidebar (widget state from the previous run)"""
+    return {
+        "sthana": st.session_state.get("filter_sthana", []),
+        "page_type": st.session_state.get("filter_page_type", []),
+        "adhyaya": st.session_state.get("filter_adhyaya", 0) or None,
+    }
 
-            answer_html = answer.replace("\n", "<br>")
-            chips = "".join([f'<span class="source-chip">{s}</span>' for s in sources])
-            sources_html = f'<div class="sources-row"><span class="sources-label">📚 Sources</span>{chips}</div>' if sources else ""
-            st.markdown(f'<div class="answer-card">{answer_html}{sources_html}</div>', unsafe_allow_html=True)
 
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": answer,
-                "sources": sources
-            })
+if question:
+    st.session_state.messages.append({"role": "user", "content": question})
+    st.markdown(f'<div class="user-bubble">🙏 {question}</div>', unsafe_allow_html=True)
 
-        except Exception as e:
-            st.error(f"⚠️ {str(e)}")
+    card = st.empty()
+    try:
+        events = engine.ask_stream(question, search_filters())
+        # Spinner only covers retrieval; the card fills in as tokens arrive
+        with st.spinner("🌿 Searching ancient wisdom..."):
+            sources = next(events)["sources"]
+
+        answer = ""
+        for event in events:
+            if event["type"] == "token":
+                answer += event["text"]
+                card.markdown(answer_card(answer + "▌", sources), unsafe_allow_html=True)
+            elif event["type"] == "done":
+                answer = event["answer"]
+                st.session_state.last_result = event
+        card.markdown(answer_card(answer, sources), unsafe_allow_html=True)
+
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": answer,
+            "sources": sources
+        })
+
+    except Exception as e:
+        st.error(f"⚠️ {str(e)}")
 
 # ── DISCLAIMER ────────────────────────────────────────────────────────
 if st.session_state.messages:
@@ -374,6 +396,49 @@ with st.sidebar:
         st.session_state.messages = []
         st.rerun()
 
+    # ── SEARCH SCOPE ──
+    st.markdown("## 🔎 Search scope")
+    st.multiselect("Sthana", [f"{name} Sthana" for name in STHANAS], key="filter_sthana",
+                   placeholder="All Sthanas")
+    st.number_input("Adhyaya (chapter, 0 = any)", min_value=0, max_value=40, step=1,
+                    key="filter_adhyaya")
+    st.multiselect("Page type", list(PAGE_TYPES), format_func=PAGE_TYPES.get,
+                   key="filter_page_type", placeholder="All pages")
+
+    # ── DEBUG PANEL ──
+    if st.checkbox("🔬 Debug panel"):
+        last = st.session_state.get("last_result")
+        if last:
+            timings = "".join(
+                f"{stage.removesuffix('_ms')}: <strong>{ms:.0f} ms</strong><br>"
+                for stage, ms in last.get("timings", {}).items() if ms is not None
+            )
+            usage = last.get("usage") or {}
+            st.markdown(f"""
+            <div class="sidebar-stat">
+                <strong>Last answer</strong><br>{timings}
+            </div>
+            <div class="sidebar-stat">
+                Tokens: <strong>{usage.get("prompt_tokens", "–")}</strong> in ·
+                <strong>{usage.get("completion_tokens", "–")}</strong> out<br>
+                Model: <strong>{last.get("model") or "–"}</strong>{" (degraded)" if last.get("degraded") else ""}<br>
+                Answer cache: <strong>{"hit" if last.get("cache_hit") else "miss"}</strong><br>
+                Embedding cache: <strong>{"hit" if last.get("embedding_cache_hit") else "miss"}</strong>
+            </div>
+            """, unsafe_allow_html=True)
+            if last.get("error"):
+                st.markdown(f'<div class="sidebar-stat">Error: {last["error"]}</div>', unsafe_allow_html=True)
+        else:
+            st.caption("Ask a question to see its timings.")
+
+        counts = {dict(labels)["outcome"]: int(value)
+                  for (name, labels), value in REGISTRY.snapshot()["counters"].items()
+                  if name == "charak_requests_total"}
+        if counts:
+            summary = " · ".join(f"{k}: <strong>{v}</strong>" for k, v in sorted(counts.items()))
+            st.markdown(f'<div class="sidebar-stat"><strong>This process</strong><br>{summary}</div>',
+                        unsafe_allow_html=True)
+
     st.markdown("---")
     st.markdown("""
     <div style='font-size:0.75rem; opacity:0.5; line-height:1.8;'>
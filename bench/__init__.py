@@ -0,0 +1,9 @@
+"""
+Benchmarks for Charak Samhita AI
+Run: python -m bench                          # stages + concurrency 1,4,16
+     python -m bench --llm-latency 1.0 --concurrency 1,8,32
+     python -m bench --compare OLD.json NEW.json
+
+See bench/run.py for what is measured and bench/stub_llm.py for the
+local Groq-compatible server that stands in for the real API.
+"""
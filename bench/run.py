@@ -0,0 +1,280 @@
+"""
+Benchmark the ask_charak hot path, stage by stage and end to end
+
+Stages are timed one question at a time on a warmed-up engine:
+
+    embed      question → vector (model only, no embedding cache)
+    retrieve   dense backend query for TOP_K chunks
+    bm25       sparse search (only when a BM25 index is present)
+    context    context packing and prompt assembly from the retrieved chunks
+    llm        chat completion against the stub server
+
+then `RagEngine.ask` runs at each concurrency level, and `ask_batch`
+answers the same requests in one call per level (the level being its LLM
+concurrency). The LLM is always the local stub (bench/stub_llm.py), so
+results measure our code plus a fixed, configurable model latency. Answer
+and embedding caches and in-flight coalescing are disabled unless
+--with-caches is given.
+
+Results (ms percentiles, requests/s) are printed and written as JSON so
+runs can be compared between commits with --compare.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+from bench.stub_llm import start_stub_server
+
+RESULTS_DIR = "bench_results"
+CONCURRENCY = [1, 4, 16]
+REQUESTS_PER_LEVEL = 64
+STAGE_ROUNDS = 3             # passes over QUESTIONS for the stage timings
+LLM_LATENCY = 0.5            # stub seconds before the first token
+PERCENTILES = (50, 95, 99)
+
+QUESTIONS = [
+    "What are the three doshas?",
+    "How is jwara (fever) treated in Chikitsa Sthana?",
+    "What does Charak Samhita say about the qualities of a good physician?",
+    "Describe the concept of agni and its types.",
+    "What is rasayana and who should take it?",
+    "Which foods aggravate vata dosha?",
+    "Explain the daily regimen (dinacharya) recommended by Charaka.",
+    "What are the causes of prameha?",
+    "How should panchakarma be prepared for with snehana and swedana?",
+    "What is the role of ojas in immunity?",
+    "Describe the seasonal regimen (ritucharya) for winter.",
+    "What are the signs of a healthy person (swastha)?",
+    "How does Charaka classify diseases by prognosis?",
+    "What are the properties of ghee in Ayurveda?",
+    "Which herbs are recommended for cough (kasa)?",
+    "What is the meaning of tridosha balance?",
+]
+
+
+def summarize(samples_ms):
+    if not samples_ms:
+        return {"n": 0}
+    values = np.asarray(samples_ms)
+    summary = {f"p{p}": round(float(np.percentile(values, p)), 3) for p in PERCENTILES}
+    summary.update(mean=round(float(values.mean()), 3), n=len(samples_ms))
+    return summary
+
+
+def _timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_stages(engine, questions, rounds=STAGE_ROUNDS):
+    """{stage: [ms, ...]} from running each stage in isolation"""
+    from rag_engine import HYBRID_CANDIDATES, _candidates, _new_info
+
+    stages = {"embed": [], "retrieve": [], "bm25": [], "context": [], "llm": []}
+    client = engine._groq_client()
+    bm25 = engine.bm25
+    prompts = []
+    for round_num in range(rounds):
+        for question in questions:
+            embedding, ms = _timed(engine.model.encode, [question])
+            stages["embed"].append(ms)
+
+            results, ms = _timed(engine.backend.query, [embedding[0].tolist()], n_results=engine.top_k)
+            stages["retrieve"].append(ms)
+
+            if bm25 is not None:
+                _, ms = _timed(bm25.search, question, HYBRID_CANDIDATES)
+                stages["bm25"].append(ms)
+
+            candidates = _candidates(results["ids"][0], results["documents"][0],
+                                     results["metadatas"][0], results["distances"][0])
+            (messages, _), ms = _timed(engine._build_prompt, question, candidates, _new_info())
+            stages["context"].append(ms)
+            if round_num == 0:
+                prompts.append(messages)
+
+    # One LLM pass is enough: the stub's latency is fixed by design
+    for messages in prompts:
+        _, ms = _timed(client.chat.completions.create, model=engine.groq_model,
+                       messages=messages, max_tokens=1500, temperature=0.3)
+        stages["llm"].append(ms)
+    return stages
+
+
+def bench_concurrency(engine, questions, levels=CONCURRENCY, requests=REQUESTS_PER_LEVEL):
+    """End-to-end `engine.ask` latency and throughput per concurrency level"""
+    runs = []
+    for level in levels:
+        batch = [questions[i % len(questions)] for i in range(requests)]
+
+        def one(question):
+            result, ms = _timed(engine.ask, question)
+            return ms, bool(result.get("error"))
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            outcomes = list(pool.map(one, batch))
+        wall = time.perf_counter() - started
+
+        errors = sum(failed for _, failed in outcomes)
+        runs.append({"concurrency": level, "requests": requests, "errors": errors,
+                     "throughput_rps": round(requests / wall, 3),
+                     "latency_ms": summarize([ms for ms, _ in outcomes])})
+    return runs
+
+
+def bench_batch(engine, questions, levels=CONCURRENCY, requests=REQUESTS_PER_LEVEL):
+    """`engine.ask_batch` wall time and throughput, LLM concurrency = level"""
+    runs = []
+    for level in levels:
+        batch = [questions[i % len(questions)] for i in range(requests)]
+        results, ms = _timed(engine.ask_batch, batch, concurrency=level)
+        runs.append({"concurrency": level, "requests": requests,
+                     "errors": sum(bool(r.get("error")) for r in results),
+                     "throughput_rps": round(requests / (ms / 1000), 3), "wall_ms": round(ms, 1)})
+    return runs
+
+
+def run(levels=CONCURRENCY, requests=REQUESTS_PER_LEVEL, llm_latency=LLM_LATENCY,
+        token_latency=0.0, with_caches=False, questions=QUESTIONS):
+    from rag_engine import RagEngine
+
+    stub = start_stub_server(llm_latency, token_latency)
+    os.environ["GROQ_BASE_URL"] = stub.base_url
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+
+    overrides = {} if with_caches else {
+        "answer_cache_threshold": 2.0,   # cosine never reaches it → always a miss
+        "embedding_cache_path": "",
+        "embedding_lru_size": 0,
+        "coalesce": False,               # the levels repeat QUESTIONS concurrently
+    }
+    engine = RagEngine(**overrides)
+    _, warm_ms = _timed(engine.warm_up)
+    print(f"🔥 Engine warmed up in {warm_ms:.0f} ms ({engine.backend.count()} chunks)")
+
+    try:
+        stages = bench_stages(engine, questions)
+        concurrency = bench_concurrency(engine, questions, levels, requests)
+        batch = bench_batch(engine, questions, levels, requests)
+    finally:
+        stub.shutdown()
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "backend": engine.backend_name if engine.snapshot_manifest is None else "snapshot",
+            "embedding_model": engine.embedding_model,
+            "embedding_runtime": engine.embedding_runtime,
+            "bm25": engine.bm25 is not None,
+            "top_k": engine.top_k,
+            "index_params": engine.index_params,
+            "chunks": engine.backend.count(),
+            "llm_latency_s": llm_latency,
+            "token_latency_s": token_latency,
+            "with_caches": with_caches,
+            "warm_up_ms": round(warm_ms, 1),
+        },
+        "stages_ms": {name: summarize(samples) for name, samples in stages.items() if samples},
+        "concurrency": concurrency,
+        "batch": batch,
+    }
+
+
+def print_report(results):
+    print(f"\n📊 Stage latency (ms) @ {results['commit'] or 'working tree'}")
+    print(f"  {'stage':10s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'n':>5s}")
+    for name, s in results["stages_ms"].items():
+        print(f"  {name:10s} {s['p50']:9.2f} {s['p95']:9.2f} {s['p99']:9.2f} {s['n']:5d}")
+
+    print("\n⚡ End to end (RagEngine.ask)")
+    print(f"  {'conc':>4s} {'req/s':>8s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'errors':>6s}")
+    for r in results["concurrency"]:
+        s = r["latency_ms"]
+        print(f"  {r['concurrency']:4d} {r['throughput_rps']:8.2f} {s['p50']:9.1f} "
+              f"{s['p95']:9.1f} {s['p99']:9.1f} {r['errors']:6d}")
+
+    print("\n📦 Batch (RagEngine.ask_batch)")
+    print(f"  {'conc':>4s} {'req/s':>8s} {'wall ms':>9s} {'errors':>6s}")
+    for r in results.get("batch", []):
+        print(f"  {r['concurrency']:4d} {r['throughput_rps']:8.2f} {r['wall_ms']:9.1f} {r['errors']:6d}")
+
+
+def compare(old_path, new_path):
+    """Print p50/p95 and throughput deltas between two result files"""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+
+    def delta(a, b):
+        return f"{a:9.2f} → {b:9.2f} ({(b - a) / a * 100 if a else 0:+6.1f}%)"
+
+    print(f"🔍 {old.get('commit')} → {new.get('commit')}")
+    for name in new["stages_ms"]:
+        if name in old["stages_ms"]:
+            for p in ("p50", "p95"):
+                print(f"  {name:10s} {p}: {delta(old['stages_ms'][name][p], new['stages_ms'][name][p])}")
+    old_runs = {r["concurrency"]: r for r in old["concurrency"]}
+    for r in new["concurrency"]:
+        if r["concurrency"] in old_runs:
+            print(f"  conc {r['concurrency']:3d} req/s: "
+                  f"{delta(old_runs[r['concurrency']]['throughput_rps'], r['throughput_rps'])}")
+    old_batch = {r["concurrency"]: r for r in old.get("batch", [])}
+    for r in new.get("batch", []):
+        if r["concurrency"] in old_batch:
+            print(f"  batch {r['concurrency']:3d} req/s: "
+                  f"{delta(old_batch[r['concurrency']]['throughput_rps'], r['throughput_rps'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default=",".join(map(str, CONCURRENCY)),
+                        help="comma-separated levels (default %(default)s)")
+    parser.add_argument("--requests", type=int, default=REQUESTS_PER_LEVEL,
+                        help="asks per concurrency level (default %(default)s)")
+    parser.add_argument("--llm-latency", type=float, default=LLM_LATENCY,
+                        help="stub LLM seconds per completion (default %(default)s)")
+    parser.add_argument("--token-latency", type=float, default=0.0,
+                        help="stub LLM extra seconds per answer word")
+    parser.add_argument("--with-caches", action="store_true",
+                        help="keep the answer/embedding caches and coalescing enabled")
+    parser.add_argument("--out", default=None, help=f"JSON results file (default {RESULTS_DIR}/...)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two result files instead of running")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run(levels=[int(c) for c in args.concurrency.split(",")], requests=args.requests,
+                  llm_latency=args.llm_latency, token_latency=args.token_latency,
+                  with_caches=args.with_caches)
+    print_report(results)
+
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"bench-{results['commit'] or 'wip'}-{results['timestamp'].replace(':', '')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✅ Results saved to {out}")
@@ -0,0 +1,169 @@
+"""
+Stub Groq-compatible chat completions server for benchmarks
+
+Answers POST /openai/v1/chat/completions (plain JSON or SSE when
+`"stream": true`) after a configurable delay, so the LLM stage costs a
+known, repeatable amount of time and no API quota. Point the Groq SDK at
+it with GROQ_BASE_URL=http://127.0.0.1:<port>.
+
+To exercise groq_pool.py it can also behave like a busy Groq: a
+per-model tokens-per-minute limit reported in x-ratelimit-* headers (429
+with retry-after once spent), a random share of 503s (or exactly the
+first `fail_first` calls), and per-model latencies. `server.calls`
+counts requests per (model, status).
+
+Run standalone: python -m bench.stub_llm --port 8011 --latency 0.5
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = ("According to Charak Samhita, the three doshas — Vata, Pitta and Kapha — "
+          "govern all physiological functions; health is their balance. "
+          "Please consult a qualified Vaidya before any treatment.")
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True   # headers and body go out as separate writes
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output clean
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _admit(self, model, tokens):
+        """(status, rate-limit headers) for a call spending `tokens` of `model`'s minute"""
+        server = self.server
+        with server.lock:
+            if server.fail_first:
+                server.fail_first -= 1
+                return server.fail_status, {}
+            if server.fail_rate and random.random() < server.fail_rate:
+                return server.fail_status, {}
+            if not server.tokens_per_minute:
+                return 200, {}
+            now = time.monotonic()
+            window = server.windows.setdefault(model, [now, 0])
+            if now - window[0] >= 60:
+                window[:] = [now, 0]
+            reset = f"{60 - (now - window[0]):.2f}s"
+            status = 200
+            if window[1] + tokens > server.tokens_per_minute:
+                status = 429
+            else:
+                window[1] += tokens
+            return status, {
+                "x-ratelimit-limit-tokens": str(server.tokens_per_minute),
+                "x-ratelimit-remaining-tokens": str(server.tokens_per_minute - window[1]),
+                "x-ratelimit-reset-tokens": reset,
+                **({"retry-after": str(max(1, round(60 - (now - window[0]))))} if status == 429 else {}),
+            }
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/openai/v1/chat/completions":
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        model = request.get("model", "stub")
+
+        words = ANSWER.split(" ")
+        prompt_tokens = sum(len(m.get("content", "")) for m in request.get("messages", [])) // 4
+        meta = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": model}
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                 "total_tokens": prompt_tokens + len(words)}
+
+        status, limit_headers = self._admit(model, usage["total_tokens"])
+        with server.lock:
+            server.requests += 1
+            server.calls[(model, status)] = server.calls.get((model, status), 0) + 1
+        if status != 200:
+            self._send_json(status, {"error": {"message": f"stub {status}", "type": "stub_error"}},
+                            limit_headers)
+            return
+
+        time.sleep(server.model_latency.get(model, server.latency))
+        if not request.get("stream"):
+            time.sleep(server.token_latency * len(words))
+            self._send_json(200, {
+                **meta, "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": ANSWER}}],
+                "usage": usage,
+            }, limit_headers)
+            return
+
+        self.send_response(200)
+        for name, value in limit_headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for i, word in enumerate(words):
+            chunk = {**meta, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word},
+                                  "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(server.token_latency)
+        final = {**meta, "object": "chat.completion.chunk",
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                 "x_groq": {"usage": usage}}
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.close_connection = True
+
+
+def start_stub_server(latency=0.5, token_latency=0.0, host="127.0.0.1", port=0,
+                      tokens_per_minute=None, fail_rate=0.0, fail_status=503, model_latency=None,
+                      fail_first=0):
+    """Serve in a daemon thread; returns the server (`.base_url`, `.requests`, `.shutdown()`)"""
+    server = ThreadingHTTPServer((host, port), StubLLMHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.token_latency = token_latency
+    server.tokens_per_minute = tokens_per_minute
+    server.fail_rate = fail_rate
+    server.fail_status = fail_status
+    server.fail_first = fail_first
+    server.model_latency = model_latency or {}
+    server.windows = {}     # model -> [window start, tokens used]
+    server.calls = {}       # (model, status) -> count
+    server.requests = 0
+    server.lock = threading.Lock()
+    server.base_url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, name="stub-llm", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per streamed word")
+    parser.add_argument("--tpm", type=int, default=None, help="tokens per minute per model (429 beyond)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered 503")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.latency, args.token_latency, port=args.port,
+                               tokens_per_minute=args.tpm, fail_rate=args.fail_rate)
+    print(f"🤖 Stub LLM on {server.base_url} (latency {args.latency}s) — Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,118 @@
+"""
+Token-budgeted context packing for Charak Samhita AI
+
+Turns the ranked chunks from retrieval into the passages sent to Groq:
+
+1. drop chunks whose cosine distance is above MAX_DISTANCE, and cut at
+   the "elbow" — the first similarity drop of at least ELBOW_GAP — so
+   weak matches don't ride along with strong ones
+2. merge hits that are consecutive chunks (chunk_index i, i+1, …) of the
+   same page into one passage, removing the words step2 repeated as
+   overlap between them
+3. add passages best-first while they fit in the token budget
+
+Chunks without a distance (BM25-only hits in hybrid mode) skip step 1;
+their position in the fused ranking still orders them. Token counts are
+an estimate (about 4 characters per token for Llama-family tokenizers),
+which is all the budget needs.
+"""
+
+import math
+
+TOKEN_BUDGET = 1800        # prompt tokens spent on passages
+MAX_DISTANCE = 0.75        # cosine distance; MiniLM similarity < 0.25 is noise
+ELBOW_GAP = 0.1            # similarity drop that ends the useful run
+MIN_PASSAGES = 1           # always keep the best passage, however weak
+MAX_OVERLAP_WORDS = 120    # longest overlap looked for between neighbours
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def strip_overlap(previous, following, max_words=MAX_OVERLAP_WORDS):
+    """`following` minus its longest word prefix that ends `previous`"""
+    prev_words, next_words = previous.split(), following.split()
+    for n in range(min(len(prev_words), len(next_words), max_words), 0, -1):
+        if prev_words[-n:] == next_words[:n]:
+            return " ".join(next_words[n:])
+    return following
+
+
+def select(candidates, max_distance=MAX_DISTANCE, elbow_gap=ELBOW_GAP, min_keep=MIN_PASSAGES):
+    """Candidates above the distance cutoff and the similarity elbow, in rank order"""
+    similarities = sorted((1.0 - c["distance"] for c in candidates if c.get("distance") is not None),
+                          reverse=True)
+    floor = 1.0 - max_distance
+    for higher, lower in zip(similarities, similarities[1:]):
+        if higher - lower >= elbow_gap:
+            floor = max(floor, higher)
+            break
+
+    kept = [c for c in candidates
+            if c.get("distance") is None or 1.0 - c["distance"] >= floor]
+    return kept if len(kept) >= min_keep else candidates[:min_keep]
+
+
+def merge_adjacent(candidates):
+    """Group consecutive chunk_index hits of one title into passages (rank of best member)"""
+    by_page = {}
+    for rank, candidate in enumerate(candidates):
+        meta = candidate.get("metadata") or {}
+        key = meta.get("title", "Charak Samhita")
+        by_page.setdefault(key, []).append((meta.get("chunk_index"), rank, candidate))
+
+    passages = []
+    for title, hits in by_page.items():
+        hits.sort(key=lambda h: -1 if h[0] is None else h[0])
+        run = []
+        for index, rank, candidate in hits:
+            if run and (index is None or run[-1][0] is None or index != run[-1][0] + 1):
+                passages.append(_passage(title, run))
+                run = []
+            run.append((index, rank, candidate))
+        if run:
+            passages.append(_passage(title, run))
+    return sorted(passages, key=lambda p: p["rank"])
+
+
+def _passage(title, run):
+    text = run[0][2]["text"]
+    for _, _, candidate in run[1:]:
+        rest = strip_overlap(text, candidate["text"])
+        if rest:
+            text = f"{text} {rest}"
+    return {
+        "title": title,
+        "ids": [c["id"] for _, _, c in run],
+        "chunk_indices": [i for i, _, _ in run],
+        "rank": min(r for _, r, _ in run),
+        "text": text,
+        "tokens": estimate_tokens(text),
+    }
+
+
+def _truncate(passage, budget):
+    words = passage["text"].split()
+    keep = max(1, int(len(words) * budget / max(passage["tokens"], 1)))
+    text = " ".join(words[:keep])
+    return {**passage, "text": text, "tokens": estimate_tokens(text)}
+
+
+def pack(candidates, budget=TOKEN_BUDGET, **select_options):
+    """Passages to send, best first, whose estimated tokens fit `budget`.
+
+    `candidates` are rank-ordered dicts: {"id", "text", "metadata", "distance"}.
+    """
+    passages = merge_adjacent(select(candidates, **select_options))
+    packed, used = [], 0
+    for passage in passages:
+        if used + passage["tokens"] <= budget:
+            packed.append(passage)
+            used += passage["tokens"]
+        elif not packed:
+            # The best passage alone is too long: send as much of it as fits
+            packed.append(_truncate(passage, budget))
+            used = packed[0]["tokens"]
+    return packed
@@ -0,0 +1,335 @@
+"""
+Shared embedding-model sidecar for Charak Samhita AI
+Run: python embed_server.py                           # ./charak_embed.sock
+     python embed_server.py --socket /run/charak/embed.sock --max-batch 64 --max-wait-ms 5
+     CHARAK_EMBED_SOCKET=./charak_embed.sock streamlit run app.py
+
+Loads the question encoder once and serves every rag_engine process on
+the machine over a Unix socket, instead of each Streamlit worker holding
+its own copy. Encode requests that arrive together are run as one
+micro-batch: the batcher takes the first waiting request, then keeps
+adding requests until MAX_BATCH_SIZE texts or MAX_WAIT_MS have passed.
+
+Wire format, both directions: a 4-byte big-endian length, then a body.
+
+    request    {"texts": [...], "model": <cache namespace>}        (JSON)
+    response   {"rows": n, "dim": d} + n*d float32 bytes           (JSON, raw)
+               {"error": "..."}                                    (JSON)
+
+`model` must match the server's, so a client never mixes vectors from
+another model or runtime into its embedding cache. `RemoteEmbedder` is
+the client; rag_engine wraps it in `FallbackEmbedder`, which encodes in
+process while the server is unreachable and tries it again RETRY_S later.
+"""
+
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+from metrics import REGISTRY
+
+EMBED_SOCKET = "./charak_embed.sock"
+MAX_BATCH_SIZE = int(os.environ.get("CHARAK_EMBED_MAX_BATCH", "64"))
+MAX_WAIT_MS = float(os.environ.get("CHARAK_EMBED_MAX_WAIT_MS", "5"))
+CLIENT_TIMEOUT_S = 10.0
+RETRY_S = 30.0              # after a failure, encode in process this long before retrying the server
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+
+_LENGTH = struct.Struct(">I")
+
+
+class EmbedServerError(Exception):
+    """The server answered with an error (e.g. a different model)"""
+
+
+# ── Framing ─────────────────────────────────────────────────────────────────
+def _recv_exact(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        part = sock.recv(n - len(data))
+        if not part:
+            raise ConnectionError("embedding server connection closed")
+        data += part
+    return bytes(data)
+
+
+def send_frame(sock, body):
+    sock.sendall(_LENGTH.pack(len(body)) + body)
+
+
+def recv_frame(sock):
+    (length,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    if length > MAX_FRAME_BYTES:
+        raise ConnectionError(f"frame of {length} bytes is over the {MAX_FRAME_BYTES} limit")
+    return _recv_exact(sock, length)
+
+
+# ── Server ──────────────────────────────────────────────────────────────────
+class _Request:
+    def __init__(self, texts):
+        self.texts = texts
+        self.queued = time.perf_counter()
+        self.done = threading.Event()
+        self.vectors = None
+        self.error = None
+
+
+class MicroBatcher:
+    """One thread running queued encode requests through the model in batches"""
+
+    def __init__(self, model, max_batch=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, metrics=REGISTRY):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.metrics = metrics
+        self._queue = queue.Queue()
+        self._held = None           # request that did not fit the previous batch
+        self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def encode(self, texts):
+        """float32 rows for `texts`, encoded together with whatever else is waiting"""
+        request = _Request(list(texts))
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.vectors
+
+    def _collect(self):
+        """Requests for the next batch: at most max_batch texts, or one bigger request"""
+        first = self._held or self._queue.get()
+        self._held = None
+        batch, size = [first], len(first.texts)
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if size + len(request.texts) > self.max_batch:
+                self._held = request
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for request in batch for text in request.texts]
+            started = time.perf_counter()
+            for request in batch:
+                self.metrics.observe("charak_embed_wait_seconds", started - request.queued)
+            try:
+                vectors = np.asarray(self.model.encode(texts, batch_size=max(len(texts), 1)),
+                                     dtype=np.float32)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+            self.metrics.observe("charak_stage_duration_seconds", time.perf_counter() - started,
+                                 stage="embed_batch")
+            self.metrics.inc("charak_embed_batches_total")
+            self.metrics.inc("charak_embed_texts_total", len(texts))
+            start = 0
+            for request in batch:
+                request.vectors = vectors[start:start + len(request.texts)]
+                start += len(request.texts)
+                request.done.set()
+
+
+class EmbedHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # One connection carries many requests; the client keeps it open
+        while True:
+            try:
+                payload = json.loads(recv_frame(self.request))
+            except (ConnectionError, OSError):
+                return
+            except ValueError:
+                send_frame(self.request, b'{"error": "request is not valid JSON"}')
+                return
+            try:
+                for frame in self._answer(payload):
+                    send_frame(self.request, frame)
+            except OSError:
+                return
+
+    def _answer(self, payload):
+        """Response frames for one request"""
+        def error(message):
+            return [json.dumps({"error": message}).encode("utf-8")]
+
+        if not isinstance(payload, dict) or payload.get("model") != self.server.namespace:
+            model = payload.get("model") if isinstance(payload, dict) else None
+            return error(f"server encodes with {self.server.namespace!r}, not {model!r}")
+        texts = payload.get("texts")
+        if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+            return error("'texts' must be a list of strings")
+        try:
+            vectors = self.server.batcher.encode(texts) if texts else np.empty((0, 0), np.float32)
+        except Exception as e:
+            return error(f"encode failed: {e}")
+        header = {"rows": vectors.shape[0], "dim": vectors.shape[1]}
+        return [json.dumps(header).encode("utf-8"), vectors.tobytes()]
+
+
+class EmbedServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128    # every worker thread of every client may connect at once
+
+    def __init__(self, path, model, namespace, max_batch=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        if os.path.exists(path):
+            os.unlink(path)          # left over from a server that did not shut down cleanly
+        super().__init__(path, EmbedHandler)
+        self.path = path
+        self.namespace = namespace
+        self.batcher = MicroBatcher(model, max_batch, max_wait_ms)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+# ── Client ──────────────────────────────────────────────────────────────────
+class RemoteEmbedder:
+    """`encode` like sentence-transformers, answered by an EmbedServer"""
+
+    def __init__(self, path, namespace, timeout=CLIENT_TIMEOUT_S):
+        self.path = path
+        self.namespace = namespace
+        self.timeout = timeout
+        self._idle = []             # open connections not in use
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def encode(self, sentences, batch_size=None, show_progress_bar=False, **_):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        request = json.dumps({"texts": texts, "model": self.namespace}, ensure_ascii=False)
+
+        sock = self._connect()
+        try:
+            send_frame(sock, request.encode("utf-8"))
+            header = json.loads(recv_frame(sock))
+            if "error" in header:
+                raise EmbedServerError(header["error"])
+            data = recv_frame(sock)
+            vectors = np.frombuffer(data, dtype=np.float32).reshape(header["rows"], header["dim"])
+        except BaseException:
+            sock.close()             # the stream may be mid-frame; never reuse it
+            raise
+        with self._lock:
+            self._idle.append(sock)
+        return vectors[0] if single else vectors
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock in idle:
+            sock.close()
+
+
+class FallbackEmbedder:
+    """RemoteEmbedder, or the in-process model while the server is unreachable.
+
+    The local model is loaded by `load_local` on the first failure only, so
+    a process whose server stays up never holds its own copy.
+    """
+
+    def __init__(self, remote, load_local, retry_s=RETRY_S, metrics=REGISTRY):
+        self.remote = remote
+        self.load_local = load_local
+        self.retry_s = retry_s
+        self.metrics = metrics
+        self._local = None
+        self._lock = threading.Lock()
+        self._retry_at = 0.0
+
+    @property
+    def local(self):
+        if self._local is None:
+            with self._lock:
+                if self._local is None:
+                    self._local = self.load_local()
+        return self._local
+
+    def encode(self, sentences, **kwargs):
+        if time.monotonic() >= self._retry_at:
+            try:
+                vectors = self.remote.encode(sentences, **kwargs)
+                self.metrics.inc("charak_embed_calls_total", result="remote")
+                return vectors
+            except (OSError, ValueError, EmbedServerError) as e:
+                if not self._retry_at:
+                    print(f"WARNING: embedding server at {self.remote.path} unavailable ({e}); "
+                          f"encoding in process")
+                self._retry_at = time.monotonic() + self.retry_s
+        self.metrics.inc("charak_embed_calls_total", result="local")
+        return self.local.encode(sentences, **kwargs)
+
+
+def serve(path=EMBED_SOCKET, max_batch=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, model=None,
+          embedding_model=None, runtime=None, onnx_dir=None, threads=None):
+    """Load the model (unless given) and return the server (call `serve_forever()` on it)"""
+    from onnx_embedder import cache_namespace, load_embedder
+    from rag_engine import EMBEDDING_MODEL, EMBEDDING_RUNTIME, EMBEDDING_THREADS, ONNX_MODEL_DIR
+
+    embedding_model = embedding_model or EMBEDDING_MODEL
+    runtime = runtime or EMBEDDING_RUNTIME
+    if model is None:
+        print(f"Loading embedding model: {embedding_model} ({runtime})")
+        model = load_embedder(embedding_model, runtime, onnx_dir=onnx_dir or ONNX_MODEL_DIR,
+                              threads=threads or EMBEDDING_THREADS)
+        model.encode(["warm up"])
+    return EmbedServer(path, model, cache_namespace(embedding_model, runtime), max_batch, max_wait_ms)
+
+
+if __name__ == "__main__":
+    from metrics import serve_metrics
+    from onnx_embedder import RUNTIMES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=os.environ.get("CHARAK_EMBED_SOCKET") or EMBED_SOCKET)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH_SIZE, help="texts per model call")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS,
+                        help="longest a request waits for others to share its batch")
+    parser.add_argument("--runtime", choices=RUNTIMES, default=None, help="embedding runtime (default: rag_engine's)")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve /metrics on this port")
+    args = parser.parse_args()
+
+    server = serve(args.socket, args.max_batch, args.max_wait_ms, runtime=args.runtime)
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    print(f"🧠 Embedding server on {args.socket} ({server.namespace}, batches of ≤{args.max_batch} "
+          f"texts, ≤{args.max_wait_ms:g} ms wait)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
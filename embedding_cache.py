@@ -0,0 +1,139 @@
+"""
+Persistent embedding cache for Charak Samhita AI
+
+Shared by step3_embed.py (chunk texts) and rag_engine (questions) so that
+identical text is never pushed through the embedding model twice. Vectors
+live in a SQLite file keyed by (model name, sha256(text)); WAL mode lets a
+build and several app workers use the same file at once. Only corpus
+chunks are written to it, so its size follows the corpus: questions are
+looked up there but kept only in a bounded in-process LRU, and a question
+miss never commits on the request path.
+
+Counters (`stats()`):
+    lru_hits    served from the in-process LRU
+    disk_hits   served from SQLite
+    misses      had to be encoded
+"""
+
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path, model_name, lru_size=1024):
+        self.path = path
+        self.model_name = model_name
+        self.lru_size = lru_size
+        self.lru_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()
+        self._db = None
+        if path:
+            try:
+                self._db = self._open_db(path)
+            except sqlite3.Error as e:
+                # e.g. read-only deploy directory: still useful as a pure LRU
+                print(f"WARNING: embedding cache {path} unavailable ({e}); using memory only")
+
+    @staticmethod
+    def _open_db(path):
+        db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                key TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, key)
+            ) WITHOUT ROWID""")
+        db.commit()
+        return db
+
+    # -- disk layer ----------------------------------------------------
+    def get_many(self, texts):
+        """Cached vectors for `texts` (None where missing); counts disk hits/misses"""
+        found = {}
+        keys = [text_key(t) for t in texts]
+        if self._db is not None:
+            unique = list(dict.fromkeys(keys))
+            with self._lock:
+                for start in range(0, len(unique), 500):
+                    part = unique[start:start + 500]
+                    rows = self._db.execute(
+                        "SELECT key, vector FROM embeddings WHERE model = ? AND key IN (%s)"
+                        % ",".join("?" * len(part)), [self.model_name, *part]
+                    ).fetchall()
+                    found.update({key: np.frombuffer(blob, dtype=np.float32) for key, blob in rows})
+
+        vectors = [found.get(k) for k in keys]
+        hits = sum(v is not None for v in vectors)
+        with self._lock:
+            self.disk_hits += hits
+            self.misses += len(vectors) - hits
+        return vectors
+
+    def put_many(self, texts, embeddings):
+        if self._db is None:
+            return
+        rows = [(self.model_name, text_key(t), np.asarray(e, dtype=np.float32).tobytes())
+                for t, e in zip(texts, embeddings)]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._db.commit()
+
+    def encode(self, encode_fn, texts, persist=True):
+        """encode_fn(texts) that only encodes texts missing from the cache
+
+        `persist=False` leaves the newly encoded vectors out of SQLite.
+        """
+        vectors = self.get_many(texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            fresh = encode_fn([texts[i] for i in missing])
+            if persist:
+                self.put_many([texts[i] for i in missing], fresh)
+            for i, vec in zip(missing, fresh):
+                vectors[i] = np.asarray(vec, dtype=np.float32)
+        return np.vstack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+
+    # -- query layer ---------------------------------------------------
+    def encode_queries(self, encode_fn, texts):
+        """Questions: LRU, then one SQLite lookup and one model call for the rest.
+
+        Newly encoded questions go to the LRU only, never to SQLite.
+        """
+        vectors = [None] * len(texts)
+        with self._lock:
+            for i, text in enumerate(texts):
+                vec = self._lru.get(text)
+                if vec is not None:
+                    self._lru.move_to_end(text)
+                    self.lru_hits += 1
+                    vectors[i] = vec
+
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            fresh = self.encode(encode_fn, [texts[i] for i in missing], persist=False)
+            with self._lock:
+                for i, vec in zip(missing, fresh):
+                    vectors[i] = vec
+                    self._lru[texts[i]] = vec
+                while len(self._lru) > self.lru_size:
+                    self._lru.popitem(last=False)
+        return vectors
+
+    def stats(self):
+        with self._lock:
+            return {"lru_hits": self.lru_hits, "disk_hits": self.disk_hits,
+                    "misses": self.misses, "lru_size": len(self._lru)}
@@ -0,0 +1,309 @@
+"""
+Pooled, rate-limit-aware Groq access for Charak Samhita AI
+
+One `GroqPool` per process owns a single Groq SDK client on a keep-alive
+httpx connection pool, so questions reuse warm TLS connections instead of
+building a client each time. Every call goes through it:
+
+1. a token bucket per model and limit (requests, tokens), re-synced from
+   the x-ratelimit-* headers Groq sends back, holds a call until the
+   model has budget for it; a 429's retry-after empties the bucket
+2. transient failures (429, 5xx, timeouts, dropped connections) are
+   retried with full-jitter exponential backoff, all within DEADLINE_S
+3. when the primary model is saturated (no budget within MAX_QUEUE_WAIT_S
+   or rate-limited) or its recent latency is over LATENCY_SLO_S, the call
+   goes to FALLBACK_MODEL instead
+
+Only when every model fails before the deadline does `LLMUnavailable`
+reach the caller; rag_engine then answers with the retrieved passages.
+Streaming calls are retried only until the response headers arrive.
+"""
+
+import os
+import random
+import re
+import threading
+import time
+
+from context_packer import estimate_tokens
+
+FALLBACK_MODEL = os.environ.get("CHARAK_GROQ_FALLBACK_MODEL", "llama-3.1-8b-instant")
+
+MAX_CONNECTIONS = 32
+KEEPALIVE_CONNECTIONS = 16
+KEEPALIVE_EXPIRY_S = 60.0
+CONNECT_TIMEOUT_S = 5.0
+
+DEADLINE_S = float(os.environ.get("CHARAK_LLM_DEADLINE", "30"))        # per question, all attempts
+LATENCY_SLO_S = float(os.environ.get("CHARAK_LLM_SLO", "10"))          # primary EWMA above → fallback
+LATENCY_WINDOW_S = 60.0     # latency older than this is forgotten, so the primary gets retried
+LATENCY_ALPHA = 0.3         # EWMA weight of the newest sample
+MAX_QUEUE_WAIT_S = 2.0      # longest wait for rate-limit budget before falling back
+ATTEMPTS_PER_MODEL = 3
+BACKOFF_BASE_S = 0.25
+BACKOFF_CAP_S = 4.0
+COMPLETION_TOKENS_ESTIMATE = 400   # reserved per call until Groq's headers correct it
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNIT_S = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class LLMUnavailable(Exception):
+    """No model answered within the deadline; `errors` lists what each attempt hit"""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors) or "no model available")
+        self.errors = errors
+
+
+def parse_duration(value):
+    """Seconds in a Groq reset header ("2m59.56s", "7.66s", "120ms"), None if unparsable"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    return sum(float(n) * _UNIT_S[unit] for n, unit in parts) if parts else None
+
+
+class TokenBucket:
+    """Client-side mirror of one Groq rate limit.
+
+    Unknown until the first response: Groq reports the limit, what is left
+    and when it is full again, which fixes capacity, level and refill rate.
+    Calls reserve budget up front so concurrent threads don't all spend
+    the same remainder.
+    """
+
+    def __init__(self):
+        self.capacity = None
+        self.level = 0.0
+        self.rate = 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def sync(self, limit, remaining, reset_s, now):
+        if limit is None or remaining is None:
+            return
+        self.capacity = float(limit)
+        self.level = float(remaining)
+        # A full bucket reports nothing missing; still refill at the limit's pace,
+        # or reservations taken before the next response would lock it out for good
+        missing = (self.capacity - self.level) or self.capacity
+        self.rate = missing / reset_s if reset_s else self.capacity
+        self.updated = now
+
+    def drain(self, seconds, now):
+        """Server said no: nothing left for `seconds`"""
+        if self.capacity is None:
+            self.capacity = 1.0
+        self._refill(now)
+        self.level = 0.0
+        self.rate = max(self.rate, self.capacity / max(seconds, 1e-3))
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` is available (0 if now or limit unknown)"""
+        if self.capacity is None:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate if self.rate else float("inf")
+
+    def take(self, amount):
+        if self.capacity is not None:
+            self.level -= min(amount, self.capacity)
+
+
+class ModelState:
+    """Rate-limit buckets and recent latency of one model"""
+
+    def __init__(self):
+        self.requests = TokenBucket()
+        self.tokens = TokenBucket()
+        self.latency = None
+        self.latency_at = 0.0
+
+    def wait_time(self, tokens, now):
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def reserve(self, tokens):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+    def sync(self, headers, now):
+        def number(name):
+            value = headers.get(name)
+            try:
+                return float(value) if value is not None else None
+            except ValueError:
+                return None
+
+        for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+            bucket.sync(number(f"x-ratelimit-limit-{kind}"), number(f"x-ratelimit-remaining-{kind}"),
+                        parse_duration(headers.get(f"x-ratelimit-reset-{kind}")), now)
+
+    def record_latency(self, seconds, now):
+        if self.latency is None or now - self.latency_at > LATENCY_WINDOW_S:
+            self.latency = seconds
+        else:
+            self.latency += LATENCY_ALPHA * (seconds - self.latency)
+        self.latency_at = now
+
+    def over_slo(self, slo, now):
+        return (self.latency is not None and now - self.latency_at <= LATENCY_WINDOW_S
+                and self.latency > slo)
+
+
+def _status(error):
+    return getattr(error, "status_code", None)
+
+
+def _retryable(error):
+    import groq
+
+    if isinstance(error, (groq.APITimeoutError, groq.APIConnectionError)):
+        return True
+    return _status(error) in RETRYABLE_STATUS
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = response.headers if response is not None else {}
+    return (parse_duration(headers.get("retry-after"))
+            or parse_duration(headers.get("x-ratelimit-reset-tokens"))
+            or parse_duration(headers.get("x-ratelimit-reset-requests")))
+
+
+class GroqPool:
+    """Process-wide Groq client with rate limiting, retries and model fallback"""
+
+    def __init__(self, primary, fallback=FALLBACK_MODEL, api_key=None, base_url=None,
+                 deadline=DEADLINE_S, latency_slo=LATENCY_SLO_S, max_connections=MAX_CONNECTIONS,
+                 metrics=None):
+        self.primary = primary
+        self.fallback = fallback if fallback and fallback != primary else None
+        self.api_key = api_key
+        self.base_url = base_url
+        self.deadline = deadline
+        self.latency_slo = latency_slo
+        self.max_connections = max_connections
+        self.metrics = metrics
+        self._client = None
+        self._lock = threading.Lock()
+        self._states = {}
+
+    @property
+    def client(self):
+        """The shared Groq SDK client (SDK retries off; this class retries)"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import httpx
+                    from groq import Groq
+                    http_client = httpx.Client(
+                        limits=httpx.Limits(max_connections=self.max_connections,
+                                            max_keepalive_connections=KEEPALIVE_CONNECTIONS,
+                                            keepalive_expiry=KEEPALIVE_EXPIRY_S),
+                        timeout=httpx.Timeout(self.deadline, connect=CONNECT_TIMEOUT_S),
+                    )
+                    self._client = Groq(api_key=self.api_key or os.environ.get("GROQ_API_KEY", ""),
+                                        base_url=self.base_url, max_retries=0,
+                                        http_client=http_client)
+        return self._client
+
+    def state(self, model):
+        with self._lock:
+            return self._states.setdefault(model, ModelState())
+
+    def models(self, now=None):
+        """Models to try in order: the primary first unless it is over its SLO"""
+        if self.fallback is None:
+            return [self.primary]
+        now = time.monotonic() if now is None else now
+        if self.state(self.primary).over_slo(self.latency_slo, now):
+            return [self.fallback, self.primary]
+        return [self.primary, self.fallback]
+
+    def _count(self, model, result):
+        if self.metrics is not None:
+            self.metrics.inc("charak_llm_calls_total", model=model, result=result)
+
+    def _call(self, messages, params, stream):
+        """(parsed response or stream, model); raises LLMUnavailable"""
+        started = time.monotonic()
+        deadline = started + self.deadline
+        tokens = (sum(estimate_tokens(m.get("content") or "") for m in messages)
+                  + min(params.get("max_tokens") or COMPLETION_TOKENS_ESTIMATE, COMPLETION_TOKENS_ESTIMATE))
+        errors = []
+
+        order = self.models(started)
+        for position, model in enumerate(order):
+            state = self.state(model)
+            last = position == len(order) - 1
+            for attempt in range(ATTEMPTS_PER_MODEL):
+                now = time.monotonic()
+                with self._lock:
+                    wait = state.wait_time(tokens, now)
+                    if not last and wait > MAX_QUEUE_WAIT_S:
+                        break            # saturated: the next model answers sooner
+                    if now + wait >= deadline:
+                        errors.append(f"{model}: no rate-limit budget before the deadline")
+                        break
+                    state.reserve(tokens)
+                if wait:
+                    time.sleep(wait)
+
+                sent = time.monotonic()
+                try:
+                    raw = self.client.with_options(timeout=max(deadline - sent, 0.1)) \
+                        .chat.completions.with_raw_response.create(
+                            model=model, messages=messages, stream=stream, **params)
+                    now = time.monotonic()
+                    with self._lock:
+                        state.sync(raw.headers, now)
+                        state.record_latency(now - sent, now)
+                    self._count(model, "ok")
+                    return raw.parse(), model
+                except Exception as e:
+                    now = time.monotonic()
+                    errors.append(f"{model}: {e}")
+                    if not _retryable(e):
+                        self._count(model, "error")
+                        if _status(e) in (401, 403):
+                            raise LLMUnavailable(errors) from e   # no model will accept this key
+                        break
+                    rate_limited = _status(e) == 429
+                    self._count(model, "rate_limited" if rate_limited else "retry")
+                    with self._lock:
+                        if rate_limited:
+                            wait = _retry_after(e) or BACKOFF_CAP_S
+                            state.requests.drain(wait, now)
+                            state.tokens.drain(wait, now)
+                        else:
+                            state.record_latency(now - sent, now)   # timeouts count against the SLO
+                    if rate_limited and not last:
+                        break            # don't queue behind a 429; use the other model
+                    backoff = random.uniform(0, min(BACKOFF_CAP_S, BACKOFF_BASE_S * 2 ** attempt))
+                    if now + backoff >= deadline:
+                        break
+                    time.sleep(backoff)
+            if time.monotonic() >= deadline:
+                break
+        raise LLMUnavailable(errors)
+
+    def complete(self, messages, **params):
+        """(chat completion, model that answered)"""
+        return self._call(messages, params, stream=False)
+
+    def stream(self, messages, **params):
+        """(iterator of completion chunks, model that answered)"""
+        return self._call(messages, params, stream=True)
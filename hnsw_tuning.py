@@ -0,0 +1,166 @@
+"""
+HNSW parameter sweep for Charak Samhita AI
+Run: python step3_embed.py --hnsw-sweep     # sweep, pick, then --rebuild to apply
+
+Builds hnswlib indexes (the library Chroma uses underneath) over the
+stored embeddings for every combination of M, construction_ef and
+search_ef, and measures against exact brute-force search:
+
+    recall@k      overlap with the true top k
+    latency       single-query knn time on one thread (ms, p50 / p95)
+    size          bytes of the saved index
+    build time    seconds to insert every vector
+
+Queries are midpoints of random pairs of stored vectors, so no query is
+itself in the index. The Pareto front over (recall ↑, p50 latency ↓,
+size ↓) is printed and saved; the chosen point — the fastest on the front
+that reaches TARGET_RECALL — goes to PARAMS_FILE, which step3_embed.py
+applies as collection metadata on the next --rebuild and rag_engine reads
+back from the collection.
+"""
+
+import itertools
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+SWEEP_FILE = "charak_hnsw_sweep.json"
+PARAMS_FILE = "charak_hnsw_params.json"
+
+M_GRID = [8, 16, 32, 48]
+CONSTRUCTION_EF_GRID = [100, 200, 400]
+SEARCH_EF_GRID = [10, 20, 50, 100, 200]
+SWEEP_QUERIES = 200
+SWEEP_TOP_K = 20            # rag_engine asks for HYBRID_CANDIDATES in hybrid mode
+TARGET_RECALL = 0.98
+
+# Chroma's defaults, i.e. what an untuned collection runs with
+CHROMA_DEFAULTS = {"hnsw:M": 16, "hnsw:construction_ef": 100, "hnsw:search_ef": 10}
+
+
+def make_queries(vectors, n=SWEEP_QUERIES, seed=0):
+    """Normalised midpoints of random pairs of rows"""
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, len(vectors), size=(n, 2))
+    queries = vectors[pairs[:, 0]] + vectors[pairs[:, 1]]
+    return queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+
+def exact_top_k(vectors, queries, k):
+    scores = queries @ vectors.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row) for row in top.tolist()]
+
+
+def _build(vectors, m, construction_ef):
+    import hnswlib
+
+    index = hnswlib.Index(space="cosine", dim=vectors.shape[1])
+    index.init_index(max_elements=len(vectors), M=m, ef_construction=construction_ef)
+    started = time.perf_counter()
+    index.add_items(vectors, np.arange(len(vectors)))
+    return index, time.perf_counter() - started
+
+
+def _index_size(index):
+    with tempfile.TemporaryDirectory(prefix="charak_hnsw_") as scratch:
+        path = os.path.join(scratch, "index.bin")
+        index.save_index(path)
+        return os.path.getsize(path)
+
+
+def sweep(vectors, m_grid=M_GRID, construction_ef_grid=CONSTRUCTION_EF_GRID,
+          search_ef_grid=SEARCH_EF_GRID, n_queries=SWEEP_QUERIES, k=SWEEP_TOP_K):
+    """One result dict per (M, construction_ef, search_ef)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    k = min(k, len(vectors))
+    queries = make_queries(vectors, n_queries)
+    truth = exact_top_k(vectors, queries, k)
+
+    results = []
+    for m, construction_ef in itertools.product(m_grid, construction_ef_grid):
+        index, build_s = _build(vectors, m, construction_ef)
+        size = _index_size(index)
+        index.set_num_threads(1)   # one query per request, as in rag_engine
+        for search_ef in search_ef_grid:
+            index.set_ef(max(search_ef, k))
+            latencies, hits = [], 0
+            for query, want in zip(queries, truth):
+                started = time.perf_counter()
+                labels, _ = index.knn_query(query[None, :], k=k)
+                latencies.append((time.perf_counter() - started) * 1000)
+                hits += len(want & set(labels[0].tolist()))
+            results.append({
+                "hnsw:M": m, "hnsw:construction_ef": construction_ef, "hnsw:search_ef": search_ef,
+                "recall": round(hits / (k * len(queries)), 4),
+                "latency_p50_ms": round(float(np.percentile(latencies, 50)), 4),
+                "latency_p95_ms": round(float(np.percentile(latencies, 95)), 4),
+                "size_bytes": size,
+                "build_s": round(build_s, 2),
+            })
+            print(f"  M={m:<3d} construction_ef={construction_ef:<4d} search_ef={search_ef:<4d} "
+                  f"recall@{k} {results[-1]['recall']:.4f}  p50 {results[-1]['latency_p50_ms']:.3f} ms  "
+                  f"{size / 1e6:.1f} MB")
+    return results
+
+
+def pareto_front(results):
+    """Points no other point beats on recall, latency and size at once"""
+    def dominates(a, b):
+        better_or_equal = (a["recall"] >= b["recall"] and a["latency_p50_ms"] <= b["latency_p50_ms"]
+                           and a["size_bytes"] <= b["size_bytes"])
+        strictly = (a["recall"] > b["recall"] or a["latency_p50_ms"] < b["latency_p50_ms"]
+                    or a["size_bytes"] < b["size_bytes"])
+        return better_or_equal and strictly
+
+    front = [r for r in results if not any(dominates(o, r) for o in results)]
+    return sorted(front, key=lambda r: (-r["recall"], r["latency_p50_ms"]))
+
+
+def choose(front, target_recall=TARGET_RECALL):
+    """Fastest front point reaching the target, else the most accurate one"""
+    good = [r for r in front if r["recall"] >= target_recall]
+    if good:
+        return min(good, key=lambda r: (r["latency_p50_ms"], r["size_bytes"]))
+    return max(front, key=lambda r: r["recall"])
+
+
+def collection_params(point):
+    """The Chroma metadata keys of a sweep point"""
+    return {key: point[key] for key in CHROMA_DEFAULTS}
+
+
+def run_sweep(vectors, sweep_file=SWEEP_FILE, params_file=PARAMS_FILE, target_recall=TARGET_RECALL,
+              **grid):
+    results = sweep(vectors, **grid)
+    front = pareto_front(results)
+    chosen = choose(front, target_recall)
+
+    print(f"\n🏁 Pareto front ({len(front)} of {len(results)} points):")
+    for r in front:
+        marker = "  ← chosen" if r is chosen else ""
+        print(f"  M={r['hnsw:M']:<3d} construction_ef={r['hnsw:construction_ef']:<4d} "
+              f"search_ef={r['hnsw:search_ef']:<4d} recall {r['recall']:.4f}  "
+              f"p50 {r['latency_p50_ms']:.3f} ms  {r['size_bytes'] / 1e6:.1f} MB{marker}")
+
+    with open(sweep_file, "w", encoding="utf-8") as f:
+        json.dump({"vectors": len(vectors), "target_recall": target_recall,
+                   "results": results, "front": front, "chosen": chosen}, f, indent=2)
+    with open(params_file, "w", encoding="utf-8") as f:
+        json.dump({**collection_params(chosen), "recall": chosen["recall"],
+                   "latency_p50_ms": chosen["latency_p50_ms"]}, f, indent=2)
+    print(f"\n✅ Sweep saved to {sweep_file}; chosen params → {params_file} "
+          f"(apply with step3_embed.py --rebuild)")
+    return chosen
+
+
+def load_params(params_file=PARAMS_FILE):
+    """Chosen hnsw:* collection metadata, or {} when no sweep was run"""
+    if not os.path.exists(params_file):
+        return {}
+    with open(params_file, "r", encoding="utf-8") as f:
+        return collection_params(json.load(f))
@@ -0,0 +1,158 @@
+"""
+Request metrics for Charak Samhita AI
+
+rag_engine attaches per-stage timings, Groq token usage and cache flags to
+every result; `observe_result` folds those into process-wide counters and
+histograms, and `serve_metrics` exposes them in the Prometheus text format
+on a local port (GET /metrics). Stdlib only.
+
+    charak_requests_total{outcome}              answered | cache_hit | degraded | error | unavailable
+                                                | coalesced (shared another ask's result)
+    charak_stage_duration_seconds{stage}        embed, search, prompt, llm_ttft, llm_total, total,
+                                                embed_batch (embed_server.py model call)
+    charak_llm_tokens_total{type}               prompt | completion
+    charak_cache_lookups_total{cache,result}    answer / embedding × hit / miss
+    charak_llm_calls_total{model,result}        ok | retry | rate_limited | error (groq_pool.py)
+    charak_http_requests_total{endpoint,status} server.py responses
+    charak_queue_wait_seconds                   server.py time waiting for a worker slot
+    charak_embed_calls_total{result}            remote | local (embed_server.py fallback)
+    charak_embed_batches_total                  embed_server.py model calls
+    charak_embed_texts_total                    texts in those calls (÷ batches = mean batch)
+    charak_embed_wait_seconds                   embed_server.py time waiting to join a batch
+"""
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    "charak_requests_total": ("counter", "Questions handled, by outcome"),
+    "charak_stage_duration_seconds": ("histogram", "Time spent per ask stage"),
+    "charak_llm_tokens_total": ("counter", "Tokens reported by the Groq usage field"),
+    "charak_cache_lookups_total": ("counter", "Answer / embedding cache lookups"),
+    "charak_llm_calls_total": ("counter", "Groq HTTP calls by model and result"),
+    "charak_http_requests_total": ("counter", "HTTP responses of server.py"),
+    "charak_queue_wait_seconds": ("histogram", "Time questions waited for a server.py worker"),
+    "charak_embed_calls_total": ("counter", "Question encodes by where they ran"),
+    "charak_embed_batches_total": ("counter", "Micro-batches run by embed_server.py"),
+    "charak_embed_texts_total": ("counter", "Texts encoded by embed_server.py"),
+    "charak_embed_wait_seconds": ("histogram", "Time encode requests waited to join a batch"),
+}
+
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Metrics:
+    """Thread-safe counters and fixed-bucket histograms"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}     # (name, labels) -> value
+        self._histograms = {}   # (name, labels) -> [bucket counts..., sum, count]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            state = self._histograms.get(key)
+            if state is None:
+                state = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            state[bisect.bisect_left(self.buckets, value)] += 1   # last slot = +Inf
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self):
+        """{"counters": {...}, "histograms": {...}} copies for display"""
+        with self._lock:
+            return {"counters": dict(self._counters),
+                    "histograms": {k: list(v) for k, v in self._histograms.items()}}
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        data = self.snapshot()
+        lines = []
+        names = sorted({n for n, _ in data["counters"]} | {n for n, _ in data["histograms"]})
+        for name in names:
+            kind, text = HELP.get(name, ("untyped", name))
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+            for (n, labels), value in sorted(data["counters"].items()):
+                if n == name:
+                    lines.append(f"{name}{_label_str(labels)} {value}")
+            for (n, labels), state in sorted(data["histograms"].items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip((*self.buckets, "+Inf"), state[:-2]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_label_str((*labels, ('le', bound)))} {cumulative}")
+                lines.append(f"{name}_sum{_label_str(labels)} {state[-2]:.6f}")
+                lines.append(f"{name}_count{_label_str(labels)} {state[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Metrics()
+
+
+def outcome(result):
+    if result.get("unavailable"):
+        return "unavailable"
+    if result.get("cache_hit"):
+        return "cache_hit"
+    if result.get("degraded"):
+        return "degraded"
+    if result.get("error"):
+        return "error"
+    return "answered"
+
+
+def observe_result(result, registry=REGISTRY):
+    """Fold one ask() result into the registry"""
+    registry.inc("charak_requests_total", outcome=outcome(result))
+    for stage, ms in (result.get("timings") or {}).items():
+        if ms is not None:
+            registry.observe("charak_stage_duration_seconds", ms / 1000, stage=stage.removesuffix("_ms"))
+    usage = result.get("usage") or {}
+    for kind in ("prompt", "completion"):
+        if usage.get(f"{kind}_tokens"):
+            registry.inc("charak_llm_tokens_total", usage[f"{kind}_tokens"], type=kind)
+    # None = no lookup happened (nothing was embedded / no chunks to key on)
+    for cache, key in (("answer", "cache_hit"), ("embedding", "embedding_cache_hit")):
+        if result.get(key) is not None:
+            registry.inc("charak_cache_lookups_total", cache=cache, result="hit" if result[key] else "miss")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_metrics(port, host="127.0.0.1", registry=REGISTRY):
+    """Serve GET /metrics from a daemon thread; returns the server"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name="charak-metrics", daemon=True).start()
+    print(f"Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,181 @@
+"""
+ONNX embedding runtime for Charak Samhita AI
+Run: python onnx_embedder.py export            # ./charak_onnx with fp32 + int8 models
+     python onnx_embedder.py parity            # compare against the PyTorch model
+
+Runs an exported all-MiniLM-L6-v2 (token embeddings → mean pooling → L2
+normalisation, the same pipeline as sentence-transformers) with
+onnxruntime and the `tokenizers` library, so neither torch nor
+transformers is imported at serve time. `export` needs them once, on the
+build machine, and also writes a dynamically int8-quantized copy.
+
+`load_embedder` picks the runtime ("torch", "onnx" or "onnx-int8") for
+rag_engine and step3_embed.py; all of them expose
+`encode(texts, batch_size=...)` returning float32 rows.
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+RUNTIMES = ("torch", "onnx", "onnx-int8")
+ONNX_MODEL_DIR = "./charak_onnx"
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+MAX_SEQ_LENGTH = 256          # all-MiniLM-L6-v2's max_seq_length
+PARITY_MIN_COSINE = 0.98      # per-text agreement required with the torch model (int8 included)
+
+PARITY_TEXTS = [
+    "What are the three doshas described in Charak Samhita?",
+    "Treatment of jwara (fever) according to Chikitsa Sthana",
+    "Vata dosha is responsible for movement and is aggravated by dry, cold and light qualities.",
+    "Rasayana therapy promotes longevity, memory, intelligence and freedom from disease.",
+    "Dinacharya",
+    "Agni governs digestion and metabolism; its impairment leads to the formation of ama.",
+]
+
+
+class OnnxEmbedder:
+    """sentence-transformers-compatible `encode` over an ONNX session"""
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=True, threads=None,
+                 max_length=MAX_SEQ_LENGTH, warm_up=True):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_file = QUANTIZED_MODEL_FILE if quantized else MODEL_FILE
+        self.model_path = os.path.join(model_dir, model_file)
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"{self.model_path} not found — run `python onnx_embedder.py export`")
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or 0   # 0 = onnxruntime picks (all cores)
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.model_path, options,
+                                            providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        if warm_up:
+            # First run allocates arenas and picks kernels; keep it off the first question
+            self.encode(["warm up"])
+
+    def _forward(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": ids, "attention_mask": mask,
+                 "token_type_ids": np.zeros_like(ids)}
+        hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self._inputs})[0]
+
+        # Mean over real tokens, then unit length
+        weights = mask[..., None].astype(np.float32)
+        pooled = (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, **_):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        # Length-sorted batches pad less; rows are put back in input order
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out = np.empty((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            vectors = self._forward([texts[i] for i in rows]).astype(np.float32)
+            if out.shape[1] == 0:
+                out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            out[rows] = vectors
+        return out[0] if single else out
+
+
+def load_embedder(model_name, runtime="torch", onnx_dir=ONNX_MODEL_DIR, threads=None):
+    """SentenceTransformer for runtime "torch", OnnxEmbedder for the ONNX ones"""
+    if runtime not in RUNTIMES:
+        raise ValueError(f"Unknown embedding runtime: {runtime!r} (expected one of {RUNTIMES})")
+    if runtime != "torch":
+        return OnnxEmbedder(onnx_dir, quantized=runtime == "onnx-int8", threads=threads)
+    from sentence_transformers import SentenceTransformer
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    return SentenceTransformer(model_name)
+
+
+def cache_namespace(model_name, runtime="torch"):
+    """Embedding-cache key: vectors from different runtimes are not mixed"""
+    return model_name if runtime == "torch" else f"{model_name}:{runtime}"
+
+
+def export_onnx(model_name, out_dir=ONNX_MODEL_DIR, quantize=True):
+    """Export the transformer to ONNX (+ int8 weights); needs torch, transformers, onnx"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    hub_name = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(hub_name)
+    model = AutoModel.from_pretrained(hub_name).eval()
+    tokenizer.backend_tokenizer.save(os.path.join(out_dir, TOKENIZER_FILE))
+
+    sample = tokenizer(["warm up"], return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    axes = {"batch": 0, "sequence": 1}
+    with torch.no_grad():
+        torch.onnx.export(
+            model, tuple(sample[n] for n in names), os.path.join(out_dir, MODEL_FILE),
+            input_names=names, output_names=["last_hidden_state"],
+            dynamic_axes={n: {v: k for k, v in axes.items()} for n in names + ["last_hidden_state"]},
+            opset_version=14,
+        )
+    print(f"✅ Exported {hub_name} → {os.path.join(out_dir, MODEL_FILE)}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(os.path.join(out_dir, MODEL_FILE),
+                         os.path.join(out_dir, QUANTIZED_MODEL_FILE),
+                         weight_type=QuantType.QInt8)
+        print(f"✅ Quantized (int8 weights) → {os.path.join(out_dir, QUANTIZED_MODEL_FILE)}")
+
+
+def parity_check(model_name, embedder, texts=PARITY_TEXTS, min_cosine=PARITY_MIN_COSINE):
+    """Cosine agreement of `embedder` with the PyTorch model; raises if below min_cosine"""
+    from sentence_transformers import SentenceTransformer
+
+    reference = SentenceTransformer(model_name).encode(texts, normalize_embeddings=True)
+    candidate = embedder.encode(texts)
+    cosines = np.sum(reference * candidate, axis=1)
+    report = {"min_cosine": float(cosines.min()), "mean_cosine": float(cosines.mean()),
+              "texts": len(texts)}
+    if report["min_cosine"] < min_cosine:
+        raise RuntimeError(f"ONNX embeddings diverge from {model_name}: min cosine "
+                           f"{report['min_cosine']:.4f} < {min_cosine}")
+    return report
+
+
+if __name__ == "__main__":
+    from rag_engine import EMBEDDING_MODEL
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("--dir", default=ONNX_MODEL_DIR, help=f"model directory (default {ONNX_MODEL_DIR})")
+    parser.add_argument("--no-quantize", action="store_true", help="export / check the fp32 model only")
+    parser.add_argument("--threads", type=int, default=None, help="onnxruntime intra-op threads")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(EMBEDDING_MODEL, args.dir, quantize=not args.no_quantize)
+    variants = [False] if args.no_quantize else [False, True]
+    for quantized in variants:
+        embedder = OnnxEmbedder(args.dir, quantized=quantized, threads=args.threads)
+        report = parity_check(EMBEDDING_MODEL, embedder)
+        print(f"🎯 Parity ({'int8' if quantized else 'fp32'}): min cosine {report['min_cosine']:.4f}, "
+              f"mean {report['mean_cosine']:.4f} over {report['texts']} texts")
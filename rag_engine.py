@@ -1,183 +1,889 @@
 """
 RAG Query Engine for Charak Samhita AI
 Uses Groq (completely free, no limits) for cloud deployment
+
+Importing this module is cheap: the embedding model, ChromaDB client and
+Groq SDK are only loaded the first time a `RagEngine` actually needs them.
+
+Every result carries `timings` (ms per stage), Groq `usage`, `error` and
+cache flags, and is recorded in metrics.REGISTRY (see metrics.py).
+
+Groq calls go through one pooled client per engine (groq_pool.py) that
+waits for rate-limit budget, retries transient failures and falls back to
+a smaller model. If no model answers in time the result is `degraded`:
+the best retrieved passages instead of a generated answer.
+
+Concurrent asks of the same (normalised) question and filters share one
+computation, streamed or not (see singleflight.py); the followers'
+results carry `coalesced: True`.
+
+Questions can be scoped with `filters` on the section metadata written by
+step2_chunk.py, e.g. {"sthana": "Sutra Sthana"} or {"sthana": [...],
+"page_type": "adhyaya"}; the dense backend and BM25 then only consider
+matching chunks.
 """
 
+import asyncio
 import os
+import threading
+import time
 import zipfile
-import chromadb
-from sentence_transformers import SentenceTransformer
-from groq import Groq
+from concurrent.futures import ThreadPoolExecutor
+
+from context_packer import TOKEN_BUDGET, pack
+from groq_pool import FALLBACK_MODEL, GroqPool
+from metrics import REGISTRY, observe_result, serve_metrics
+from singleflight import FlightTimeout, SingleFlight, normalize_question
 
 COLLECTION_NAME = "charak_samhita"
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 GROQ_MODEL = "llama-3.3-70b-versatile"
 TOP_K = 5
 
-# ── Step 1: Find & unzip DB ──────────────────────────────────────────
+# Shown instead of an error when Groq can't answer (see groq_pool.py)
+DEGRADED_NOTE = ("⚠️ The answer service is busy right now, so here are the most relevant "
+                 "passages from Charak Samhita instead:")
+DEGRADED_PASSAGES = 3
+DEGRADED_WORDS = 80        # per passage
+INTERRUPTED_NOTE = "*(The answer was cut short: the model stopped responding.)*"
+
+# Semantic answer cache (see answer_cache.py); set the path env var to
+# keep cached answers across restarts
+ANSWER_CACHE_THRESHOLD = 0.92
+ANSWER_CACHE_SIZE = 512
+ANSWER_CACHE_TTL = 7 * 24 * 3600
+ANSWER_CACHE_PATH = os.environ.get("CHARAK_ANSWER_CACHE_PATH")
+
+# Persistent (model, sha256(text)) → vector cache filled by step3_embed.py and
+# read (never written) for questions, which are kept in an in-process LRU;
+# "" keeps only the LRU
+EMBEDDING_CACHE_PATH = os.environ.get("CHARAK_EMBEDDING_CACHE", "./charak_embedding_cache.sqlite")
+EMBEDDING_LRU_SIZE = 1024
+
+# Question encoder: "torch" (sentence-transformers) or "onnx" / "onnx-int8"
+# running the export from `python onnx_embedder.py export` without torch;
+# CHARAK_EMBEDDING_THREADS caps its CPU threads (unset = all cores)
+EMBEDDING_RUNTIME = os.environ.get("CHARAK_EMBEDDING_RUNTIME", "torch")
+ONNX_MODEL_DIR = os.environ.get("CHARAK_ONNX_MODEL", "./charak_onnx")
+EMBEDDING_THREADS = int(os.environ.get("CHARAK_EMBEDDING_THREADS", "0")) or None
+
+# Unix socket of a shared `python embed_server.py`; unset = encode in process.
+# While the server is unreachable questions are encoded in process anyway.
+EMBED_SOCKET = os.environ.get("CHARAK_EMBED_SOCKET", "")
+
+# Which retrieval backend to search (see retrieval.py):
+#   "chroma" — ChromaDB collection under charak_db (HNSW, approximate)
+#   "numpy"  — exact search over the mmap'd index exported by step3_embed.py
+RETRIEVAL_BACKEND = os.environ.get("CHARAK_RETRIEVAL_BACKEND", "chroma")
+NUMPY_INDEX_PATH = os.environ.get("CHARAK_NUMPY_INDEX", "./charak_index")
+# Stored copy to scan: "float32", "float16" or "int8" (None = what step3
+# exported). float16 / int8 are 2x / 4x smaller but NOT faster: each scan
+# widens them to float32 (int8 ~2x, float16 ~7x the float32 latency), so use them
+# only when memory is the limit. Quantized scans re-rank
+# NUMPY_RESCORE * TOP_K candidates at float32, 0 = off
+NUMPY_INDEX_DTYPE = os.environ.get("CHARAK_INDEX_DTYPE") or None
+NUMPY_RESCORE = int(os.environ.get("CHARAK_INDEX_RESCORE", "4"))
+
+# Single-file index built by `step3_embed.py --snapshot` (see snapshot.py).
+# When present it is preferred over both backends above: it is mapped in
+# place, so startup neither searches for charak_db nor unzips anything.
+# Set CHARAK_SNAPSHOT_VERIFY=1 to re-hash the whole file on open.
+SNAPSHOT_PATH = os.environ.get("CHARAK_SNAPSHOT", "./charak_index.snapshot")
+SNAPSHOT_VERIFY = os.environ.get("CHARAK_SNAPSHOT_VERIFY", "") == "1"
+
+# Hybrid retrieval: BM25 over the index written by step2_chunk.py runs next
+# to dense search and the two rankings are merged with reciprocal rank
+# fusion. A snapshot carries its own copy; otherwise this file is read,
+# and search is silently dense-only when it is missing.
+BM25_INDEX_PATH = os.environ.get("CHARAK_BM25_INDEX", "./charak_bm25.npz")
+HYBRID_CANDIDATES = 20   # per retriever, before fusion down to TOP_K
+
+# Groq calls in flight at once for ask_batch / ask_async
+LLM_CONCURRENCY = int(os.environ.get("CHARAK_LLM_CONCURRENCY", "8"))
+
+# Share one in-flight computation between identical concurrent questions; "0" = off
+COALESCE = os.environ.get("CHARAK_COALESCE", "1") != "0"
+
+# Chunk metadata `ask(question, filters=...)` may restrict on
+FILTER_FIELDS = ("sthana", "adhyaya", "page_type")
+FILTER_CACHE_SIZE = 64   # distinct filters whose BM25 row mask is kept
+NO_MATCH_ANSWER = "No passages of Charak Samhita match the selected filters. Try widening them."
+
+# Retrieved chunks are merged, filtered and packed into this many prompt
+# tokens (estimated) before the Groq call, see context_packer.py
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CHARAK_CONTEXT_BUDGET", str(TOKEN_BUDGET)))
+
+# Prometheus text metrics on http://127.0.0.1:<port>/metrics; 0 = off
+METRICS_PORT = int(os.environ.get("CHARAK_METRICS_PORT", "0"))
+
 # Try multiple possible paths where charak_db might be
 POSSIBLE_DB_PATHS = ["./charak_db", "./charak_db/charak_db", "../charak_db"]
-DB_PATH = None
+ZIP_PATHS = ["./charak_db.zip", "../charak_db.zip"]
+DEFAULT_DB_PATH = "./charak_db"
 
-def find_or_extract_db():
-    global DB_PATH
+# ── System Prompt ────────────────────────────────────────────────────
+SYSTEM_PROMPT = """You are an expert Ayurvedic scholar specializing in Charak Samhita — one of the foundational texts of Ayurveda.
+
+Your role:
+- Answer questions based ONLY on the context from Charak Samhita provided to you
+- Be accurate, detailed, and mention which part of Charak Samhita the information comes from
+- If the answer is not found in the context, clearly say: "This specific topic is not covered in the provided sections of Charak Samhita."
+- Never invent or hallucinate information
+- Use proper Ayurvedic terminology (Sanskrit terms with explanation)
+- Always remind users that Ayurvedic treatments should be supervised by a qualified Vaidya (Ayurvedic physician)"""
 
-    # First check if charak_db already exists somewhere
+
+# ── Locate DB ────────────────────────────────────────────────────────
+def _has_chroma_files(path):
+    """True if a ChromaDB store lives somewhere under `path`"""
+    for root, dirs, files in os.walk(path):
+        if any(f.endswith(".sqlite3") or f.endswith(".bin") for f in files):
+            return True
+    return False
+
+
+def _find_db():
     for path in POSSIBLE_DB_PATHS:
-        if os.path.exists(path):
-            # Check if it actually has ChromaDB files inside
-            for root, dirs, files in os.walk(path):
-                if any(f.endswith(".sqlite3") or f.endswith(".bin") for f in files):
-                    DB_PATH = path
-                    print(f"Found DB at: {path}")
-                    return
+        if os.path.exists(path) and _has_chroma_files(path):
+            return path
+    return None
+
+
+def find_or_extract_db():
+    """Return the ChromaDB path, unzipping charak_db.zip on first use"""
+    path = _find_db()
+    if path:
+        print(f"Found DB at: {path}")
+        return path
 
     # Not found — try to unzip
-    zip_paths = ["./charak_db.zip", "../charak_db.zip"]
-    for zip_path in zip_paths:
+    for zip_path in ZIP_PATHS:
         if os.path.exists(zip_path):
             print(f"Unzipping {zip_path}...")
             with zipfile.ZipFile(zip_path, "r") as z:
-                # Show zip contents
-                names = z.namelist()
-                print(f"Zip contains: {names[:10]}")
                 z.extractall(".")
-            print("Unzipped!")
-            # Try to find DB again after extraction
-            for path in POSSIBLE_DB_PATHS:
-                if os.path.exists(path):
-                    for root, dirs, files in os.walk(path):
-                        if any(f.endswith(".sqlite3") or f.endswith(".bin") for f in files):
-                            DB_PATH = path
-                            print(f"Found DB at: {path} after unzip")
-                            return
+            path = _find_db()
+            if path:
+                print(f"Found DB at: {path} after unzip")
+                return path
             break
 
     # If still not found, use default path
-    if DB_PATH is None:
-        DB_PATH = "./charak_db"
-        print(f"Using default DB path: {DB_PATH}")
-        os.makedirs(DB_PATH, exist_ok=True)
-
-find_or_extract_db()
-
-# ── Step 2: Debug — show full directory structure ────────────────────
-print(f"\nDirectory contents:")
-for item in os.listdir("."):
-    print(f"  {item}")
-
-if os.path.exists("./charak_db"):
-    print(f"\ncharak_db contents:")
-    for root, dirs, files in os.walk("./charak_db"):
-        level = root.replace("./charak_db", "").count(os.sep)
-        indent = "  " * level
-        print(f"{indent}{os.path.basename(root)}/")
-        for f in files:
-            print(f"{indent}  {f}")
-
-# ── Step 3: Load models ──────────────────────────────────────────────
-print("\nLoading embedding model...")
-_embedding_model = SentenceTransformer(EMBEDDING_MODEL)
-
-# ── Step 4: Connect to ChromaDB ──────────────────────────────────────
-print(f"Connecting to ChromaDB at: {DB_PATH}")
-_chroma_client = chromadb.PersistentClient(path=DB_PATH)
-
-available = _chroma_client.list_collections()
-print(f"Available collections: {[c.name for c in available]}")
-
-if len(available) == 0:
-    print("WARNING: No collections found — creating empty one")
-    _collection = _chroma_client.get_or_create_collection(
-        name=COLLECTION_NAME,
-        metadata={"hnsw:space": "cosine"}
-    )
-else:
-    # Use exact match or first available
-    _collection = None
-    for col in available:
-        if col.name == COLLECTION_NAME:
-            _collection = _chroma_client.get_collection(col.name)
-            break
-    if _collection is None:
-        _collection = _chroma_client.get_collection(available[0].name)
-        print(f"Using collection: {available[0].name}")
-
-print(f"DB ready! Total items: {_collection.count()}")
-
-# ── System Prompt ────────────────────────────────────────────────────
-SYSTEM_PROMPT = """You are an expert Ayurvedic scholar specializing in Charak Samhita — one of the foundational texts of Ayurveda.
+    print(f"Using default DB path: {DEFAULT_DB_PATH}")
+    os.makedirs(DEFAULT_DB_PATH, exist_ok=True)
+    return DEFAULT_DB_PATH
+
+
+# ── Engine ───────────────────────────────────────────────────────────
+class RagEngine:
+    """Owns the embedding model and vector store for one process.
+
+    Every heavy resource is created on first access behind its own lock, so
+    concurrent Streamlit sessions share a single copy and never load it
+    twice.
+    """
+
+    def __init__(self, db_path=None, collection_name=COLLECTION_NAME,
+                 embedding_model=EMBEDDING_MODEL, groq_model=GROQ_MODEL,
+                 top_k=TOP_K, answer_cache_threshold=ANSWER_CACHE_THRESHOLD,
+                 answer_cache_size=ANSWER_CACHE_SIZE, answer_cache_ttl=ANSWER_CACHE_TTL,
+                 answer_cache_path=ANSWER_CACHE_PATH, backend=RETRIEVAL_BACKEND,
+                 numpy_index_path=NUMPY_INDEX_PATH, bm25_index_path=BM25_INDEX_PATH,
+                 embedding_cache_path=EMBEDDING_CACHE_PATH, numpy_index_dtype=NUMPY_INDEX_DTYPE,
+                 numpy_rescore=NUMPY_RESCORE, snapshot_path=SNAPSHOT_PATH,
+                 embedding_runtime=EMBEDDING_RUNTIME, onnx_model_dir=ONNX_MODEL_DIR,
+                 embedding_threads=EMBEDDING_THREADS, embedding_lru_size=EMBEDDING_LRU_SIZE,
+                 embed_socket=EMBED_SOCKET, metrics=REGISTRY, context_budget=CONTEXT_TOKEN_BUDGET,
+                 fallback_model=FALLBACK_MODEL, llm_concurrency=LLM_CONCURRENCY, coalesce=COALESCE):
+        self.db_path = db_path
+        self.collection_name = collection_name
+        self.embedding_model = embedding_model
+        self.groq_model = groq_model
+        self.fallback_model = fallback_model
+        self.llm_concurrency = llm_concurrency
+        self.top_k = top_k
+        self.answer_cache_threshold = answer_cache_threshold
+        self.answer_cache_size = answer_cache_size
+        self.answer_cache_ttl = answer_cache_ttl
+        self.answer_cache_path = answer_cache_path
+        self.backend_name = backend
+        self.numpy_index_path = numpy_index_path
+        self.numpy_index_dtype = numpy_index_dtype
+        self.numpy_rescore = numpy_rescore
+        self.snapshot_path = snapshot_path
+        self.embedding_runtime = embedding_runtime
+        self.onnx_model_dir = onnx_model_dir
+        self.embedding_threads = embedding_threads
+        self.embedding_lru_size = embedding_lru_size
+        self.embed_socket = embed_socket
+        self.metrics = metrics
+        self.context_budget = context_budget
+        self.snapshot_manifest = None
+        self.index_params = {}
+        self.bm25_index_path = bm25_index_path
+        self.embedding_cache_path = embedding_cache_path
+
+        self._model = None
+        self._client = None
+        self._collection = None
+        self._answer_cache = None
+        self._embedding_cache = None
+        self._backend = None
+        self._bm25 = None
+        self._bm25_loaded = False
+        self._bm25_masks = {}
+        self._llm = None
+        self._flights = SingleFlight() if coalesce else None
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag")
+        self._ask_pool = ThreadPoolExecutor(max_workers=llm_concurrency, thread_name_prefix="rag-ask")
+        self._model_lock = threading.Lock()
+        self._client_lock = threading.Lock()
+        self._warm_thread = None
+
+    # -- lazily initialised resources ---------------------------------
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    if self.embed_socket:
+                        from embed_server import FallbackEmbedder, RemoteEmbedder
+                        from onnx_embedder import cache_namespace
+                        print(f"Using embedding server at: {self.embed_socket}")
+                        remote = RemoteEmbedder(self.embed_socket,
+                                                cache_namespace(self.embedding_model, self.embedding_runtime))
+                        self._model = FallbackEmbedder(remote, self._load_model, metrics=self.metrics)
+                    else:
+                        self._model = self._load_model()
+        return self._model
+
+    def _load_model(self):
+        from onnx_embedder import load_embedder
+        print(f"Loading embedding model: {self.embedding_model} ({self.embedding_runtime})")
+        return load_embedder(self.embedding_model, self.embedding_runtime,
+                             onnx_dir=self.onnx_model_dir, threads=self.embedding_threads)
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import chromadb
+                    if self.db_path is None:
+                        self.db_path = find_or_extract_db()
+                    print(f"Connecting to ChromaDB at: {self.db_path}")
+                    self._client = chromadb.PersistentClient(path=self.db_path)
+        return self._client
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            client = self.client
+            with self._client_lock:
+                if self._collection is None:
+                    self._collection = self._open_collection(client)
+        return self._collection
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            if self.snapshot_path and os.path.exists(self.snapshot_path):
+                with self._client_lock:
+                    if self._backend is None:
+                        from snapshot import open_snapshot
+                        print(f"Opening index snapshot: {self.snapshot_path}")
+                        # Raises SnapshotError if built for another embedding model or runtime
+                        self._backend, self.snapshot_manifest = open_snapshot(
+                            self.snapshot_path, embedding_model=self.embedding_model,
+                            embedding_runtime=self.embedding_runtime,
+                            dtype=self.numpy_index_dtype, rescore=self.numpy_rescore,
+                            verify=SNAPSHOT_VERIFY,
+                        )
+            elif self.backend_name == "numpy":
+                with self._client_lock:
+                    if self._backend is None:
+                        from retrieval import NumpyBackend
+                        print(f"Opening NumPy index at: {self.numpy_index_path}")
+                        self._backend = NumpyBackend.load(self.numpy_index_path,
+                                                          dtype=self.numpy_index_dtype,
+                                                          rescore=self.numpy_rescore)
+            elif self.backend_name == "chroma":
+                collection = self.collection
+                from retrieval import ChromaBackend
+                self._backend = ChromaBackend(collection)
+            else:
+                raise ValueError(f"Unknown retrieval backend: {self.backend_name!r}")
+        return self._backend
+
+    @property
+    def bm25(self):
+        """BM25Index, or None when no sparse index was built.
+
+        With a snapshot the BM25 arrays packed into it are used; a separate
+        BM25 file only if the snapshot has none, and only if it indexes the
+        snapshot's chunks.
+        """
+        if not self._bm25_loaded:
+            snapshot = self.snapshot_path and os.path.exists(self.snapshot_path)
+            backend = self.backend if snapshot else None     # opens the snapshot first
+            with self._client_lock:
+                if not self._bm25_loaded:
+                    if snapshot and self.snapshot_manifest.get("bm25"):
+                        from snapshot import open_snapshot_bm25
+                        self._bm25 = open_snapshot_bm25(self.snapshot_path, self.snapshot_manifest)
+                    elif self.bm25_index_path and os.path.exists(self.bm25_index_path):
+                        from sparse_index import BM25Index
+                        print(f"Loading BM25 index: {self.bm25_index_path}")
+                        self._bm25 = BM25Index.load(self.bm25_index_path)
+                        if snapshot and set(self._bm25.ids) != set(backend.ids):
+                            print(f"WARNING: {self.bm25_index_path} does not match the chunks in "
+                                  f"{self.snapshot_path}; hybrid search is off until both are rebuilt")
+                            self._bm25 = None
+                    self._bm25_loaded = True
+        return self._bm25
+
+    @property
+    def llm(self):
+        """GroqPool shared by every question this engine answers"""
+        if self._llm is None:
+            with self._client_lock:
+                if self._llm is None:
+                    self._llm = GroqPool(self.groq_model, fallback=self.fallback_model,
+                                         metrics=self.metrics)
+        return self._llm
+
+    @property
+    def embedding_cache(self):
+        if self._embedding_cache is None:
+            with self._client_lock:
+                if self._embedding_cache is None:
+                    from embedding_cache import EmbeddingCache
+                    from onnx_embedder import cache_namespace
+                    self._embedding_cache = EmbeddingCache(
+                        self.embedding_cache_path or None,
+                        cache_namespace(self.embedding_model, self.embedding_runtime),
+                        lru_size=self.embedding_lru_size,
+                    )
+        return self._embedding_cache
+
+    def _embed_queries(self, questions):
+        """(embedding lists, cache-hit flags); misses are encoded in one model call"""
+        missed = set()
+
+        # Defers loading the model until a question actually misses
+        def encode(texts):
+            missed.update(texts)
+            return self.model.encode(texts)
+
+        vectors = self.embedding_cache.encode_queries(encode, questions)
+        return [v.tolist() for v in vectors], [q not in missed for q in questions]
+
+    @property
+    def answer_cache(self):
+        if self._answer_cache is None:
+            with self._client_lock:
+                if self._answer_cache is None:
+                    from answer_cache import AnswerCache
+                    self._answer_cache = AnswerCache(
+                        threshold=self.answer_cache_threshold,
+                        max_entries=self.answer_cache_size,
+                        ttl=self.answer_cache_ttl,
+                        path=self.answer_cache_path,
+                    )
+        return self._answer_cache
+
+    def _open_collection(self, client):
+        available = client.list_collections()
+        if len(available) == 0:
+            print("WARNING: No collections found — creating empty one")
+            return client.get_or_create_collection(
+                name=self.collection_name,
+                metadata={"hnsw:space": "cosine"}
+            )
+
+        # Use exact match or first available
+        for col in available:
+            if col.name == self.collection_name:
+                collection = client.get_collection(col.name)
+                break
+        else:
+            collection = client.get_collection(available[0].name)
+            print(f"Using collection: {available[0].name}")
+
+        # HNSW params chosen by `step3_embed.py --hnsw-sweep`, if any
+        self.index_params = {k: v for k, v in (collection.metadata or {}).items()
+                             if k.startswith("hnsw:")}
+        print(f"DB ready! Total items: {collection.count()} (index: {self.index_params})")
+        return collection
+
+    def warm_up(self, background=False):
+        """Load the model and open the collection ahead of the first question"""
+        if not background:
+            self.model.encode("warm up")
+            self.backend.count()
+            self.bm25
+            return None
+
+        if self._warm_thread is None:
+            self._warm_thread = threading.Thread(
+                target=self.warm_up, name="rag-warm-up", daemon=True
+            )
+            self._warm_thread.start()
+        return self._warm_thread
+
+    # -- query ---------------------------------------------------------
+    def _unavailable(self):
+        """Result dict explaining why no question can be answered, or None"""
+        if not os.environ.get("GROQ_API_KEY", ""):
+            return {
+                "answer": "Groq API key is not set. Please add GROQ_API_KEY in Streamlit secrets. Get free key from https://console.groq.com",
+                "sources": [],
+                "chunks_used": 0,
+                "unavailable": True
+            }
+
+        if self.backend.count() == 0:
+            return {
+                "answer": "The database is empty! Please re-upload charak_db.zip to GitHub with the correct contents.",
+                "sources": [],
+                "chunks_used": 0,
+                "unavailable": True
+            }
+        return None
+
+    def _bm25_mask(self, where):
+        """BM25 row mask of the chunks matching `where`, computed once per filter"""
+        key = repr(where)
+        mask = self._bm25_masks.get(key)
+        if mask is None:
+            mask = self.bm25.mask(self.backend.filter_ids(where))
+            with self._client_lock:
+                if len(self._bm25_masks) >= FILTER_CACHE_SIZE:
+                    self._bm25_masks.clear()
+                self._bm25_masks[key] = mask
+        return mask
+
+    def _retrieve(self, question, info=None, where=None):
+        """Embed the question and fetch the TOP_K best chunks.
+
+        Returns (question embedding, candidates), candidates being rank-ordered
+        {"id", "text", "metadata", "distance"} dicts (distance None for
+        BM25-only hits). `info`, when given, receives embed/search timings and
+        the embedding cache flag. `where` (see `where_clause`) limits both
+        retrievers to matching chunks.
+        """
+        info = info if info is not None else _new_info()
+        return self._retrieve_many([question], [info], where)[0]
+
+    def _retrieve_many(self, questions, infos, where=None):
+        """`_retrieve` for several questions: one encode call, one backend query.
+
+        Every info gets the batch's embed/search times.
+        """
+        bm25 = self.bm25
+        sparse = None
+        if bm25 is not None:
+            # Sparse searches run while the questions are embedded and searched densely
+            allowed = self._bm25_mask(where) if where else None
+            sparse = [self._pool.submit(bm25.search, q, HYBRID_CANDIDATES, allowed) for q in questions]
+
+        started = time.perf_counter()
+        embeddings, hits = self._embed_queries(questions)
+        embed_ms = _ms_since(started)
+        started = time.perf_counter()
+        dense = self.backend.query(embeddings, n_results=self.top_k if bm25 is None else HYBRID_CANDIDATES,
+                                   where=where)
+        rows = zip(dense["ids"], dense["documents"], dense["metadatas"], dense["distances"])
+        if sparse is None:
+            retrieved = [_candidates(*row) for row in rows]
+        else:
+            retrieved = [self._fuse(row, future.result()) for row, future in zip(rows, sparse)]
+        search_ms = _ms_since(started)
+
+        for info, hit in zip(infos, hits):
+            info["timings"].update(embed_ms=embed_ms, search_ms=search_ms)
+            info["embedding_cache_hit"] = hit
+        return list(zip(embeddings, retrieved))
+
+    def _fuse(self, dense_row, sparse_hits):
+        """TOP_K candidates from one question's dense row and BM25 hits (RRF)"""
+        from sparse_index import reciprocal_rank_fusion
+
+        dense_ids, documents, metadatas, distances = dense_row
+        fused = reciprocal_rank_fusion([dense_ids, [cid for cid, _ in sparse_hits]])
+        ids = [cid for cid, _ in fused[:self.top_k]]
+
+        # Dense hits already carry their text; fetch only sparse-only hits
+        rows = {cid: (doc, meta, dist) for cid, doc, meta, dist in
+                zip(dense_ids, documents, metadatas, distances)}
+        missing = [cid for cid in ids if cid not in rows]
+        if missing:
+            extra = self.backend.get(missing)
+            rows.update({cid: (doc, meta, None) for cid, doc, meta in
+                         zip(extra["ids"], extra["documents"], extra["metadatas"])})
+
+        ids = [cid for cid in ids if cid in rows]
+        return [{"id": cid, "text": rows[cid][0], "metadata": rows[cid][1] or {},
+                 "distance": rows[cid][2]} for cid in ids]
+
+    def _build_messages(self, question, passages):
+        context = "\n\n---\n\n".join(
+            [f"[From: {p['title']}]\n{p['text']}" for p in passages]
+        )
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"""Here are relevant passages from Charak Samhita:
 
-Your role:
-- Answer questions based ONLY on the context from Charak Samhita provided to you
-- Be accurate, detailed, and mention which part of Charak Samhita the information comes from
-- If the answer is not found in the context, clearly say: "This specific topic is not covered in the provided sections of Charak Samhita."
-- Never invent or hallucinate information
-- Use proper Ayurvedic terminology (Sanskrit terms with explanation)
-- Always remind users that Ayurvedic treatments should be supervised by a qualified Vaidya (Ayurvedic physician)"""
+{context}
 
+---
 
-def ask_charak(question: str) -> dict:
-    groq_api_key = os.environ.get("GROQ_API_KEY", "")
+Question: {question}
 
-    if not groq_api_key:
+Please answer based on the above context from Charak Samhita."""}
+        ]
+
+    def _cached_result(self, q_embedding, ids):
+        """Same chunks + near-identical question → reuse the earlier answer"""
+        cached = self.answer_cache.lookup(q_embedding, ids, namespace=self.groq_model)
+        if cached is None:
+            return None
+        entry, similarity = cached
         return {
-            "answer": "Groq API key is not set. Please add GROQ_API_KEY in Streamlit secrets. Get free key from https://console.groq.com",
-            "sources": [],
-            "chunks_used": 0
+            "answer": entry["answer"],
+            "sources": entry["sources"],
+            "chunks_used": len(ids),
+            "cache_hit": True,
+            "cache_similarity": similarity
         }
 
-    if _collection.count() == 0:
-        return {
-            "answer": "The database is empty! Please re-upload charak_db.zip to GitHub with the correct contents.",
-            "sources": [],
-            "chunks_used": 0
+    def _cache_answer(self, q_embedding, ids, answer, sources, model):
+        """Keep a primary-model answer; a failing cache never costs the answer itself"""
+        if model != self.groq_model:
+            return
+        try:
+            self.answer_cache.store(q_embedding, ids, answer, sources, namespace=self.groq_model)
+        except Exception as e:
+            print(f"WARNING: answer cache store failed ({e})")
+
+    def _groq_client(self):
+        return self.llm.client
+
+    def _build_prompt(self, question, candidates, info):
+        """(messages, passages) for the budget-packed context"""
+        started = time.perf_counter()
+        passages = pack(candidates, budget=self.context_budget)
+        messages = self._build_messages(question, passages)
+        info["timings"]["prompt_ms"] = _ms_since(started)
+        info["context_tokens"] = sum(p["tokens"] for p in passages)
+        return messages, passages
+
+    def _finish(self, result, info, started):
+        """Attach timings / usage / flags to a result and record its metrics"""
+        info["timings"]["total_ms"] = _ms_since(started)
+        result.update(info)
+        observe_result(result, self.metrics)
+        return result
+
+    def ask(self, question: str, filters=None) -> dict:
+        """Answer `question`; `filters` optionally scopes retrieval (see `where_clause`)"""
+        if self._flights is None:
+            return self._ask(question, filters)
+        key = _flight_key(question, filters)
+        try:
+            result, shared = self._flights.do(key, lambda: self._ask(question, filters))
+        except FlightTimeout:
+            return self._ask(question, filters)
+        if shared:
+            self.metrics.inc("charak_requests_total", outcome="coalesced")
+            return {**result, "coalesced": True}
+        return result
+
+    def _ask(self, question, filters=None):
+        started = time.perf_counter()
+        info = _new_info()
+        where = where_clause(filters)
+        unavailable = self._unavailable()
+        if unavailable:
+            return self._finish(unavailable, info, started)
+
+        q_embedding, candidates = self._retrieve(question, info, where)
+        return self._answer(question, q_embedding, candidates, info, started, where)
+
+    def _answer(self, question, q_embedding, candidates, info, started, where=None):
+        """Second half of `ask`: pack, answer-cache lookup, Groq call"""
+        if not candidates and where:
+            return self._finish(_no_match(), info, started)
+        messages, passages = self._build_prompt(question, candidates, info)
+        ids, sources = _packed_ids(passages), _sources(passages)
+
+        cached = self._cached_result(q_embedding, ids)
+        if cached:
+            return self._finish(cached, info, started)
+
+        llm_started = time.perf_counter()
+        try:
+            response, info["model"] = self.llm.complete(messages, max_tokens=1500, temperature=0.3)
+            answer = response.choices[0].message.content
+            info["usage"] = _usage(response)
+        except Exception as e:
+            answer = _degraded_answer(passages)
+            info["error"] = str(e)
+            info["degraded"] = True
+        else:
+            self._cache_answer(q_embedding, ids, answer, sources, info["model"])
+        info["timings"]["llm_total_ms"] = _ms_since(llm_started)
+
+        return self._finish({
+            "answer": answer,
+            "sources": sources,
+            "chunks_used": len(ids),
+            "cache_hit": False
+        }, info, started)
+
+    def ask_batch(self, questions, filters=None, concurrency=None):
+        """Answer many questions at once, results in input order.
+
+        All questions are embedded in one `encode` call and searched with one
+        backend query; Groq calls then run `concurrency` (default
+        llm_concurrency) at a time.
+        """
+        started = time.perf_counter()
+        questions = list(questions)
+        infos = [_new_info() for _ in questions]
+        where = where_clause(filters)
+        unavailable = self._unavailable()
+        if unavailable:
+            return [self._finish(dict(unavailable), info, started) for info in infos]
+        if not questions:
+            return []
+
+        retrieved = self._retrieve_many(questions, infos, where)
+        workers = max(1, min(concurrency or self.llm_concurrency, len(questions)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-batch") as pool:
+            futures = [pool.submit(self._answer, question, q_embedding, candidates, info, started, where)
+                       for question, (q_embedding, candidates), info in zip(questions, retrieved, infos)]
+            return [future.result() for future in futures]
+
+    async def ask_async(self, question: str, filters=None) -> dict:
+        """`ask` for asyncio callers; at most llm_concurrency run at once"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._ask_pool, self.ask, question, filters)
+
+    def ask_stream(self, question: str, filters=None):
+        """Like `ask`, but yields events as soon as they are available:
+
+            {"type": "sources", "sources": [...], "chunks_used": n}
+            {"type": "token", "text": "..."}          (zero or more)
+            {"type": "done", **result}                 (same keys as `ask`)
+        """
+        if self._flights is None:
+            yield from self._ask_stream(question, filters)
+            return
+        key = _flight_key(question, filters)
+        events, shared = self._flights.stream(key, lambda: self._ask_stream(question, filters))
+        yielded = False
+        try:
+            for event in events:
+                if shared and event["type"] == "done":
+                    self.metrics.inc("charak_requests_total", outcome="coalesced")
+                    event = {**event, "coalesced": True}
+                yielded = True
+                yield event
+        except FlightTimeout:
+            if yielded:
+                raise
+            yield from self._ask_stream(question, filters)
+
+    def _ask_stream(self, question, filters=None):
+        started = time.perf_counter()
+        info = _new_info()
+        where = where_clause(filters)
+        unavailable = self._unavailable()
+        if unavailable:
+            yield {"type": "sources", "sources": [], "chunks_used": 0}
+            yield {"type": "token", "text": unavailable["answer"]}
+            yield {"type": "done", **self._finish(unavailable, info, started)}
+            return
+
+        q_embedding, candidates = self._retrieve(question, info, where)
+        if not candidates and where:
+            no_match = _no_match()
+            yield {"type": "sources", "sources": [], "chunks_used": 0}
+            yield {"type": "token", "text": no_match["answer"]}
+            yield {"type": "done", **self._finish(no_match, info, started)}
+            return
+        messages, passages = self._build_prompt(question, candidates, info)
+        ids, sources = _packed_ids(passages), _sources(passages)
+
+        cached = self._cached_result(q_embedding, ids)
+        if cached:
+            yield {"type": "sources", "sources": cached["sources"], "chunks_used": len(ids)}
+            yield {"type": "token", "text": cached["answer"]}
+            yield {"type": "done", **self._finish(cached, info, started)}
+            return
+
+        yield {"type": "sources", "sources": sources, "chunks_used": len(ids)}
+
+        llm_started = time.perf_counter()
+        parts = []
+        try:
+            stream, info["model"] = self.llm.stream(messages, max_tokens=1500, temperature=0.3)
+            for chunk in stream:
+                # Usage arrives on the last chunk (x_groq.usage)
+                info["usage"] = _usage(chunk) or info["usage"]
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    if not parts:
+                        info["timings"]["llm_ttft_ms"] = _ms_since(llm_started)
+                    parts.append(text)
+                    yield {"type": "token", "text": text}
+            answer = "".join(parts)
+        except Exception as e:
+            info["error"] = str(e)
+            # Keep whatever already streamed; otherwise fall back to the passages
+            if parts:
+                text = f"\n\n{INTERRUPTED_NOTE}"
+            else:
+                text = _degraded_answer(passages)
+                info["degraded"] = True
+            parts.append(text)
+            yield {"type": "token", "text": text}
+            answer = "".join(parts)
+        else:
+            self._cache_answer(q_embedding, ids, answer, sources, info["model"])
+        info["timings"]["llm_total_ms"] = _ms_since(llm_started)
+
+        yield {
+            "type": "done",
+            **self._finish({
+                "answer": answer,
+                "sources": sources,
+                "chunks_used": len(ids),
+                "cache_hit": False
+            }, info, started)
         }
 
-    groq_client = Groq(api_key=groq_api_key)
 
-    # Embed question
-    q_embedding = _embedding_model.encode(question).tolist()
+def where_clause(filters):
+    """Chroma `where` for {field: value or [values]} filters, or None.
 
-    # Search ChromaDB
-    results = _collection.query(
-        query_embeddings=[q_embedding],
-        n_results=TOP_K
-    )
+    Values are strings or integers; empty values are ignored and several
+    fields must all match. Raises ValueError for anything else, so no raw
+    Chroma operator reaches the index.
+    """
+    clauses = []
+    for field, value in (filters or {}).items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Cannot filter on {field!r}; use one of {FILTER_FIELDS}")
+        many = isinstance(value, (list, tuple, set))
+        if not (all(map(_is_filter_value, value)) if many else value is None or _is_filter_value(value)):
+            raise ValueError(f"Filter {field!r} takes a string, an integer or a list of them")
+        if many:
+            values = sorted(value, key=lambda v: (isinstance(v, str), v))
+            if len(values) > 1:
+                clauses.append({field: {"$in": values}})
+                continue
+            value = values[0] if values else None
+        if value not in (None, ""):
+            clauses.append({field: value})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
 
-    docs = results["documents"][0]
-    metadatas = results["metadatas"][0]
 
-    context = "\n\n---\n\n".join(
-        [f"[From: {m.get('title', 'Charak Samhita')}]\n{doc}"
-         for doc, m in zip(docs, metadatas)]
-    )
-    sources = list({m.get("title", "Charak Samhita") for m in metadatas})
+def _is_filter_value(value):
+    return isinstance(value, str) or (isinstance(value, int) and not isinstance(value, bool))
 
-    try:
-        response = groq_client.chat.completions.create(
-            model=GROQ_MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": f"""Here are relevant passages from Charak Samhita:
 
-{context}
+def _no_match():
+    return {"answer": NO_MATCH_ANSWER, "sources": [], "chunks_used": 0, "cache_hit": None}
 
----
 
-Question: {question}
+def _flight_key(question, filters):
+    """Questions coalesce when this matches; raises ValueError for bad filters"""
+    return normalize_question(question), repr(where_clause(filters))
 
-Please answer based on the above context from Charak Samhita."""}
-            ],
-            max_tokens=1500,
-            temperature=0.3
-        )
-        answer = response.choices[0].message.content
-    except Exception as e:
-        answer = f"Error from Groq: {str(e)}"
-
-    return {
-        "answer": answer,
-        "sources": sources,
-        "chunks_used": len(docs)
-    }
\ No newline at end of file
+
+def _packed_ids(passages):
+    return [cid for p in passages for cid in p["ids"]]
+
+
+def _sources(passages):
+    return list(dict.fromkeys(p["title"] for p in passages))
+
+
+def _degraded_answer(passages):
+    """Extractive answer from the best passages, for when no model responds"""
+    if not passages:
+        return f"{DEGRADED_NOTE}\n\n(no passages found)"
+    excerpts = []
+    for p in passages[:DEGRADED_PASSAGES]:
+        words = p["text"].split()
+        excerpt = " ".join(words[:DEGRADED_WORDS]) + (" …" if len(words) > DEGRADED_WORDS else "")
+        excerpts.append(f"**{p['title']}**: {excerpt}")
+    return "\n\n".join([DEGRADED_NOTE, *excerpts])
+
+
+def _candidates(ids, documents, metadatas, distances):
+    return [{"id": cid, "text": doc, "metadata": meta or {}, "distance": dist}
+            for cid, doc, meta, dist in zip(ids, documents, metadatas, distances)]
+
+
+def _new_info():
+    """Diagnostics merged into every result"""
+    return {"timings": {}, "usage": None, "error": None, "embedding_cache_hit": None,
+            "context_tokens": 0, "model": None, "degraded": False}
+
+
+def _ms_since(started):
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+def _usage(response):
+    """Groq token usage as a dict, from a completion or the last stream chunk"""
+    usage = getattr(response, "usage", None) or getattr(getattr(response, "x_groq", None), "usage", None)
+    if usage is None:
+        return None
+    return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens,
+            "total_tokens": usage.total_tokens}
+
+
+# ── Process-wide engine ──────────────────────────────────────────────
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> RagEngine:
+    """Return the engine shared by every caller in this process"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RagEngine()
+                if METRICS_PORT:
+                    try:
+                        serve_metrics(METRICS_PORT)
+                    except OSError as e:
+                        # e.g. another worker on this host already serves the port
+                        print(f"WARNING: metrics endpoint on port {METRICS_PORT} unavailable ({e})")
+    return _engine
+
+
+def ask_charak(question: str, filters=None) -> dict:
+    return get_engine().ask(question, filters)
+
+
+async def ask_charak_async(question: str, filters=None) -> dict:
+    """Awaitable `ask_charak`"""
+    return await get_engine().ask_async(question, filters)
+
+
+def ask_charak_batch(questions, filters=None, concurrency=None) -> list:
+    """Answers for many questions; see `RagEngine.ask_batch`"""
+    return get_engine().ask_batch(questions, filters, concurrency)
+
+
+def ask_charak_stream(question: str, filters=None):
+    """Generator of answer events; see `RagEngine.ask_stream`"""
+    return get_engine().ask_stream(question, filters)
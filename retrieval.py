@@ -0,0 +1,367 @@
+"""
+Retrieval backends for Charak Samhita AI
+
+Every backend answers the same small interface and returns results shaped
+like ChromaDB's `collection.query` output, so `rag_engine` does not care
+which one is in use:
+
+    count()                                        -> int
+    query(query_embeddings, n_results, where=None) -> {"ids", "documents", "metadatas", "distances"}
+    get(ids)                                       -> {"ids", "documents", "metadatas"}
+    filter_ids(where)                              -> [id, ...] matching `where`
+
+Distances are cosine distances (1 - cosine similarity), as with a
+`{"hnsw:space": "cosine"}` Chroma collection. `where` is a Chroma metadata
+filter ({"sthana": "Sutra Sthana"}, {"adhyaya": {"$in": [1, 2]}}, $and /
+$or of those) applied before scoring: Chroma filters inside its index,
+NumpyBackend only scans the matching rows.
+
+NumpyBackend keeps the corpus as one L2-normalised float32 matrix in
+`embeddings.npy`, the chunk texts as one UTF-8 blob (`documents.npy`,
+uint8) indexed by `doc_offsets.npy`, and ids plus columnar metadata in a
+small `table.json`. Matrix and texts are opened with mmap, so worker
+processes on one machine share the same page-cache copy and only the
+returned rows' texts are ever decoded; search is an exact matmul +
+argpartition.
+
+The index can also carry a scalar-quantized copy of the matrix: float16
+(`embeddings.f16.npy`, 2x smaller) or int8 with one scale per dimension
+(`embeddings.i8.npy` + `scales.npy`, 4x smaller). Searching the quantized
+copy only pages in that file; with `rescore` the best `rescore * k`
+candidates are then re-ranked against the float32 rows, which touches just
+those rows of `embeddings.npy`. NumPy has no float16 or int8 BLAS matmul,
+so every scan widens SCAN_BLOCK rows at a time into one reused float32
+buffer: a quantized scan trades memory for latency (on a 5000-chunk
+index int8 measured about 2x and float16 about 7x the float32 time, as
+NumPy's float16 conversion is slow) and is worth it only when the float32
+matrix does not fit in RAM. `measure_latency` and
+`step3_embed.py --recall-check` report both costs.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+EMBEDDINGS_FILE = "embeddings.npy"
+TABLE_FILE = "table.json"
+DOCUMENTS_FILE = "documents.npy"
+DOC_OFFSETS_FILE = "doc_offsets.npy"
+QUANTIZED_FILES = {"float16": "embeddings.f16.npy", "int8": "embeddings.i8.npy"}
+SCALES_FILE = "scales.npy"
+SCAN_BLOCK = 8192   # quantized rows widened to float32 at a time when scanning
+FILTER_CACHE_SIZE = 64   # `where` → matching rows, kept per NumpyBackend
+
+_COMPARE = {
+    "$eq": lambda v, x: v == x,
+    "$ne": lambda v, x: v != x,
+    "$gt": lambda v, x: v is not None and v > x,
+    "$gte": lambda v, x: v is not None and v >= x,
+    "$lt": lambda v, x: v is not None and v < x,
+    "$lte": lambda v, x: v is not None and v <= x,
+    "$in": lambda v, x: v in x,
+    "$nin": lambda v, x: v not in x,
+}
+
+
+class RetrievalBackend:
+    """Interface shared by all backends"""
+
+    def count(self):
+        raise NotImplementedError
+
+    def query(self, query_embeddings, n_results, where=None):
+        raise NotImplementedError
+
+    def get(self, ids):
+        raise NotImplementedError
+
+    def filter_ids(self, where):
+        raise NotImplementedError
+
+
+class ChromaBackend(RetrievalBackend):
+    """Thin adapter over a ChromaDB collection (HNSW, approximate)"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def count(self):
+        return self.collection.count()
+
+    def query(self, query_embeddings, n_results, where=None):
+        return self.collection.query(
+            query_embeddings=[list(map(float, q)) for q in query_embeddings],
+            n_results=n_results,
+            **({"where": where} if where else {})
+        )
+
+    def get(self, ids):
+        return self.collection.get(ids=list(ids), include=["documents", "metadatas"])
+
+    def filter_ids(self, where):
+        return self.collection.get(where=where, include=[])["ids"]
+
+
+class Documents:
+    """Chunk texts decoded on access from a UTF-8 blob and n+1 byte offsets"""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.blob[start:end].tobytes().decode("utf-8")
+
+
+class NumpyBackend(RetrievalBackend):
+    """Cosine search over an in-memory (mmap'd) embedding matrix"""
+
+    def __init__(self, vectors, ids, documents, metadata_columns, scales=None, full=None, rescore=0):
+        self.vectors = vectors          # float32, float16 or int8 codes
+        self.scales = scales            # per-dimension scales for int8 codes
+        self.full = full                # float32 matrix for re-scoring, if any
+        self.rescore = rescore if full is not None and vectors is not full else 0
+        self.ids = ids
+        self.documents = documents      # Documents, or a plain list
+        self.columns = metadata_columns
+        self._row_of = {chunk_id: row for row, chunk_id in enumerate(ids)}
+        self._filter_rows = {}
+
+    @classmethod
+    def load(cls, path, mmap=True, dtype=None, rescore=0):
+        """Open an index; `dtype` picks the stored copy to scan (default: the table's)"""
+        mode = "r" if mmap else None
+        with open(os.path.join(path, TABLE_FILE), "r", encoding="utf-8") as f:
+            table = json.load(f)
+
+        def open_array(name):
+            file_path = os.path.join(path, name)
+            return np.load(file_path, mmap_mode=mode) if os.path.exists(file_path) else None
+
+        return cls.from_table(table, open_array, dtype=dtype, rescore=rescore, source=path)
+
+    @classmethod
+    def from_table(cls, table, open_array, dtype=None, rescore=0, source="index"):
+        """Build from a parsed table.json; `open_array(file name)` returns an array or None"""
+        dtype = dtype or table.get("dtype", "float32")
+        if dtype not in ("float32", *QUANTIZED_FILES):
+            raise ValueError(f"Unsupported index dtype: {dtype!r}")
+
+        full = open_array(EMBEDDINGS_FILE)
+        scales = None
+        if dtype == "float32":
+            vectors = full
+        else:
+            vectors = open_array(QUANTIZED_FILES[dtype])
+            if dtype == "int8":
+                scales = open_array(SCALES_FILE)
+
+        if vectors is None or len(table["ids"]) != vectors.shape[0]:
+            raise ValueError(f"{source}: {dtype} embeddings missing or not matching {len(table['ids'])} ids")
+
+        if "documents" in table:        # indexes written before the documents blob
+            documents = table["documents"]
+        else:
+            blob, offsets = open_array(DOCUMENTS_FILE), open_array(DOC_OFFSETS_FILE)
+            if blob is None or offsets is None or len(offsets) != len(table["ids"]) + 1:
+                raise ValueError(f"{source}: documents missing or not matching {len(table['ids'])} ids")
+            documents = Documents(blob, offsets)
+        return cls(vectors, table["ids"], documents, table["metadata"],
+                   scales=scales, full=full, rescore=rescore)
+
+    def count(self):
+        return len(self.ids)
+
+    def _metadata(self, row):
+        return {name: column[row] for name, column in self.columns.items()
+                if column[row] is not None}
+
+    def _rows(self, rows):
+        return (
+            [self.ids[r] for r in rows],
+            [self.documents[r] for r in rows],
+            [self._metadata(r) for r in rows],
+        )
+
+    def rows_where(self, where):
+        """Sorted row numbers whose metadata matches `where` (cached)"""
+        key = json.dumps(where, sort_keys=True)
+        rows = self._filter_rows.get(key)
+        if rows is None:
+            rows = np.flatnonzero(where_mask(self.columns, where, len(self.ids)))
+            if len(self._filter_rows) >= FILTER_CACHE_SIZE:
+                self._filter_rows.clear()
+            self._filter_rows[key] = rows
+        return rows
+
+    def filter_ids(self, where):
+        return [self.ids[r] for r in self.rows_where(where)]
+
+    def _scan(self, queries, rows=None):
+        """(n_queries, N) scores against the stored (possibly quantized) vectors.
+
+        With `rows`, only those rows are scored; column j is row rows[j].
+        """
+        if self.scales is not None:
+            queries = queries * self.scales      # x·q ≈ codes·(scales*q)
+        n = self.vectors.shape[0] if rows is None else len(rows)
+        if self.vectors.dtype == np.float32:
+            return queries @ (self.vectors if rows is None else self.vectors[rows]).T
+        # One reused float32 buffer per scan; the widening copy is the whole
+        # extra cost of a quantized scan over float32
+        scores = np.empty((len(queries), n), dtype=np.float32)
+        buffer = np.empty((min(n, SCAN_BLOCK), self.vectors.shape[1]), dtype=np.float32)
+        for start in range(0, n, SCAN_BLOCK):
+            block = (self.vectors[start:start + SCAN_BLOCK] if rows is None
+                     else self.vectors[rows[start:start + SCAN_BLOCK]])
+            widened = buffer[:len(block)]
+            np.copyto(widened, block, casting="unsafe")
+            scores[:, start:start + len(block)] = queries @ widened.T
+        return scores
+
+    def search(self, query_embeddings, n_results, rows=None):
+        """Return (rows, similarities), each shaped (n_queries, k), best first.
+
+        `rows` (sorted row numbers) restricts the search to those rows.
+        """
+        queries = np.array(query_embeddings, dtype=np.float32, ndmin=2)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        k = min(n_results, len(self.ids) if rows is None else len(rows))
+        if k == 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+
+        scores = self._scan(queries, rows)
+        if not self.rescore:
+            top, sims = _top_k(scores, k)
+            return (top if rows is None else rows[top]), sims
+
+        # Re-rank the quantized shortlist with exact float32 scores
+        candidates, _ = _top_k(scores, min(k * self.rescore, scores.shape[1]))
+        if rows is not None:
+            candidates = rows[candidates]
+        shortlist = np.asarray(self.full[candidates.ravel()], dtype=np.float32)
+        exact = np.einsum("qcd,qd->qc", shortlist.reshape(*candidates.shape, -1), queries)
+        order, sims = _top_k(exact, k)
+        return np.take_along_axis(candidates, order, axis=1), sims
+
+    def query(self, query_embeddings, n_results, where=None):
+        rows, sims = self.search(query_embeddings, n_results,
+                                 rows=self.rows_where(where) if where else None)
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for row_list, sim_list in zip(rows, sims):
+            ids, docs, metas = self._rows(row_list.tolist())
+            results["ids"].append(ids)
+            results["documents"].append(docs)
+            results["metadatas"].append(metas)
+            results["distances"].append((1.0 - sim_list).tolist())
+        return results
+
+    def get(self, ids):
+        rows = [self._row_of[i] for i in ids if i in self._row_of]
+        ids, docs, metas = self._rows(rows)
+        return {"ids": ids, "documents": docs, "metadatas": metas}
+
+
+def where_mask(columns, where, n):
+    """Boolean mask of the n rows whose columnar metadata matches a Chroma `where`"""
+    mask = np.ones(n, dtype=bool)
+    for field, condition in where.items():
+        if field in ("$and", "$or"):
+            masks = [where_mask(columns, clause, n) for clause in condition]
+            mask &= np.logical_and.reduce(masks) if field == "$and" else np.logical_or.reduce(masks)
+            continue
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        column = columns.get(field, [None] * n)
+        for op, operand in condition.items():
+            if op not in _COMPARE:
+                raise ValueError(f"Unsupported where operator: {op!r}")
+            test = _COMPARE[op]
+            mask &= np.fromiter((test(v, operand) for v in column), dtype=bool, count=n)
+    return mask
+
+
+def _top_k(scores, k):
+    """Row-wise top k of a (n_queries, N) score matrix, best first"""
+    if k < scores.shape[1]:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def quantize_int8(matrix):
+    """Symmetric per-dimension int8 quantization → (codes, scales)"""
+    scales = np.abs(matrix).max(axis=0) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(matrix / scales), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def measure_recall(candidate, reference, queries, k):
+    """Mean recall@k of `candidate` against `reference` (e.g. int8 vs float32)"""
+    got, _ = candidate.search(queries, k)
+    want, _ = reference.search(queries, k)
+    return float(np.mean([len(set(g) & set(w)) / max(len(w), 1)
+                          for g, w in zip(got.tolist(), want.tolist())]))
+
+
+def measure_latency(backend, queries, k, repeat=3):
+    """Median ms of a single-query search (what one ask pays), best of `repeat` rounds"""
+    timings = []
+    for _ in range(repeat):
+        for query in queries:
+            started = time.perf_counter()
+            backend.search(query, k)
+            timings.append((time.perf_counter() - started) * 1000)
+    return float(np.median(timings))
+
+
+def save_numpy_index(path, ids, embeddings, documents, metadatas, dtype="float32"):
+    """Write embeddings, documents blob and id/metadata table in the NumpyBackend layout.
+
+    `dtype` "float16" or "int8" also writes a quantized copy and makes it
+    the default one to search; the float32 matrix is always kept for re-scoring and
+    recall checks.
+    """
+    if dtype not in ("float32", *QUANTIZED_FILES):
+        raise ValueError(f"Unsupported index dtype: {dtype!r}")
+    os.makedirs(path, exist_ok=True)
+
+    matrix = np.array(embeddings, dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    # Columnar metadata: one list per field instead of one dict per chunk
+    fields = sorted({name for m in metadatas for name in m})
+    table = {
+        "dtype": dtype,
+        "ids": list(ids),
+        "metadata": {name: [m.get(name) for m in metadatas] for name in fields},
+    }
+
+    encoded = [doc.encode("utf-8") for doc in documents]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(doc) for doc in encoded], out=offsets[1:])
+    np.save(os.path.join(path, DOCUMENTS_FILE), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(os.path.join(path, DOC_OFFSETS_FILE), offsets)
+
+    np.save(os.path.join(path, EMBEDDINGS_FILE), matrix)
+    if dtype == "float16":
+        np.save(os.path.join(path, QUANTIZED_FILES["float16"]), matrix.astype(np.float16))
+    elif dtype == "int8":
+        codes, scales = quantize_int8(matrix)
+        np.save(os.path.join(path, QUANTIZED_FILES["int8"]), codes)
+        np.save(os.path.join(path, SCALES_FILE), scales)
+
+    with open(os.path.join(path, TABLE_FILE), "w", encoding="utf-8") as f:
+        json.dump(table, f, ensure_ascii=False)
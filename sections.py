@@ -0,0 +1,66 @@
+"""
+Sthana / Adhyaya metadata of Charak Samhita pages
+
+`parse_section(title, content)` places a scraped page in the text from
+its title ("Sutra Sthana", "Jwara Chikitsa") or, failing that, the
+"X Sthana Chapter N" header its text opens with. step2_chunk.py tags
+every chunk with the result; app.py lists STHANAS as search filters.
+Stdlib only, so the UI can import it without the build dependencies.
+"""
+
+import re
+
+# carakasamhitaonline spellings of the eight Sthanas
+STHANAS = {
+    "Sutra": r"s[uo]{1,2}tra",
+    "Nidana": r"nidana?",
+    "Vimana": r"vimana?",
+    "Sharira": r"sh?ar(?:i|ee)ra",
+    "Indriya": r"indriya",
+    "Chikitsa": r"c(?:h)?ikitsa",
+    "Kalpa": r"kalpa",
+    "Siddhi": r"siddhi",
+}
+# Chapter page titles end in their Sthana's name ("Jwara Chikitsa",
+# "Rasa Vimana", "Varnasvariyam Indriyam"); Sutra chapters in "Adhyaya"
+CHAPTER_SUFFIXES = {
+    **{name: rf"{pattern}(?:m|tam|itam)?" for name, pattern in STHANAS.items() if name != "Sutra"},
+    "": r"adhyaya",
+}
+HEADER_CHARS = 600   # start of the page text read for an opening "X Sthana Chapter N"
+
+_STHANA_ALT = "|".join(f"(?P<{name}>{pattern})" for name, pattern in STHANAS.items())
+_STHANA_TITLE = re.compile(rf"^(?:{_STHANA_ALT})\s+sthana[mn]?$", re.IGNORECASE)
+_CHAPTER_TITLE = re.compile(
+    r"^.+\s(?:" + "|".join(f"(?P<{name or 'Adhyaya'}>{pattern})" for name, pattern in CHAPTER_SUFFIXES.items())
+    + r")$", re.IGNORECASE)
+_HEADER = re.compile(rf"\b(?:{_STHANA_ALT})\s+sthana[mn]?\b(?:[\s,:.\-–]*(?:chapter|adhyaya)\s+(?P<number>\d+))?",
+                     re.IGNORECASE)
+
+
+def _sthana(match):
+    groups = match.groupdict()
+    name = next((name for name in STHANAS if groups.get(name)), "")
+    return f"{name} Sthana" if name else ""
+
+
+def parse_section(title, content):
+    """{"sthana", "adhyaya", "page_type"} of a page, from its title, else its header"""
+    section = {"sthana": "", "adhyaya": 0, "page_type": "other"}
+    title = title.strip()
+
+    match = _STHANA_TITLE.match(title)
+    if match:
+        return {**section, "sthana": _sthana(match), "page_type": "sthana"}
+    match = _CHAPTER_TITLE.match(title)
+    if match:
+        section.update(sthana=_sthana(match), page_type="adhyaya")
+
+    # Chapter pages open with e.g. "Cikitsa Sthana Chapter 3. Management of Jwara";
+    # only the opening counts, a mention of another chapter later on does not
+    header = _HEADER.match(content[:HEADER_CHARS].lstrip())
+    if header:
+        section["sthana"] = section["sthana"] or _sthana(header)
+        if header.group("number"):
+            section.update(adhyaya=int(header.group("number")), page_type="adhyaya")
+    return section
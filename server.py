@@ -0,0 +1,347 @@
+"""
+Headless HTTP service for Charak Samhita AI
+Run: python server.py                       # http://127.0.0.1:8080
+     python server.py --host 0.0.0.0 --port 9000 --workers 8 --queue 32
+
+Serves rag_engine without the Streamlit runtime, stdlib only:
+
+    POST /v1/ask            {"question": ..., "filters": {...}} → result JSON
+    POST /v1/ask/stream     same body → server-sent events
+    GET  /v1/ask/stream?question=...&sthana=...   (for EventSource clients)
+    GET  /healthz           200 while the process is up
+    GET  /readyz            200 once the model and index are warm, else 503
+    GET  /metrics           Prometheus text (see metrics.py)
+
+SSE events are `sources`, `token` (zero or more) and `done`, each with the
+matching `RagEngine.ask_stream` event as JSON data; a stream that fails
+after it started ends with an `error` event instead of `done`.
+
+Bad requests (including unknown filter fields) get 400 before a slot is
+taken; a failure while answering is a 500, never blamed on the client.
+
+At most WORKERS questions are answered at once; up to QUEUE_SIZE more wait
+for a slot (for at most QUEUE_TIMEOUT_S). Anything beyond that is turned
+away immediately with 503 and a Retry-After estimated from the queue
+length and recent answer times, so a load balancer can try another
+replica. On SIGTERM the service reports not-ready, finishes what it
+holds and exits.
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from metrics import REGISTRY
+from rag_engine import FILTER_FIELDS, LLM_CONCURRENCY, get_engine, where_clause
+
+SERVER_HOST = os.environ.get("CHARAK_HOST", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("CHARAK_PORT", "8080"))
+WORKERS = int(os.environ.get("CHARAK_SERVER_WORKERS", str(LLM_CONCURRENCY)))
+QUEUE_SIZE = int(os.environ.get("CHARAK_QUEUE_SIZE", "32"))
+QUEUE_TIMEOUT_S = 30.0
+DRAIN_TIMEOUT_S = 60.0
+MAX_BODY_BYTES = 16 * 1024
+MAX_QUESTION_CHARS = 2000
+SERVICE_TIME_ALPHA = 0.2    # EWMA weight for the Retry-After estimate
+INITIAL_SERVICE_S = 2.0
+MAX_RETRY_AFTER_S = 60
+UNAVAILABLE_RETRY_AFTER_S = 30   # engine not configured (e.g. no GROQ_API_KEY)
+ROUTES = ("/v1/ask", "/v1/ask/stream", "/healthz", "/readyz", "/metrics")
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Admission:
+    """`workers` running slots plus a bounded queue of waiters"""
+
+    def __init__(self, workers=WORKERS, queue_size=QUEUE_SIZE, queue_timeout=QUEUE_TIMEOUT_S):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._slots = threading.Semaphore(workers)
+        self._lock = threading.Lock()
+        self.admitted = 0            # running + queued
+        self.service_s = INITIAL_SERVICE_S
+
+    def retry_after(self):
+        waves = max(1, math.ceil((self.admitted - self.workers + 1) / self.workers))
+        return min(MAX_RETRY_AFTER_S, max(1, math.ceil(waves * self.service_s)))
+
+    def enter(self):
+        """Take a slot, waiting in the queue if needed; raises Overloaded"""
+        with self._lock:
+            if self.admitted >= self.workers + self.queue_size:
+                raise Overloaded(self.retry_after())
+            self.admitted += 1
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.admitted -= 1
+                retry_after = self.retry_after()
+            raise Overloaded(retry_after)
+        REGISTRY.observe("charak_queue_wait_seconds", time.perf_counter() - started)
+        return time.perf_counter()
+
+    def wait_idle(self, timeout):
+        """True once nothing is running or queued, False if `timeout` passes first"""
+        deadline = time.monotonic() + timeout
+        while self.admitted and time.monotonic() < deadline:
+            time.sleep(0.1)
+        return not self.admitted
+
+    def leave(self, entered):
+        self._slots.release()
+        with self._lock:
+            self.admitted -= 1
+            self.service_s += SERVICE_TIME_ALPHA * (time.perf_counter() - entered - self.service_s)
+
+
+def parse_request(payload):
+    """(question, filters) from a request body or query dict; raises ValueError"""
+    question = payload.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError("'question' must be a non-empty string")
+    if len(question) > MAX_QUESTION_CHARS:
+        raise ValueError(f"'question' is longer than {MAX_QUESTION_CHARS} characters")
+    filters = payload.get("filters") or {field: payload[field] for field in FILTER_FIELDS if field in payload}
+    if not isinstance(filters, dict):
+        raise ValueError("'filters' must be an object")
+    where_clause(filters)        # unknown fields or values that are not str / int
+    return question.strip(), filters
+
+
+def query_payload(query_string):
+    """Request dict from ?question=...&sthana=... (last value wins; adhyaya as int)"""
+    payload = {key: values[-1] for key, values in parse_qs(query_string).items()}
+    if payload.get("adhyaya", "").isdigit():
+        payload["adhyaya"] = int(payload["adhyaya"])
+    return payload
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    # -- responses -----------------------------------------------------
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self._count(status)
+
+    def _send_error(self, status, message, headers=None):
+        self._send_json(status, {"error": message}, headers)
+
+    def _endpoint(self):
+        return urlparse(self.path).path
+
+    def _count(self, status):
+        endpoint = self._endpoint()
+        REGISTRY.inc("charak_http_requests_total", endpoint=endpoint if endpoint in ROUTES else "other",
+                     status=str(status))
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError(f"body larger than {MAX_BODY_BYTES} bytes")
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise ValueError("body is not valid JSON")
+        if not isinstance(payload, dict):
+            raise ValueError("body must be a JSON object")
+        return payload
+
+    # -- routes --------------------------------------------------------
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/healthz":
+            self._send_json(200, {"status": "ok"})
+        elif url.path == "/readyz":
+            ready, reason = self.server.readiness()
+            self._send_json(200 if ready else 503, {"status": "ready" if ready else reason})
+        elif url.path == "/metrics":
+            body = REGISTRY.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif url.path == "/v1/ask/stream":
+            self._handle(query_payload(url.query), stream=True)
+        else:
+            self._send_error(404, f"unknown path {url.path}")
+
+    def do_POST(self):
+        path = self._endpoint()
+        if path not in ("/v1/ask", "/v1/ask/stream"):
+            self.close_connection = True     # the body was not read
+            self._send_error(404, f"unknown path {path}")
+            return
+        try:
+            payload = self._read_json()
+        except ValueError as e:
+            self.close_connection = True
+            self._send_error(400, str(e))
+            return
+        self._handle(payload, stream=path.endswith("/stream"))
+
+    def _handle(self, payload, stream):
+        try:
+            question, filters = parse_request(payload)
+        except ValueError as e:
+            self._send_error(400, str(e))
+            return
+        if self.server.draining:
+            self._send_error(503, "shutting down", {"Retry-After": "1"})
+            return
+        try:
+            entered = self.server.admission.enter()
+        except Overloaded as e:
+            self._send_error(503, "server busy", {"Retry-After": str(e.retry_after)})
+            return
+        try:
+            if stream:
+                self._stream(question, filters)
+            else:
+                self._answer(question, filters)
+        finally:
+            self.server.admission.leave(entered)
+
+    def _internal_error(self, e):
+        print(f"WARNING: answering failed ({type(e).__name__}: {e})")
+        self._send_error(500, "internal error while answering")
+
+    def _answer(self, question, filters):
+        try:
+            result = self.server.engine.ask(question, filters)
+        except Exception as e:
+            self._internal_error(e)
+            return
+        if result.get("unavailable"):
+            self._send_json(503, result, {"Retry-After": str(UNAVAILABLE_RETRY_AFTER_S)})
+        else:
+            self._send_json(200, result)
+
+    def _stream(self, question, filters):
+        events = self.server.engine.ask_stream(question, filters)
+        try:
+            first = next(events)
+        except Exception as e:
+            self._internal_error(e)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for event in itertools.chain([first], events):
+                data = json.dumps({k: v for k, v in event.items() if k != "type"}, ensure_ascii=False)
+                self.wfile.write(f"event: {event['type']}\ndata: {data}\n\n".encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            events.close()           # client went away; stop generating
+        except Exception as e:
+            print(f"WARNING: stream failed ({type(e).__name__}: {e})")
+            try:
+                data = json.dumps({"error": "internal error while answering"})
+                self.wfile.write(f"event: error\ndata: {data}\n\n".encode("utf-8"))
+            except OSError:
+                pass
+        self._count(200)
+
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, engine, workers=WORKERS, queue_size=QUEUE_SIZE):
+        super().__init__(address, QueryHandler)
+        self.engine = engine
+        self.admission = Admission(workers, queue_size)
+        self.warm = threading.Event()
+        self.warm_error = None
+        self.draining = False
+
+    def warm_up(self):
+        """Load the model and index in the background; /readyz turns green after"""
+        def run():
+            try:
+                self.engine.warm_up()
+                self.warm.set()
+            except Exception as e:
+                self.warm_error = str(e)
+                print(f"WARNING: warm-up failed ({e})")
+
+        threading.Thread(target=run, name="charak-warm-up", daemon=True).start()
+
+    def readiness(self):
+        """(ready, reason)"""
+        if self.draining:
+            return False, "draining"
+        if self.warm_error:
+            return False, f"warm-up failed: {self.warm_error}"
+        if not self.warm.is_set():
+            return False, "warming up"
+        unavailable = self.engine._unavailable()
+        if unavailable:
+            return False, unavailable["answer"]
+        return True, "ready"
+
+    def drain(self, timeout=DRAIN_TIMEOUT_S):
+        """Stop taking questions, let the admitted ones finish, then stop serving"""
+        self.draining = True
+
+        def run():
+            self.admission.wait_idle(timeout)
+            self.shutdown()
+
+        threading.Thread(target=run, name="charak-drain", daemon=True).start()
+
+
+def serve(host=SERVER_HOST, port=SERVER_PORT, workers=WORKERS, queue_size=QUEUE_SIZE, engine=None):
+    """Start warming up and return the server (call `serve_forever()` on it)"""
+    server = QueryServer((host, port), engine or get_engine(), workers, queue_size)
+    server.warm_up()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="questions answered at once")
+    parser.add_argument("--queue", type=int, default=QUEUE_SIZE, help="questions allowed to wait")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.workers, args.queue)
+    signal.signal(signal.SIGTERM, lambda *_: server.drain())
+    print(f"🌿 Charak Samhita AI on http://{args.host}:{server.server_address[1]} "
+          f"({args.workers} workers, queue {args.queue}) — warming up...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,157 @@
+"""
+In-flight request coalescing for Charak Samhita AI
+
+When several sessions ask the same question at the same moment (a popular
+example button), only the first one — the leader — embeds, searches and
+calls Groq; the others wait for its result instead of repeating the work
+and spending rate limit. Nothing is kept once the call finishes: reusing
+finished answers is the answer cache's job.
+
+    do(key, fn)        first caller runs fn(); concurrent callers with
+                       the same key get its return value, or its exception
+    stream(key, gen)   gen() runs on a background thread and every caller
+                       iterates the same events, late joiners from the start
+
+`do` and `stream` calls never join each other, even under the same key:
+a result is not a stream of events, nor the other way round.
+
+Each key has a timeout of inactivity: a `do` call is stuck once its
+leader has run that long, a stream once no event has arrived for that
+long (a healthy stream may run far past it). Followers of a stuck call
+give up with `FlightTimeout` (the leader itself never does), and a new
+caller finding a stuck call starts a fresh one rather than queueing
+behind it.
+"""
+
+import threading
+import time
+import unicodedata
+
+COALESCE_TIMEOUT_S = 60.0   # longer than a Groq call's retry deadline
+
+
+class FlightTimeout(TimeoutError):
+    """The shared call did not finish within its key's timeout"""
+
+
+def normalize_question(text):
+    """Case, width and whitespace folded, trailing ?/./! dropped"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return " ".join(text.split()).rstrip("?.! ")
+
+
+class _Call:
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+        self.cond = threading.Condition()
+        self.done = False
+        self.result = None
+        self.error = None
+        self.events = []            # stream calls only
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.deadline
+
+    def finish(self, result=None, error=None):
+        with self.cond:
+            self.result, self.error, self.done = result, error, True
+            self.cond.notify_all()
+
+    def publish(self, event):
+        with self.cond:
+            self.events.append(event)
+            self.deadline = time.monotonic() + self.timeout
+            self.cond.notify_all()
+
+    def wait(self):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.done, timeout=max(self.deadline - time.monotonic(), 0)):
+                raise FlightTimeout("shared call still running after its timeout")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def replay(self, bounded=True):
+        """Every event published so far and until the call ends.
+
+        `bounded` = give up once no event has arrived for the timeout.
+        """
+        position = 0
+        while True:
+            with self.cond:
+                timeout = max(self.deadline - time.monotonic(), 0) if bounded else None
+                ready = self.cond.wait_for(lambda: self.done or position < len(self.events), timeout)
+                if not ready:
+                    raise FlightTimeout("shared stream stalled: no event within its timeout")
+                pending = self.events[position:]
+                position = len(self.events)
+                finished, error = self.done, self.error
+            yield from pending
+            if finished and position == len(self.events):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key"""
+
+    def __init__(self, timeout=COALESCE_TIMEOUT_S):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _join(self, key, timeout):
+        """(call, True if this caller must run it)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and not call.expired:
+                return call, False
+            call = self._calls[key] = _Call(timeout or self.timeout)
+            return call, True
+
+    def _forget(self, key, call):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def do(self, key, fn, timeout=None):
+        """(fn() or the in-flight call's result, True if shared with a leader)"""
+        key = ("do", key)
+        call, leader = self._join(key, timeout)
+        if not leader:
+            return call.wait(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            call.finish(error=e)
+            raise
+        finally:
+            self._forget(key, call)
+        call.finish(result)
+        return result, False
+
+    def stream(self, key, gen_fn, timeout=None):
+        """(iterator over gen_fn()'s events, True if joining a running stream)
+
+        The generator is driven by a background thread, so it runs to the
+        end even if the caller that started it stops reading.
+        """
+        key = ("stream", key)
+        call, leader = self._join(key, timeout)
+        if leader:
+            def produce():
+                try:
+                    for event in gen_fn():
+                        call.publish(event)
+                except BaseException as e:
+                    call.finish(error=e)
+                else:
+                    call.finish()
+                finally:
+                    self._forget(key, call)
+
+            threading.Thread(target=produce, name="singleflight-stream", daemon=True).start()
+        return call.replay(bounded=not leader), not leader
@@ -0,0 +1,255 @@
+"""
+Single-file index snapshots for Charak Samhita AI
+
+A snapshot is one uncompressed zip archive built by step3_embed.py:
+
+    manifest.json          format version, embedding model and runtime,
+                           dimension, chunk count, dtype, corpus hash and
+                           the sha256 of every other member
+    table.json             ids and columnar metadata
+    embeddings.npy         float32 matrix (+ the quantized copy, if any)
+    documents.npy          chunk texts as one UTF-8 blob (+ doc_offsets.npy)
+    bm25_*.npy             step2's BM25 arrays (see sparse_index.py), if built
+
+Members are stored, not deflated, and every .npy starts on a 64-byte
+boundary, so the matrices are memory-mapped straight out of the archive:
+opening a snapshot reads the manifest and table and maps the rest, with
+nothing extracted to disk, and chunk texts are decoded only when returned.
+`verify_snapshot` re-hashes every member against the manifest;
+`open_snapshot` does so on request. With the BM25 arrays packed in, the
+snapshot is the whole deploy artifact for hybrid search too, and the
+packed BM25 index is checked against the chunk ids when it is built.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import zipfile
+
+import numpy as np
+
+from retrieval import TABLE_FILE, NumpyBackend
+from sparse_index import BM25Index
+
+SNAPSHOT_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
+ALIGNMENT = 64
+_PADDING_ID = 0xD935          # extra-field id used to align members (as zipalign does)
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+BM25_ARRAYS = ("ids", "terms", "offsets", "postings", "tfs", "doc_lens")
+BM25_PREFIX = "bm25_"
+
+
+class SnapshotError(Exception):
+    """Snapshot missing, corrupt, of an unknown format or for another model"""
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def corpus_hash(ids, content_hashes):
+    """One hash over every (id, content_hash) pair, independent of row order"""
+    digest = hashlib.sha256()
+    for chunk_id, value in sorted(zip(ids, content_hashes)):
+        digest.update(f"{chunk_id}\0{value or ''}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+# ── Write ────────────────────────────────────────────────────────────
+def _write_aligned(archive, name, path):
+    """Store `path` uncompressed with its data starting on an ALIGNMENT boundary"""
+    info = zipfile.ZipInfo.from_file(path, arcname=name)
+    info.compress_type = zipfile.ZIP_STORED
+    data_start = archive.fp.tell() + _LOCAL_HEADER.size + len(name.encode("utf-8"))
+    pad = (-(data_start + 4)) % ALIGNMENT
+    info.extra = struct.pack("<HH", _PADDING_ID, pad) + b"\0" * pad
+    with open(path, "rb") as src, archive.open(info, "w") as dst:
+        for block in iter(lambda: src.read(1 << 20), b""):
+            dst.write(block)
+
+
+def _bm25_members(bm25_path, ids, scratch):
+    """{member name: path} of step2's BM25 arrays as .npy files in `scratch`"""
+    with np.load(bm25_path, allow_pickle=False) as data:
+        arrays = {name: data[name] for name in BM25_ARRAYS}
+    if set(arrays["ids"].tolist()) != set(ids):
+        raise SnapshotError(f"{bm25_path} does not index the same chunks as the embeddings; "
+                            f"re-run step2_chunk.py and step3_embed.py")
+    members = {}
+    for name, array in arrays.items():
+        members[f"{BM25_PREFIX}{name}.npy"] = path = os.path.join(scratch, f"{BM25_PREFIX}{name}.npy")
+        np.save(path, array)
+    return members
+
+
+def write_snapshot(snapshot_path, index_dir, embedding_model, embedding_runtime="torch", bm25_path=None):
+    """Pack a NumPy index directory (see retrieval.save_numpy_index) into one file.
+
+    `bm25_path` (step2's .npz) is packed in as well; raises SnapshotError
+    when it indexes other chunks than the embeddings.
+    """
+    with open(os.path.join(index_dir, TABLE_FILE), "r", encoding="utf-8") as f:
+        table = json.load(f)
+    members = {n: os.path.join(index_dir, n) for n in sorted(os.listdir(index_dir))
+               if n == TABLE_FILE or n.endswith(".npy")}
+    embeddings = np.load(os.path.join(index_dir, "embeddings.npy"), mmap_mode="r")
+
+    with tempfile.TemporaryDirectory(prefix="charak_bm25_") as scratch:
+        if bm25_path:
+            members.update(_bm25_members(bm25_path, table["ids"], scratch))
+
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "embedding_model": embedding_model,
+            "embedding_runtime": embedding_runtime,
+            "dimension": int(embeddings.shape[1]),
+            "chunks": len(table["ids"]),
+            "dtype": table.get("dtype", "float32"),
+            "corpus_hash": corpus_hash(table["ids"], table["metadata"].get("content_hash",
+                                                                           [None] * len(table["ids"]))),
+            "bm25": bool(bm25_path),
+            "files": {name: _sha256_file(path) for name, path in members.items()},
+        }
+
+        # Written next to the target and renamed, so readers never see half a file
+        tmp_path = f"{snapshot_path}.tmp"
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as archive:
+            archive.writestr(MANIFEST_FILE, json.dumps(manifest, indent=2))
+            for name, path in members.items():
+                _write_aligned(archive, name, path)
+    os.replace(tmp_path, snapshot_path)
+    return manifest
+
+
+# ── Read ─────────────────────────────────────────────────────────────
+def read_manifest(snapshot_path):
+    try:
+        with zipfile.ZipFile(snapshot_path) as archive:
+            manifest = json.loads(archive.read(MANIFEST_FILE))
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+        raise SnapshotError(f"{snapshot_path}: not a readable index snapshot ({e})") from e
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"{snapshot_path}: snapshot format {manifest.get('format')!r}, "
+                            f"this version reads format {SNAPSHOT_FORMAT}")
+    return manifest
+
+
+def _data_offset(f, info):
+    """Offset of a stored member's bytes in the archive file"""
+    f.seek(info.header_offset)
+    header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+    return info.header_offset + _LOCAL_HEADER.size + header[10] + header[11]
+
+
+def _map_npy(snapshot_path, f, info):
+    """np.memmap over a stored .npy member, without copying it out"""
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise SnapshotError(f"{snapshot_path}: {info.filename} is compressed and cannot be mapped")
+    f.seek(_data_offset(f, info))
+    version = np.lib.format.read_magic(f)
+    read_header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                   else np.lib.format.read_array_header_2_0)
+    shape, fortran_order, dtype = read_header(f)
+    return np.memmap(snapshot_path, dtype=dtype, mode="r", offset=f.tell(),
+                     shape=shape, order="F" if fortran_order else "C")
+
+
+def verify_snapshot(snapshot_path, manifest=None):
+    """Re-hash every member against the manifest; raise SnapshotError on mismatch"""
+    manifest = manifest or read_manifest(snapshot_path)
+    with zipfile.ZipFile(snapshot_path) as archive:
+        for name, expected in manifest["files"].items():
+            digest = hashlib.sha256()
+            try:
+                with archive.open(name) as member:
+                    for block in iter(lambda: member.read(1 << 20), b""):
+                        digest.update(block)
+            except KeyError as e:
+                raise SnapshotError(f"{snapshot_path}: {name} listed in manifest but missing") from e
+            except zipfile.BadZipFile as e:
+                raise SnapshotError(f"{snapshot_path}: {name} is corrupt ({e})") from e
+            if digest.hexdigest() != expected:
+                raise SnapshotError(f"{snapshot_path}: checksum mismatch for {name}")
+    return manifest
+
+
+def open_snapshot(snapshot_path, embedding_model=None, embedding_runtime=None, dtype=None,
+                  rescore=0, verify=False):
+    """(NumpyBackend, manifest) mapped from the snapshot file.
+
+    Raises SnapshotError when the snapshot was built with a different
+    `embedding_model` or `embedding_runtime` (snapshots that predate the
+    runtime field were built with torch); `verify=True` also checks every
+    member's sha256.
+    """
+    manifest = read_manifest(snapshot_path)
+    if embedding_model and manifest["embedding_model"] != embedding_model:
+        raise SnapshotError(
+            f"{snapshot_path} was built with embedding model {manifest['embedding_model']!r} "
+            f"but this engine embeds questions with {embedding_model!r}; rebuild it with "
+            f"step3_embed.py --snapshot or point the engine at the matching model"
+        )
+    built_runtime = manifest.get("embedding_runtime", "torch")
+    if embedding_runtime and built_runtime != embedding_runtime:
+        raise SnapshotError(
+            f"{snapshot_path} was built with the {built_runtime!r} embedding runtime but this "
+            f"engine embeds questions with {embedding_runtime!r}; rebuild it with "
+            f"step3_embed.py --runtime {embedding_runtime} --snapshot or set "
+            f"CHARAK_EMBEDDING_RUNTIME={built_runtime}"
+        )
+    if verify:
+        verify_snapshot(snapshot_path, manifest)
+
+    with zipfile.ZipFile(snapshot_path) as archive, open(snapshot_path, "rb") as f:
+        try:
+            table_bytes = archive.read(TABLE_FILE)
+        except (KeyError, zipfile.BadZipFile) as e:
+            raise SnapshotError(f"{snapshot_path}: unreadable {TABLE_FILE} ({e})") from e
+        # The table is read in full anyway, so its checksum is always checked
+        if hashlib.sha256(table_bytes).hexdigest() != manifest["files"].get(TABLE_FILE):
+            raise SnapshotError(f"{snapshot_path}: checksum mismatch for {TABLE_FILE}")
+        table = json.loads(table_bytes)
+        arrays = {info.filename: _map_npy(snapshot_path, f, info)
+                  for info in archive.infolist() if info.filename.endswith(".npy")}
+
+    if len(table["ids"]) != manifest["chunks"]:
+        raise SnapshotError(f"{snapshot_path}: manifest lists {manifest['chunks']} chunks, "
+                            f"table has {len(table['ids'])}")
+    try:
+        backend = NumpyBackend.from_table(table, arrays.get, dtype=dtype, rescore=rescore,
+                                          source=snapshot_path)
+    except ValueError as e:
+        raise SnapshotError(str(e)) from e
+    return backend, manifest
+
+
+def open_snapshot_bm25(snapshot_path, manifest=None):
+    """BM25Index mapped from the snapshot, or None when it was built without one"""
+    manifest = manifest or read_manifest(snapshot_path)
+    if not manifest.get("bm25"):
+        return None
+    with zipfile.ZipFile(snapshot_path) as archive, open(snapshot_path, "rb") as f:
+        try:
+            arrays = {name: _map_npy(snapshot_path, f, archive.getinfo(f"{BM25_PREFIX}{name}.npy"))
+                      for name in BM25_ARRAYS}
+        except KeyError as e:
+            raise SnapshotError(f"{snapshot_path}: manifest lists a BM25 index but {e} is missing") from e
+    return BM25Index(**arrays)
+
+
+if __name__ == "__main__":
+    import sys
+
+    for path in sys.argv[1:] or ["./charak_index.snapshot"]:
+        manifest = verify_snapshot(path)
+        print(f"✅ {path}: {manifest['chunks']} chunks, {manifest['embedding_model']} "
+              f"[{manifest.get('embedding_runtime', 'torch')}] "
+              f"({manifest['dimension']}d, {manifest['dtype']}"
+              f"{', + BM25' if manifest.get('bm25') else ''}), checksums OK")
@@ -0,0 +1,153 @@
+"""
+Sparse BM25 index for Charak Samhita AI
+
+MiniLM has never seen most Sanskrit terms ("Deerghanjiviteeya", "Vata",
+"Panchakarma"), so dense search alone often misses the one chunk that
+literally contains the word. This inverted index is built once by
+step2_chunk.py and queried next to the dense backend; the two rankings are
+merged with reciprocal rank fusion.
+
+On disk the index is a single .npz of flat arrays (CSR layout):
+
+    ids           chunk id per document row
+    terms         sorted vocabulary
+    offsets       postings of terms[t] live in [offsets[t], offsets[t + 1])
+    postings      document rows, int32
+    tfs           term frequencies, uint16
+    doc_lens      tokens per document, int32
+"""
+
+import re
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+K1 = 1.5
+B = 0.75
+RRF_K = 60
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Lowercase word tokens with diacritics folded (Vāta → vata)"""
+    folded = unicodedata.normalize("NFKD", text.lower())
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return _TOKEN.findall(folded)
+
+
+class BM25Builder:
+    """Accumulates postings one chunk at a time; call save() at the end"""
+
+    def __init__(self):
+        self.ids = []
+        self.doc_lens = []
+        self._postings = {}   # term -> ([rows], [tfs])
+
+    def add(self, chunk_id, text):
+        row = len(self.ids)
+        tokens = tokenize(text)
+        self.ids.append(chunk_id)
+        self.doc_lens.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            rows, tfs = self._postings.setdefault(term, ([], []))
+            rows.append(row)
+            tfs.append(min(tf, np.iinfo(np.uint16).max))
+
+    def arrays(self):
+        terms = sorted(self._postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        postings, tfs = [], []
+        for i, term in enumerate(terms):
+            rows, counts = self._postings[term]
+            postings.extend(rows)
+            tfs.extend(counts)
+            offsets[i + 1] = len(postings)
+        return {
+            "ids": np.array(self.ids, dtype=str),
+            "terms": np.array(terms, dtype=str),
+            "offsets": offsets,
+            "postings": np.array(postings, dtype=np.int32),
+            "tfs": np.array(tfs, dtype=np.uint16),
+            "doc_lens": np.array(self.doc_lens, dtype=np.int32),
+        }
+
+    def save(self, path):
+        np.savez_compressed(path, **self.arrays())
+
+
+class BM25Index:
+    def __init__(self, ids, terms, offsets, postings, tfs, doc_lens, k1=K1, b=B):
+        self.ids = [str(i) for i in ids]
+        self.offsets = offsets
+        self.postings = postings
+        self.tfs = tfs.astype(np.float32)
+        self.k1 = k1
+        self.b = b
+        self._term_row = {str(t): i for i, t in enumerate(terms)}
+        self._row_of = None   # chunk id → row, built by the first mask()
+
+        doc_lens = doc_lens.astype(np.float32)
+        avg_len = float(doc_lens.mean()) if len(doc_lens) else 1.0
+        # Per-document length normalisation is query independent
+        self._norm = k1 * (1 - b + b * doc_lens / max(avg_len, 1e-9))
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["ids"], data["terms"], data["offsets"], data["postings"],
+                       data["tfs"], data["doc_lens"], **kwargs)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def mask(self, chunk_ids):
+        """Boolean row mask selecting `chunk_ids`, for `search(allowed=...)`"""
+        if self._row_of is None:
+            self._row_of = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        mask = np.zeros(len(self.ids), dtype=bool)
+        mask[[self._row_of[i] for i in chunk_ids if i in self._row_of]] = True
+        return mask
+
+    def search(self, query, n_results, allowed=None):
+        """Return [(chunk_id, score), ...] best first; only docs sharing a term.
+
+        `allowed` (a boolean mask from `mask`) restricts the hits to those rows.
+        """
+        n_docs = len(self.ids)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        matched = False
+
+        for term in set(tokenize(query)):
+            t = self._term_row.get(term)
+            if t is None:
+                continue
+            start, end = self.offsets[t], self.offsets[t + 1]
+            rows = self.postings[start:end]
+            tf = self.tfs[start:end]
+            df = end - start
+            idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + self._norm[rows])
+            matched = True
+
+        if not matched:
+            return []
+        if allowed is not None:
+            scores[~allowed] = 0
+        hits = np.flatnonzero(scores)
+        if len(hits) == 0:
+            return []
+        k = min(n_results, len(hits))
+        top = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[r], float(scores[r])) for r in top]
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Merge several ranked id lists; returns [(id, fused_score), ...] best first"""
+    fused = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: -item[1])
@@ -1,102 +1,235 @@
 """
 STEP 1: Scrape all pages from carakasamhitaonline.com
 Run: python step1_scrape.py
+
+Pages are fetched by MAX_WORKERS threads sharing one pooled session,
+throttled by a token bucket so the server never sees more than
+REQUESTS_PER_SECOND. TextExtracts returns full-page plain text for only
+one page per call (several need `exintro`), so titles go one per request
+and the workers fetch them in parallel; larger batches would only turn
+into sequential continuation calls inside one worker. Every finished
+page is appended as one JSON line to OUTPUT_FILE, so an interrupted run
+resumes by reading back only the titles.
+
+Each record carries the page's `revid` and `touched` timestamp. Later runs
+list the current revision of every page in bulk (500 per call) and fetch
+only pages that are new or whose revision changed; deleted pages get a
+`{"title": ..., "deleted": true}` tombstone. The latest line for a title
+wins. CHANGES_FILE lists the added / modified / deleted titles of the run.
 """
 
-import requests
 import json
-import time
 import os
+import threading
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-API_URL = "https://www.carakasamhitaonline.com/api.php"
-OUTPUT_FILE = "charak_samhita_raw.json"
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-def get_all_page_titles():
-    """Fetch all page titles using MediaWiki API"""
-    titles = []
+API_URL = "https://www.carakasamhitaonline.com/api.php"
+OUTPUT_FILE = "charak_samhita_raw.jsonl"
+CHANGES_FILE = "charak_changes.json"
+
+MAX_WORKERS = 4
+REQUESTS_PER_SECOND = 2.0   # be respectful to the server
+TITLES_PER_REQUEST = 1      # full-page extracts: exlimit is 1 unless exintro is set
+
+
+class TokenBucket:
+    """Thread-safe rate limiter: `rate` tokens per second, bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def make_session(pool_size=MAX_WORKERS):
+    """Keep-alive session with a connection per worker and retry on 429/5xx"""
+    session = requests.Session()
+    retry = Retry(total=5, backoff_factor=1.0, status_forcelist=[429, 500, 502, 503, 504],
+                  respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = "CharakSamhitaAI/1.0 (RAG corpus builder)"
+    return session
+
+
+def api_get(session, bucket, params, api_url=API_URL):
+    bucket.acquire()
+    response = session.get(api_url, params={**params, "format": "json"}, timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_all_page_revisions(session, bucket, api_url=API_URL):
+    """Current {title: {"revid", "touched"}} of every main-namespace page"""
+    revisions = {}
     params = {
         "action": "query",
-        "list": "allpages",
-        "aplimit": "500",
-        "apnamespace": "0",  # main content only
-        "format": "json"
+        "generator": "allpages",
+        "gaplimit": "500",
+        "gapnamespace": "0",  # main content only
+        "prop": "info",
     }
 
-    print("📚 Fetching all page titles...")
+    print("📚 Fetching page revisions...")
     while True:
-        response = requests.get(API_URL, params=params, timeout=30)
-        data = response.json()
-        pages = data["query"]["allpages"]
-        titles.extend([p["title"] for p in pages])
-        print(f"  Found {len(titles)} titles so far...")
+        data = api_get(session, bucket, params, api_url)
+        for page in data.get("query", {}).get("pages", {}).values():
+            revisions[page["title"]] = {"revid": page.get("lastrevid"), "touched": page.get("touched")}
+        print(f"  Found {len(revisions)} pages so far...")
 
         if "continue" in data:
-            params["apcontinue"] = data["continue"]["apcontinue"]
+            params.update(data["continue"])
         else:
             break
 
-    print(f"✅ Total pages found: {len(titles)}")
-    return titles
+    print(f"✅ Total pages found: {len(revisions)}")
+    return revisions
 
 
-def get_page_content(title):
-    """Get plain text content of a single page"""
+def get_pages_content(session, bucket, titles, api_url=API_URL):
+    """Text + revision of `titles`, following `extracts` continuation for all but the first"""
     params = {
         "action": "query",
-        "titles": title,
-        "prop": "extracts",
-        "explaintext": True,
-        "format": "json"
+        "titles": "|".join(titles),
+        "prop": "extracts|info",
+        "explaintext": "1",
+        "exlimit": "max",
     }
-    response = requests.get(API_URL, params=params, timeout=30)
-    data = response.json()
-    pages = data["query"]["pages"]
-    page = next(iter(pages.values()))
-    return page.get("extract", "")
-
-
-def scrape_all():
-    # Load already scraped titles to resume if interrupted
-    already_scraped = set()
-    all_data = []
-
-    if os.path.exists(OUTPUT_FILE):
-        with open(OUTPUT_FILE, "r", encoding="utf-8") as f:
-            all_data = json.load(f)
-            already_scraped = {d["title"] for d in all_data}
-        print(f"🔄 Resuming... already have {len(already_scraped)} pages")
-
-    titles = get_all_page_titles()
-
-    for i, title in enumerate(titles):
-        if title in already_scraped:
-            continue
-
-        try:
-            print(f"[{i+1}/{len(titles)}] Scraping: {title}")
-            content = get_page_content(title)
-            if content and len(content) > 100:
-                all_data.append({
-                    "title": title,
-                    "url": f"https://www.carakasamhitaonline.com/index.php/{title.replace(' ', '_')}",
-                    "content": content
-                })
-        except Exception as e:
-            print(f"  ⚠️ Error scraping {title}: {e}")
-
-        # Save every 50 pages to avoid losing progress
-        if (i + 1) % 50 == 0:
-            with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-                json.dump(all_data, f, ensure_ascii=False, indent=2)
-            print(f"  💾 Saved {len(all_data)} pages so far...")
-
-        time.sleep(0.5)  # be respectful to the server
-
-    # Final save
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(all_data, f, ensure_ascii=False, indent=2)
-
-    print(f"\n✅ Done! Scraped {len(all_data)} pages → saved to {OUTPUT_FILE}")
+    contents = {}
+    while True:
+        data = api_get(session, bucket, params, api_url)
+        for page in data.get("query", {}).get("pages", {}).values():
+            if "extract" in page:
+                contents[page["title"]] = {
+                    "content": page["extract"],
+                    "revid": page.get("lastrevid"),
+                    "touched": page.get("touched"),
+                }
+        # Servers may hand back fewer extracts than asked and continue the rest
+        if "continue" in data:
+            params.update(data["continue"])
+        else:
+            return contents
+
+
+def load_scraped_revisions(path=OUTPUT_FILE):
+    """{title: revid} of the latest record per page, read line by line"""
+    revisions = {}
+    if not os.path.exists(path):
+        return revisions
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                title = record["title"]
+            except (ValueError, KeyError):
+                continue  # torn last line from an interrupted run
+            if record.get("deleted"):
+                revisions.pop(title, None)
+            else:
+                revisions[title] = record.get("revid")
+    return revisions
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def page_record(title, page):
+    return {
+        "title": title,
+        "url": f"https://www.carakasamhitaonline.com/index.php/{title.replace(' ', '_')}",
+        "revid": page["revid"],
+        "touched": page["touched"],
+        "content": page["content"]
+    }
+
+
+def scrape_all(api_url=API_URL, output_file=OUTPUT_FILE, changes_file=CHANGES_FILE,
+               max_workers=MAX_WORKERS, requests_per_second=REQUESTS_PER_SECOND,
+               batch_size=TITLES_PER_REQUEST):
+    session = make_session(max_workers)
+    bucket = TokenBucket(requests_per_second, capacity=max_workers)
+
+    # Only {title: revid} is read back from earlier runs, not the content
+    local = load_scraped_revisions(output_file)
+    if local:
+        print(f"🔄 Refreshing... already have {len(local)} pages")
+
+    remote = get_all_page_revisions(session, bucket, api_url)
+    added = [t for t in remote if t not in local]
+    modified = [t for t in remote if t in local and local[t] != remote[t]["revid"]]
+    deleted = [t for t in local if t not in remote]
+    print(f"🔍 {len(added)} new, {len(modified)} edited, {len(deleted)} deleted pages")
+
+    titles = added + modified
+    batches = [titles[i:i + batch_size] for i in range(0, len(titles), batch_size)]
+    print(f"⚡ Fetching {len(titles)} pages in {len(batches)} requests with {max_workers} workers...")
+
+    fetched = set()
+    started = time.time()
+    with open(output_file, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=max_workers) as pool:
+        if out.tell() and not _ends_with_newline(output_file):
+            out.write("\n")  # seal a torn last line before appending
+
+        for title in deleted:
+            out.write(json.dumps({"title": title, "deleted": True}, ensure_ascii=False) + "\n")
+
+        futures = {pool.submit(get_pages_content, session, bucket, batch, api_url): batch
+                   for batch in batches}
+        for done, future in enumerate(as_completed(futures), 1):
+            batch = futures[future]
+            try:
+                pages = future.result()
+            except Exception as e:
+                print(f"  ⚠️ Error scraping {batch[0]} … {batch[-1]}: {e}")
+                continue
+
+            for title in batch:
+                if title in pages:
+                    out.write(json.dumps(page_record(title, pages[title]), ensure_ascii=False) + "\n")
+                    fetched.add(title)
+            out.flush()
+            print(f"  [{done}/{len(batches)}] {len(fetched)} pages saved "
+                  f"({len(fetched) / max(time.time() - started, 1e-9):.1f} pages/s)")
+
+    # Pages that failed to fetch stay out of the manifest and are retried next run
+    changes = {
+        "generated": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "added": [t for t in added if t in fetched],
+        "modified": [t for t in modified if t in fetched],
+        "deleted": deleted,
+    }
+    with open(changes_file, "w", encoding="utf-8") as f:
+        json.dump(changes, f, ensure_ascii=False, indent=2)
+
+    print(f"\n✅ Done! {len(changes['added'])} added, {len(changes['modified'])} modified, "
+          f"{len(deleted)} deleted → {output_file} (changes in {changes_file})")
+    return changes
 
 
 if __name__ == "__main__":
@@ -1,26 +1,67 @@
 """
 STEP 2: Clean and chunk scraped data
 Run: python step2_chunk.py
+     python step2_chunk.py --mode tokens   # chunks sized for the embedding model
+
+Streams step1's JSONL file through a process pool (one worker per core)
+and writes one chunk per line to OUTPUT_FILE. Only a bounded window of
+pages is in flight at a time and results are written back in input order,
+so chunk IDs and ordering are the same on every run.
+
+"words" mode cuts fixed CHUNK_SIZE word windows. "tokens" mode packs whole
+sentences into chunks of at most CHUNK_TOKENS wordpieces of the embedding
+model's tokenizer (MiniLM only sees 256), overlapping by OVERLAP_TOKENS,
+and records each chunk's `n_tokens`.
+
+Every chunk also carries its page's place in the text (see sections.py):
+`sthana` ("Sutra Sthana", … or "" when unknown), `adhyaya` (chapter
+number, 0 when unknown) and `page_type` ("sthana" overview, "adhyaya"
+chapter or "other"). step3 stores them as metadata so rag_engine can
+restrict a search to part of the corpus.
 """
 
+import argparse
 import json
+import os
 import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from sections import parse_section
+from sparse_index import BM25Builder
 
-INPUT_FILE = "charak_samhita_raw.json"
-OUTPUT_FILE = "charak_chunks.json"
+INPUT_FILE = "charak_samhita_raw.jsonl"
+OUTPUT_FILE = "charak_chunks.jsonl"
+BM25_FILE = "charak_bm25.npz"   # sparse index for hybrid search in rag_engine
 
 CHUNK_SIZE = 400   # words per chunk
 OVERLAP = 50       # overlapping words for better context
+MIN_WORDS = 50     # skip tiny chunks
+
+# Token mode — budgets in wordpieces of TOKENIZER_MODEL
+TOKENIZER_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+CHUNK_TOKENS = 240   # leaves room for [CLS]/[SEP] inside the 256 window
+OVERLAP_TOKENS = 32
+MIN_TOKENS = 48
+
+PAGES_PER_TASK = 16          # pages handed to a worker at once
+TASKS_PER_WORKER = 2         # in-flight tasks per worker (bounds memory)
+
+# Section headers, [edit] tags, wiki templates and URLs in a single pass
+_STRIP = re.compile(r'==+.*?==+|\[.*?\]|\{\{.*?\}\}|http\S+')
+# Max 2 newlines and collapsed spaces in a single pass
+_SPACE = re.compile(r'(\n{3,})|[ \t]+')
+# Sentence ends (incl. Devanagari danda) or paragraph breaks
+_SENTENCE = re.compile(r'(?<=[.!?।॥])\s+|\n{2,}')
+
+_tokenizer = None   # per worker process, see _init_worker
 
 
 def clean_text(text):
     """Clean raw wiki text"""
-    text = re.sub(r'==+.*?==+', '', text)        # remove section headers
-    text = re.sub(r'\[.*?\]', '', text)            # remove [edit] tags
-    text = re.sub(r'\{\{.*?\}\}', '', text)        # remove wiki templates
-    text = re.sub(r'http\S+', '', text)            # remove URLs
-    text = re.sub(r'\n{3,}', '\n\n', text)         # max 2 newlines
-    text = re.sub(r'[ \t]+', ' ', text)            # collapse spaces
+    text = _STRIP.sub('', text)
+    text = _SPACE.sub(lambda m: '\n\n' if m.group(1) else ' ', text)
     return text.strip()
 
 
@@ -31,50 +72,249 @@ def chunk_text(text, title, chunk_size=CHUNK_SIZE, overlap=OVERLAP):
     step = chunk_size - overlap
 
     for i in range(0, len(words), step):
-        chunk = " ".join(words[i:i + chunk_size])
-        if len(chunk.split()) > 50:  # skip tiny chunks
+        piece = words[i:i + chunk_size]
+        if len(piece) > MIN_WORDS:
             chunks.append({
                 "id": f"{title}_chunk_{len(chunks)}",
                 "title": title,
                 "chunk_index": len(chunks),
-                "text": chunk
+                "text": " ".join(piece)
             })
 
     return chunks
 
 
-def process_all():
-    print(f"📂 Loading {INPUT_FILE}...")
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        raw_data = json.load(f)
+def load_tokenizer(model=TOKENIZER_MODEL):
+    from tokenizers import Tokenizer
+    return Tokenizer.from_pretrained(model)
 
-    print(f"Found {len(raw_data)} pages. Processing...")
 
-    all_chunks = []
-    skipped = 0
+def _sentence_pieces(text, tokenizer, budget, overlap=0):
+    """[(text, n_tokens), ...] per sentence, none over `budget - overlap`
 
-    for page in raw_data:
-        title = page["title"]
-        content = page.get("content", "")
+    Longer sentences are split, so the overlap carried from the previous
+    chunk always fits next to any piece.
+    """
+    sentences = [s.strip() for s in _SENTENCE.split(text) if s and s.strip()]
+    pieces = []
+    for sentence, enc in zip(sentences, tokenizer.encode_batch(sentences, add_special_tokens=False)):
+        n = len(enc.ids)
+        step = budget - overlap
+        if n <= step:
+            pieces.append((sentence, n))
+            continue
+        for i in range(0, n, step):
+            span = enc.offsets[i:i + step]
+            pieces.append((sentence[span[0][0]:span[-1][1]], len(span)))
+    return pieces
+
+
+def _split_piece(text, tokenizer, k):
+    """(first k wordpieces of text, rest), each as (text, n_tokens)"""
+    enc = tokenizer.encode(text, add_special_tokens=False)
+    head = text[:enc.offsets[k - 1][1]]
+    rest = text[enc.offsets[k][0]:]
+    return (head, k), (rest, len(enc.ids) - k)
+
+
+def _last_tokens(text, tokenizer, k):
+    """Last k wordpieces of text as (text, k)"""
+    enc = tokenizer.encode(text, add_special_tokens=False)
+    return text[enc.offsets[-k][0]:], k
+
+
+def chunk_tokens(text, title, tokenizer, budget=CHUNK_TOKENS, overlap=OVERLAP_TOKENS):
+    """Pack whole sentences into chunks of at most `budget` wordpieces"""
+    chunks = []
+    current, size = [], 0
+
+    def emit():
+        if size >= MIN_TOKENS:
+            chunks.append({
+                "id": f"{title}_chunk_{len(chunks)}",
+                "title": title,
+                "chunk_index": len(chunks),
+                "text": " ".join(piece for piece, _ in current),
+                "n_tokens": size
+            })
+
+    for piece, n in _sentence_pieces(text, tokenizer, budget, overlap):
+        if current and size + n > budget:
+            if size < MIN_TOKENS:
+                # Too short to stand alone: top it up with the start of this sentence
+                head, (piece, n) = _split_piece(piece, tokenizer, budget - size)
+                current.append(head)
+                size += head[1]
+            emit()
+            # Carry the last `overlap` tokens into the next chunk: whole trailing
+            # sentences, topped up with the end of the sentence that does not fit
+            tail, tail_size = [], 0
+            for prev, m in reversed(current):
+                if tail_size + m > overlap:
+                    if tail_size < overlap:
+                        tail.insert(0, _last_tokens(prev, tokenizer, overlap - tail_size))
+                        tail_size = overlap
+                    break
+                tail.insert(0, (prev, m))
+                tail_size += m
+            current, size = tail, tail_size
+        current.append((piece, n))
+        size += n
+
+    if current:
+        emit()
+    return chunks
+
+
+def _init_worker(mode):
+    global _tokenizer
+    if mode == "tokens":
+        _tokenizer = load_tokenizer()
+
+
+def chunk_page(title, content, mode="words"):
+    """Chunks of one page, each tagged with the page's section metadata"""
+    if mode == "tokens":
+        chunks = chunk_tokens(clean_text(content), title, _tokenizer)
+    else:
+        chunks = chunk_text(clean_text(content), title)
+    section = parse_section(title, content)
+    for chunk in chunks:
+        chunk.update(section)
+    return chunks
+
+
+def chunk_pages(pages, mode="words"):
+    """Worker task: [(title, content), ...] -> [[chunk, ...] per page]"""
+    return [chunk_page(title, content, mode) for title, content in pages]
+
+
+_TITLE_PREFIX = b'{"title": '     # step1 writes every record title first
+_TOMBSTONE_TAIL = ', "deleted": true}'
+_TITLE_WINDOW = 4096               # bytes decoded to read a title
+_DECODER = json.JSONDecoder()
+
+
+def peek_title(line):
+    """(title, deleted) of a step1 record, reading only its leading title key.
+
+    Falls back to parsing the whole line for records that do not start with
+    the title; (None, False) for a line that is not a record at all.
+    """
+    if line.startswith(_TITLE_PREFIX):
+        head = line[:_TITLE_WINDOW].decode("utf-8", errors="ignore")
+        try:
+            title, end = _DECODER.raw_decode(head, len(_TITLE_PREFIX))
+        except ValueError:
+            title = None
+        if isinstance(title, str):
+            return title, head.startswith(_TOMBSTONE_TAIL, end)
+    try:
+        record = json.loads(line)
+        return record["title"], bool(record.get("deleted"))
+    except (ValueError, KeyError, TypeError):
+        return None, False
 
+
+def iter_pages(path=INPUT_FILE):
+    """Stream pages from step1's JSONL file; the latest record per title wins.
+
+    A first pass reads only each record's title and remembers its byte
+    offset, so page content is neither decoded nor kept. The second pass
+    seeks to each title's latest record and parses just that one. A torn
+    line from an interrupted step1 run does not parse and is skipped, as in
+    step1's own `load_scraped_revisions`, so the title's previous record
+    wins instead.
+    """
+    offsets = {}        # title → offsets of its records, None for a tombstone
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                title, deleted = peek_title(line)
+                if title is not None:
+                    offsets.setdefault(title, []).append(None if deleted else offset)
+            offset += len(line)
+
+    with open(path, "rb") as f:
+        for history in offsets.values():
+            for offset in reversed(history):
+                if offset is None:
+                    break
+                f.seek(offset)
+                try:
+                    page = json.loads(f.readline())
+                except ValueError:
+                    continue    # torn line; fall back to the previous record
+                yield page
+                break
+
+
+def _batches(pages, stats):
+    batch = []
+    for page in pages:
+        content = page.get("content", "")
         if not content or len(content) < 200:
-            skipped += 1
+            stats["skipped"] += 1
             continue
+        stats["pages"] += 1
+        batch.append((page["title"], content))
+        if len(batch) == PAGES_PER_TASK:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-        cleaned = clean_text(content)
-        chunks = chunk_text(cleaned, title)
-        all_chunks.extend(chunks)
 
+def iter_chunks(pages, workers=None, mode="words"):
+    """Chunk pages on a process pool, yielding chunks in input order"""
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(mode,)) as pool:
+        pending = deque()
+        for batch in pages:
+            pending.append(pool.submit(chunk_pages, batch, mode))
+            if len(pending) >= workers * TASKS_PER_WORKER:
+                for page_chunks in pending.popleft().result():
+                    yield from page_chunks
+        while pending:
+            for page_chunks in pending.popleft().result():
+                yield from page_chunks
+
+
+def process_all(input_file=INPUT_FILE, output_file=OUTPUT_FILE, bm25_file=BM25_FILE,
+                workers=None, mode="words"):
+    workers = workers or os.cpu_count() or 1
+    print(f"📂 Streaming {input_file} with {workers} workers ({mode} mode)...")
+
+    stats = {"pages": 0, "skipped": 0}
+    total_chunks = 0
+    bm25 = BM25Builder()
+    started = time.time()
+
+    with open(output_file, "w", encoding="utf-8") as out:
+        for chunk in iter_chunks(_batches(iter_pages(input_file), stats), workers, mode):
+            out.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+            bm25.add(chunk["id"], chunk["text"])
+            total_chunks += 1
+
+    elapsed = max(time.time() - started, 1e-9)
     print(f"\n📊 Summary:")
-    print(f"  Pages processed : {len(raw_data) - skipped}")
-    print(f"  Pages skipped   : {skipped} (too short)")
-    print(f"  Total chunks    : {len(all_chunks)}")
+    print(f"  Pages processed : {stats['pages']}")
+    print(f"  Pages skipped   : {stats['skipped']} (too short)")
+    print(f"  Total chunks    : {total_chunks}")
+    print(f"  Throughput      : {stats['pages'] / elapsed:.1f} pages/s, {total_chunks / elapsed:.1f} chunks/s")
 
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(all_chunks, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Chunks saved to {output_file}")
 
-    print(f"\n✅ Chunks saved to {OUTPUT_FILE}")
+    bm25.save(bm25_file)
+    print(f"✅ BM25 index saved to {bm25_file}")
 
 
 if __name__ == "__main__":
-    process_all()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["words", "tokens"], default="words",
+                        help="chunk by word count or by embedding-model tokens")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    args = parser.parse_args()
+
+    process_all(workers=args.workers, mode=args.mode)
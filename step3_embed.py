@@ -1,73 +1,366 @@
 """
 STEP 3: Generate embeddings and store in ChromaDB vector database
 Run: python step3_embed.py
+     python step3_embed.py --rebuild        # drop the collection and re-embed everything
+     python step3_embed.py --export-numpy   # also write ./charak_index for the NumPy backend
+     python step3_embed.py --export-numpy --quantize int8 --recall-check
+     python step3_embed.py --snapshot       # single-file ./charak_index.snapshot for deploys
+     python step3_embed.py --hnsw-sweep     # tune HNSW params (see hnsw_tuning.py)
+
+Re-runs are incremental: every chunk carries a `content_hash` of
+(embedding model and runtime, text), so switching --runtime re-embeds
+everything rather than mixing torch and ONNX vectors. Only chunks whose hash is new or different from
+the stored one are embedded and upserted, and IDs that vanished from the
+chunk file are deleted afterwards, so the collection stays queryable the
+whole time. Chunks whose text is unchanged but whose metadata changed
+(e.g. new section fields from step2) are relabelled without re-embedding.
+
+Encoding runs on ENCODE_WORKERS processes (sentence-transformers'
+multi-process pool) over batches sorted by length, so similar-length
+chunks are padded together. A writer thread upserts finished batches from
+a bounded queue while the next batch is being encoded. With
+`--runtime onnx|onnx-int8` a single onnxruntime session encodes instead,
+using --workers as its thread count.
+
+`--quantize float16|int8` adds a scalar-quantized copy of the NumPy index
+(2x / 4x smaller) that rag_engine scans by default; `--recall-check`
+reports its recall@TOP_K against the float32 matrix and the single-query
+scan latency of both. Quantized scans are slower than float32 (see
+retrieval.py): they save memory, not time.
+
+`--snapshot` packs the NumPy index and step2's BM25 index into one
+checksummed, versioned file (see snapshot.py) that rag_engine opens in
+place instead of locating or unzipping charak_db.
+
+New collections are created with the HNSW parameters chosen by the last
+`--hnsw-sweep` (charak_hnsw_params.json), stored as collection metadata;
+Chroma fixes them at creation, so changing them needs --rebuild.
 """
 
+import argparse
+import hashlib
 import json
-from sentence_transformers import SentenceTransformer
+import os
+import queue
+import tempfile
+import threading
+import time
 import chromadb
 from chromadb.config import Settings
 
-INPUT_FILE = "charak_chunks.json"
+from embedding_cache import EmbeddingCache
+from hnsw_tuning import CHROMA_DEFAULTS, load_params, make_queries, run_sweep
+from onnx_embedder import RUNTIMES, cache_namespace, load_embedder
+
+INPUT_FILE = "charak_chunks.jsonl"
 DB_PATH = "./charak_db"
+NUMPY_INDEX_PATH = "./charak_index"
+SNAPSHOT_PATH = "./charak_index.snapshot"
+BM25_INDEX_PATH = "./charak_bm25.npz"     # written by step2, packed into snapshots
 COLLECTION_NAME = "charak_samhita"
-BATCH_SIZE = 100
+BATCH_SIZE = 512            # chunks per encode round / upsert
+ENCODE_BATCH_SIZE = 32      # chunks per forward pass inside a worker
+ENCODE_WORKERS = os.cpu_count() or 1
+WRITE_QUEUE_DEPTH = 2       # encoded batches allowed to wait for the writer
+RECALL_QUERIES = 200        # held-out queries (midpoints of stored rows) for --recall-check
+RECALL_TOP_K = 5            # matches rag_engine.TOP_K
 
 # Best free embedding model for multilingual/Sanskrit-adjacent text
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 
+# Shared with rag_engine; chunks whose text was embedded before are not re-encoded
+EMBEDDING_CACHE_PATH = os.environ.get("CHARAK_EMBEDDING_CACHE", "./charak_embedding_cache.sqlite")
+
+# "torch" (sentence-transformers) or an ONNX export, see onnx_embedder.py
+EMBEDDING_RUNTIME = os.environ.get("CHARAK_EMBEDDING_RUNTIME", "torch")
+
+
+def load_chunks(path=INPUT_FILE):
+    """Chunks from step2's JSONL output"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def content_hash(text, model=EMBEDDING_MODEL, runtime=EMBEDDING_RUNTIME):
+    # Same namespace as the embedding cache; plain model name for torch
+    namespace = cache_namespace(model, runtime)
+    return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).hexdigest()
+
+
+# Section fields written by step2_chunk.py, filterable in rag_engine
+SECTION_FIELDS = ("sthana", "adhyaya", "page_type")
+
+
+def chunk_metadata(chunk):
+    metadata = {"title": chunk["title"], "chunk_index": chunk["chunk_index"],
+                "content_hash": chunk["content_hash"]}
+    for field in ("n_tokens", *SECTION_FIELDS):
+        if field in chunk:
+            metadata[field] = chunk[field]
+    return metadata
+
+
+def stored_metadata(collection):
+    """{id: metadata} of everything already in the collection"""
+    data = collection.get(include=["metadatas"])
+    return {i: m or {} for i, m in zip(data["ids"], data["metadatas"])}
+
+
+def relabel(collection, chunks):
+    """Rewrite the metadata of already embedded chunks"""
+    for start in range(0, len(chunks), BATCH_SIZE):
+        batch = chunks[start:start + BATCH_SIZE]
+        collection.update(ids=[c["id"] for c in batch], metadatas=[chunk_metadata(c) for c in batch])
+
+
+def encode_batches(model, batches, workers=ENCODE_WORKERS, cache=None):
+    """Yield (batch, embeddings) for each batch, encoding on `workers` processes"""
+    pool = None
+    if workers <= 1:
+        def encode(texts):
+            return model.encode(texts, batch_size=ENCODE_BATCH_SIZE, show_progress_bar=False)
+    else:
+        # Split the cores between workers instead of letting each grab all of them
+        os.environ.setdefault("OMP_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // workers)))
+        pool = model.start_multi_process_pool(target_devices=["cpu"] * workers)
+
+        def encode(texts):
+            return model.encode_multi_process(texts, pool, batch_size=ENCODE_BATCH_SIZE)
+
+    try:
+        for batch in batches:
+            texts = [c["text"] for c in batch]
+            yield batch, cache.encode(encode, texts) if cache else encode(texts)
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+
+
+def _write_batches(collection, pending, errors):
+    """Writer thread: upsert encoded batches until a None sentinel arrives"""
+    while True:
+        item = pending.get()
+        if item is None:
+            return
+        if errors:
+            continue  # keep draining so the encoder never blocks on a dead writer
+        batch, embeddings = item
+        try:
+            collection.upsert(
+                documents=[c["text"] for c in batch],
+                embeddings=[list(map(float, e)) for e in embeddings],
+                ids=[c["id"] for c in batch],
+                metadatas=[chunk_metadata(c) for c in batch]
+            )
+        except Exception as e:
+            errors.append(e)
+
+
+def embed_and_store(model, collection, chunks, workers=ENCODE_WORKERS, cache=None):
+    """Encode `chunks` and upsert them, overlapping encoding with writes"""
+    # Similar lengths in the same batch → less padding per forward pass
+    ordered = sorted(chunks, key=lambda c: c.get("n_tokens", len(c["text"])))
+    batches = [ordered[i:i + BATCH_SIZE] for i in range(0, len(ordered), BATCH_SIZE)]
+    print(f"\n⚡ Embedding {len(chunks)} chunks in {len(batches)} batches on {workers} worker(s)...")
 
-def build_vector_db():
+    pending = queue.Queue(maxsize=WRITE_QUEUE_DEPTH)
+    errors = []
+    writer = threading.Thread(target=_write_batches, args=(collection, pending, errors), daemon=True)
+    writer.start()
+
+    started = time.time()
+    done = 0
+    try:
+        for batch_num, (batch, embeddings) in enumerate(encode_batches(model, batches, workers, cache), 1):
+            pending.put((batch, embeddings))
+            done += len(batch)
+            print(f"  Batch {batch_num}/{len(batches)} encoded ({done}/{len(chunks)} chunks, "
+                  f"{done / max(time.time() - started, 1e-9):.1f} chunks/s)")
+    finally:
+        pending.put(None)
+        writer.join()
+    if errors:
+        raise errors[0]
+
+    elapsed = max(time.time() - started, 1e-9)
+    print(f"  Stored {len(chunks)} chunks in {elapsed:.1f}s ({len(chunks) / elapsed:.1f} chunks/s)")
+    if cache:
+        stats = cache.stats()
+        print(f"  Embedding cache: {stats['disk_hits']} hits, {stats['misses']} encoded")
+
+
+def open_collection(client, hnsw_params):
+    """Existing collection as is, or a new one with the tuned HNSW params"""
+    try:
+        collection = client.get_collection(COLLECTION_NAME)
+    except ValueError:
+        if hnsw_params:
+            print(f"  Creating collection with tuned HNSW params: {hnsw_params}")
+        return client.create_collection(
+            name=COLLECTION_NAME,
+            metadata={"hnsw:space": "cosine", **hnsw_params}
+        )
+
+    # get_or_create would overwrite the metadata without changing the index
+    current = {key: (collection.metadata or {}).get(key, default)
+               for key, default in CHROMA_DEFAULTS.items()}
+    if hnsw_params and current != hnsw_params:
+        print(f"  ⚠️ Collection built with {current}, tuned params are {hnsw_params}; "
+              f"run with --rebuild to apply them")
+    return collection
+
+
+def build_vector_db(rebuild=False, workers=ENCODE_WORKERS, runtime=EMBEDDING_RUNTIME):
     print(f"📂 Loading chunks from {INPUT_FILE}...")
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        chunks = json.load(f)
+    chunks = load_chunks(INPUT_FILE)
+    for chunk in chunks:
+        chunk["content_hash"] = content_hash(chunk["text"], runtime=runtime)
     print(f"  Loaded {len(chunks)} chunks")
 
-    print(f"\n🤖 Loading embedding model: {EMBEDDING_MODEL}")
-    model = SentenceTransformer(EMBEDDING_MODEL)
-    print("  Model loaded!")
-
     print(f"\n🗄️ Setting up ChromaDB at {DB_PATH}...")
     client = chromadb.PersistentClient(path=DB_PATH)
 
-    # Delete existing collection if rebuilding
-    try:
-        client.delete_collection(COLLECTION_NAME)
-        print("  Deleted existing collection (rebuilding fresh)")
-    except:
-        pass
-
-    collection = client.create_collection(
-        name=COLLECTION_NAME,
-        metadata={"hnsw:space": "cosine"}
+    if rebuild:
+        try:
+            client.delete_collection(COLLECTION_NAME)
+            print("  Deleted existing collection (rebuilding fresh)")
+        except ValueError:
+            pass
+
+    collection = open_collection(client, load_params())
+
+    stored = stored_metadata(collection)
+    current_ids = {c["id"] for c in chunks}
+    todo = [c for c in chunks if stored.get(c["id"], {}).get("content_hash") != c["content_hash"]]
+    changed = {c["id"] for c in todo}
+    relabelled = [c for c in chunks if c["id"] not in changed and stored[c["id"]] != chunk_metadata(c)]
+    vanished = [i for i in stored if i not in current_ids]
+    print(f"  {len(stored)} stored, {len(todo)} new/changed, {len(relabelled)} relabelled, "
+          f"{len(vanished)} to delete, {len(chunks) - len(todo) - len(relabelled)} unchanged")
+
+    if relabelled:
+        relabel(collection, relabelled)
+
+    if todo:
+        print(f"\n🤖 Loading embedding model: {EMBEDDING_MODEL} ({runtime})")
+        if runtime == "torch":
+            model = load_embedder(EMBEDDING_MODEL, runtime)
+        else:
+            # One intra-op threaded session instead of a process pool
+            model, workers = load_embedder(EMBEDDING_MODEL, runtime, threads=workers), 1
+        print("  Model loaded!")
+        cache = (EmbeddingCache(EMBEDDING_CACHE_PATH, cache_namespace(EMBEDDING_MODEL, runtime))
+                 if EMBEDDING_CACHE_PATH else None)
+        embed_and_store(model, collection, todo, workers, cache)
+
+    # Deletes last, once every replacement is already searchable
+    for start in range(0, len(vanished), BATCH_SIZE):
+        collection.delete(ids=vanished[start:start + BATCH_SIZE])
+    if vanished:
+        print(f"  🗑️ Deleted {len(vanished)} vanished chunks")
+
+    print(f"\n✅ Vector DB up to date! {collection.count()} chunks stored at {DB_PATH}")
+
+
+def export_numpy_index(out_dir=NUMPY_INDEX_PATH, dtype="float32"):
+    """Copy the Chroma collection into the mmap-able NumPy index layout"""
+    from retrieval import save_numpy_index
+
+    client = chromadb.PersistentClient(path=DB_PATH)
+    collection = client.get_collection(COLLECTION_NAME)
+    data = collection.get(include=["embeddings", "documents", "metadatas"])
+
+    # Stable row order regardless of how Chroma happens to return rows
+    order = sorted(range(len(data["ids"])), key=lambda i: data["ids"][i])
+    save_numpy_index(
+        out_dir,
+        ids=[data["ids"][i] for i in order],
+        embeddings=[data["embeddings"][i] for i in order],
+        documents=[data["documents"][i] for i in order],
+        metadatas=[data["metadatas"][i] for i in order],
+        dtype=dtype,
     )
+    print(f"✅ NumPy index written: {len(order)} chunks ({dtype}) → {out_dir}")
 
-    print(f"\n⚡ Embedding and storing {len(chunks)} chunks in batches of {BATCH_SIZE}...")
-    total_batches = (len(chunks) + BATCH_SIZE - 1) // BATCH_SIZE
 
-    for batch_num in range(total_batches):
-        start = batch_num * BATCH_SIZE
-        end = min(start + BATCH_SIZE, len(chunks))
-        batch = chunks[start:end]
+def recall_check(index_dir=NUMPY_INDEX_PATH, n_queries=RECALL_QUERIES, k=RECALL_TOP_K):
+    """Recall@k and single-query scan latency of each stored quantized copy vs float32"""
+    import numpy as np
+    from retrieval import EMBEDDINGS_FILE, NumpyBackend, QUANTIZED_FILES, measure_latency, measure_recall
 
-        texts = [c["text"] for c in batch]
-        ids = [c["id"] for c in batch]
-        metadatas = [{"title": c["title"], "chunk_index": c["chunk_index"]} for c in batch]
+    reference = NumpyBackend.load(index_dir, dtype="float32")
+    # A stored row would find itself at rank 1 and inflate recall; use points between rows
+    queries = make_queries(np.asarray(reference.vectors, dtype=np.float32), n_queries).astype(np.float32)
 
-        # Generate embeddings
-        embeddings = model.encode(texts, show_progress_bar=False).tolist()
+    size = os.path.getsize(os.path.join(index_dir, EMBEDDINGS_FILE)) / 1e6
+    print(f"\n🎯 Recall@{k} vs float32 on {len(queries)} queries:")
+    print(f"  {'float32':8s} rescore=0: recall 1.0000, "
+          f"{measure_latency(reference, queries, k):.2f} ms/query, {size:.1f} MB")
+    for dtype, filename in QUANTIZED_FILES.items():
+        if not os.path.exists(os.path.join(index_dir, filename)):
+            continue
+        size = os.path.getsize(os.path.join(index_dir, filename)) / 1e6
+        for rescore in (0, 4):
+            backend = NumpyBackend.load(index_dir, dtype=dtype, rescore=rescore)
+            recall = measure_recall(backend, reference, queries, k)
+            latency = measure_latency(backend, queries, k)
+            print(f"  {dtype:8s} rescore={rescore}: recall {recall:.4f}, "
+                  f"{latency:.2f} ms/query, {size:.1f} MB")
 
-        collection.add(
-            documents=texts,
-            embeddings=embeddings,
-            ids=ids,
-            metadatas=metadatas
-        )
 
-        print(f"  Batch {batch_num + 1}/{total_batches} done ({end}/{len(chunks)} chunks)")
+def hnsw_sweep():
+    """Sweep HNSW params over the stored embeddings and record the chosen point"""
+    client = chromadb.PersistentClient(path=DB_PATH)
+    data = client.get_collection(COLLECTION_NAME).get(include=["embeddings"])
+    print(f"\n🔬 HNSW sweep over {len(data['ids'])} stored embeddings...")
+    return run_sweep(data["embeddings"])
 
-    print(f"\n✅ Vector DB built! {collection.count()} chunks stored at {DB_PATH}")
+
+def build_snapshot(snapshot_path=SNAPSHOT_PATH, index_dir=None, dtype="float32",
+                   runtime=EMBEDDING_RUNTIME):
+    """Write a verified single-file snapshot, exporting the index first if needed"""
+    from snapshot import verify_snapshot, write_snapshot
+
+    with tempfile.TemporaryDirectory(prefix="charak_index_") as scratch:
+        if index_dir is None:
+            index_dir = scratch
+            export_numpy_index(index_dir, dtype=dtype)
+        bm25_path = BM25_INDEX_PATH if os.path.exists(BM25_INDEX_PATH) else None
+        manifest = write_snapshot(snapshot_path, index_dir, EMBEDDING_MODEL, runtime, bm25_path)
+    verify_snapshot(snapshot_path, manifest)
+    size = os.path.getsize(snapshot_path) / 1e6
+    print(f"📦 Snapshot written: {manifest['chunks']} chunks, {manifest['dtype']}"
+          f"{' + BM25' if manifest['bm25'] else ''}, "
+          f"{size:.1f} MB → {snapshot_path}")
 
 
 if __name__ == "__main__":
-    build_vector_db()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true",
+                        help="delete the collection and re-embed every chunk")
+    parser.add_argument("--workers", type=int, default=ENCODE_WORKERS,
+                        help=f"encoder processes, or ONNX threads (default {ENCODE_WORKERS})")
+    parser.add_argument("--runtime", choices=RUNTIMES, default=EMBEDDING_RUNTIME,
+                        help=f"embedding runtime (default {EMBEDDING_RUNTIME})")
+    parser.add_argument("--export-numpy", nargs="?", const=NUMPY_INDEX_PATH, metavar="DIR",
+                        help=f"after building, export the index for the NumPy backend (default {NUMPY_INDEX_PATH})")
+    parser.add_argument("--quantize", choices=["float32", "float16", "int8"], default="float32",
+                        help="also store a quantized copy of the exported index (smaller, slower to scan)")
+    parser.add_argument("--recall-check", action="store_true",
+                        help="report recall and scan latency of the quantized index against float32")
+    parser.add_argument("--snapshot", nargs="?", const=SNAPSHOT_PATH, metavar="FILE",
+                        help=f"also write a single-file index snapshot (default {SNAPSHOT_PATH})")
+    parser.add_argument("--hnsw-sweep", action="store_true",
+                        help="sweep HNSW M / construction_ef / search_ef and record the chosen params")
+    args = parser.parse_args()
+
+    build_vector_db(rebuild=args.rebuild, workers=args.workers, runtime=args.runtime)
+    if args.export_numpy:
+        export_numpy_index(args.export_numpy, dtype=args.quantize)
+    if args.recall_check:
+        recall_check(args.export_numpy or NUMPY_INDEX_PATH)
+    if args.snapshot:
+        build_snapshot(args.snapshot, index_dir=args.export_numpy, dtype=args.quantize,
+                       runtime=args.runtime)
+    if args.hnsw_sweep:
+        hnsw_sweep()
@@ -0,0 +1,86 @@
+"""
+Stub MediaWiki api.php for step1_scrape.py tests
+
+Answers the two queries the scraper makes, the way MediaWiki does:
+
+    generator=allpages&prop=info          revisions, GAP_LIMIT per call + continue
+    prop=extracts|info&explaintext        one full-page extract per call (TextExtracts
+                                          ignores exlimit without exintro) + excontinue
+
+`server.pages` is {title: {"revid", "touched", "text"}} and may be edited
+between runs; `server.calls` records the query dict of every request.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+GAP_LIMIT = 25
+
+
+class StubWikiHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        query = dict(parse_qsl(urlparse(self.path).query))
+        with self.server.lock:
+            self.server.calls.append(query)
+            pages = dict(self.server.pages)
+
+        if query.get("generator") == "allpages":
+            payload = self._allpages(pages, query)
+        elif "extracts" in query.get("prop", ""):
+            payload = self._extracts(pages, query)
+        else:
+            payload = {"error": {"code": "badquery"}}
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _allpages(self, pages, query):
+        titles = sorted(pages)
+        start = int(query.get("gapcontinue", "0"))
+        batch = titles[start:start + min(int(query.get("gaplimit", GAP_LIMIT)), GAP_LIMIT)]
+        payload = {"query": {"pages": {
+            str(start + i): {"pageid": start + i, "title": title,
+                             "lastrevid": pages[title]["revid"], "touched": pages[title]["touched"]}
+            for i, title in enumerate(batch)}}}
+        if start + len(batch) < len(titles):
+            payload["continue"] = {"gapcontinue": str(start + len(batch)), "continue": "gapcontinue||"}
+        return payload
+
+    def _extracts(self, pages, query):
+        titles = query["titles"].split("|")
+        offset = int(query.get("excontinue", "0"))
+        limit = len(titles) if query.get("exintro") else 1
+        result = {}
+        for i, title in enumerate(titles):
+            if title not in pages:
+                result[str(-1 - i)] = {"title": title, "missing": ""}
+                continue
+            page = {"pageid": i, "title": title, "lastrevid": pages[title]["revid"],
+                    "touched": pages[title]["touched"]}
+            if offset <= i < offset + limit:
+                page["extract"] = pages[title]["text"]
+            result[str(i)] = page
+        payload = {"query": {"pages": result}}
+        if offset + limit < len(titles):
+            payload["continue"] = {"excontinue": offset + limit, "continue": "||"}
+        return payload
+
+
+def start_stub_wiki(pages):
+    """Serve `pages` on a free port from a daemon thread; `server.api_url` is the endpoint"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubWikiHandler)
+    server.daemon_threads = True
+    server.pages = dict(pages)
+    server.calls = []
+    server.lock = threading.Lock()
+    server.api_url = f"http://127.0.0.1:{server.server_address[1]}/api.php"
+    threading.Thread(target=server.serve_forever, name="stub-wiki", daemon=True).start()
+    return server
@@ -0,0 +1,65 @@
+import json
+import random
+import re
+
+from step1_scrape import page_record
+from step2_chunk import chunk_tokens, iter_pages, peek_title
+
+
+def record(title, content, revid=1):
+    page = {"revid": revid, "touched": "2024-01-01T00:00:00Z", "content": content}
+    return json.dumps(page_record(title, page), ensure_ascii=False) + "\n"
+
+
+def test_peek_title_reads_only_the_title():
+    assert peek_title(record("Sutra Sthana", "x").encode()) == ("Sutra Sthana", False)
+    assert peek_title(b'{"title": "Gone", "deleted": true}\n') == ("Gone", True)
+    assert peek_title(b'{"content": "x", "title": "Late"}\n') == ("Late", False)
+    assert peek_title(b'{"title": "Torn", "con\n') == ("Torn", False)
+    assert peek_title(b'{"tit\n') == (None, False)
+
+
+def test_latest_record_wins_and_torn_lines_are_skipped(tmp_path):
+    path = tmp_path / "raw.jsonl"
+    path.write_text(
+        record("Vata", "old") + record("Pitta", "पित्त") + record("Vata", "new", revid=2)
+        + '{"title": "Pitta", "deleted": true}\n'
+        + record("Kapha", "kapha")
+        + '{"title": "Kapha", "con\n'             # torn by an interrupted step1 run, then sealed
+        + '{"title": "Ojas", "con\n',
+        encoding="utf-8",
+    )
+
+    pages = {page["title"]: page["content"] for page in iter_pages(str(path))}
+
+    assert pages == {"Vata": "new", "Kapha": "kapha"}
+
+
+class WhitespaceTokenizer:
+    """One wordpiece per whitespace-separated word, with character offsets"""
+
+    class Encoding:
+        def __init__(self, text):
+            self.offsets = [m.span() for m in re.finditer(r"\S+", text)]
+            self.ids = list(range(len(self.offsets)))
+
+    def encode(self, text, add_special_tokens=False):
+        return self.Encoding(text)
+
+    def encode_batch(self, texts, add_special_tokens=False):
+        return [self.Encoding(t) for t in texts]
+
+
+def test_token_chunks_overlap_even_after_long_sentences():
+    rng = random.Random(0)
+    words = iter(f"w{i}" for i in range(100000))
+    text = " ".join(" ".join(next(words) for _ in range(rng.randint(5, 60))) + "."
+                    for _ in range(60))
+
+    chunks = chunk_tokens(text, "Page", WhitespaceTokenizer(), budget=120, overlap=16)
+
+    assert len(chunks) > 5
+    for prev, nxt in zip(chunks, chunks[1:]):
+        assert nxt["n_tokens"] <= 120
+        shared = set(prev["text"].split()) & set(nxt["text"].split())
+        assert len(shared) >= 16
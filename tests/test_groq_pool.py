@@ -0,0 +1,100 @@
+import time
+
+import pytest
+
+from bench.stub_llm import start_stub_server
+from groq_pool import GroqPool, LLMUnavailable, ModelState, TokenBucket, parse_duration
+
+MESSAGES = [{"role": "user", "content": "What are the three doshas? " * 10}]
+
+
+@pytest.fixture
+def stub():
+    server = start_stub_server(latency=0.0)
+    yield server
+    server.shutdown()
+
+
+def pool(stub, **kwargs):
+    return GroqPool("big", api_key="test", base_url=stub.base_url, **kwargs)
+
+
+def test_parse_duration():
+    assert parse_duration("2m59.56s") == pytest.approx(179.56)
+    assert parse_duration("120ms") == pytest.approx(0.12)
+    assert parse_duration("3") == 3.0
+    assert parse_duration("soon") is None and parse_duration(None) is None
+
+
+def test_full_bucket_still_refills():
+    bucket = TokenBucket()
+    bucket.sync(limit=10, remaining=10, reset_s=1.0, now=0.0)
+    bucket.take(10)
+    assert 0 < bucket.wait_time(1, now=0.0) <= 1.0
+    assert bucket.wait_time(1, now=1.0) == 0.0
+
+
+def test_model_state_syncs_from_headers():
+    state = ModelState()
+    state.sync({"x-ratelimit-limit-tokens": "6000", "x-ratelimit-remaining-tokens": "0",
+                "x-ratelimit-reset-tokens": "6s"}, now=0.0)
+    assert state.wait_time(1000, now=0.0) == pytest.approx(1.0)
+
+
+def test_transient_errors_are_retried(stub):
+    stub.fail_first = 2
+    response, model = pool(stub, fallback=None).complete(MESSAGES)
+
+    assert model == "big" and response.choices[0].message.content
+    assert stub.calls == {("big", 503): 2, ("big", 200): 1}
+
+
+def test_saturated_primary_falls_back_before_429(stub):
+    stub.tokens_per_minute = 1000
+    p = pool(stub, fallback="small")
+    used = [p.complete(MESSAGES, max_tokens=100)[1] for _ in range(12)]
+
+    assert used[0] == "big" and used[-1] == "small"
+    assert ("big", 429) not in stub.calls        # the mirrored bucket saw it coming
+
+
+def test_429_drains_the_bucket_and_falls_back(stub):
+    stub.tokens_per_minute = 1000
+    stub.windows["big"] = [time.monotonic(), 1000]   # minute already spent elsewhere
+    p = pool(stub, fallback="small")
+
+    assert p.complete(MESSAGES)[1] == "small"
+    assert stub.calls[("big", 429)] == 1
+    assert p.state("big").tokens.wait_time(100, time.monotonic()) > 1
+
+
+def test_slow_primary_is_routed_around(stub):
+    stub.model_latency = {"big": 0.3, "small": 0.0}
+    p = pool(stub, fallback="small", latency_slo=0.1)
+
+    assert [p.complete(MESSAGES)[1] for _ in range(3)] == ["big", "small", "small"]
+
+
+def test_gives_up_at_the_deadline(stub):
+    stub.fail_rate = 1.0
+    started = time.monotonic()
+    with pytest.raises(LLMUnavailable) as raised:
+        pool(stub, fallback="small", deadline=1.0).complete(MESSAGES)
+
+    assert time.monotonic() - started < 2.0
+    assert raised.value.errors
+
+
+def test_bad_key_is_not_retried(stub):
+    stub.fail_rate, stub.fail_status = 1.0, 401
+    with pytest.raises(LLMUnavailable):
+        pool(stub, fallback="small").complete(MESSAGES)
+
+    assert sum(stub.calls.values()) == 1
+
+
+def test_stream(stub):
+    chunks, model = pool(stub).stream(MESSAGES)
+    text = "".join(c.choices[0].delta.content or "" for c in chunks if c.choices)
+
+    assert model == "big" and "doshas" in text
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from step1_scrape import TokenBucket, get_pages_content, load_scraped_revisions, make_session, scrape_all
+from tests.stub_mediawiki import start_stub_wiki
+
+
+def make_pages(n, revid=100):
+    return {f"Page {i:02d}": {"revid": revid + i, "touched": "2024-01-01T00:00:00Z",
+                              "text": f"Sutra {i} " * 40} for i in range(n)}
+
+
+@pytest.fixture
+def wiki():
+    server = start_stub_wiki(make_pages(57))
+    yield server
+    server.shutdown()
+
+
+def run(wiki, tmp_path, **kwargs):
+    return scrape_all(api_url=wiki.api_url, output_file=str(tmp_path / "raw.jsonl"),
+                      changes_file=str(tmp_path / "changes.json"), requests_per_second=1000, **kwargs)
+
+
+def records(tmp_path):
+    with open(tmp_path / "raw.jsonl", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def extract_calls(wiki):
+    return [c for c in wiki.calls if "extracts" in c.get("prop", "")]
+
+
+def test_full_scrape_writes_every_page(wiki, tmp_path):
+    changes = run(wiki, tmp_path)
+
+    saved = {r["title"]: r for r in records(tmp_path)}
+    assert set(saved) == set(wiki.pages)
+    assert saved["Page 03"]["content"] == wiki.pages["Page 03"]["text"]
+    assert saved["Page 03"]["revid"] == 103
+    assert sorted(changes["added"]) == sorted(wiki.pages)
+    assert changes["modified"] == [] and changes["deleted"] == []
+    assert len(extract_calls(wiki)) == len(wiki.pages)   # one full-page extract per call
+
+
+def test_rescrape_fetches_only_changes(wiki, tmp_path):
+    run(wiki, tmp_path)
+    wiki.pages["Page 05"] = {**wiki.pages["Page 05"], "revid": 999, "text": "edited"}
+    del wiki.pages["Page 06"]
+    wiki.pages["Page 99"] = {"revid": 1, "touched": "2024-02-01T00:00:00Z", "text": "new"}
+    wiki.calls.clear()
+
+    changes = run(wiki, tmp_path)
+
+    assert (changes["added"], changes["modified"], changes["deleted"]) == (["Page 99"], ["Page 05"], ["Page 06"])
+    assert sorted(c["titles"] for c in extract_calls(wiki)) == ["Page 05", "Page 99"]
+    assert records(tmp_path)[-3]["deleted"] is True
+    revisions = load_scraped_revisions(str(tmp_path / "raw.jsonl"))
+    assert revisions["Page 05"] == 999 and "Page 06" not in revisions and "Page 99" in revisions
+
+
+def test_resume_after_torn_line(wiki, tmp_path):
+    run(wiki, tmp_path)
+    with open(tmp_path / "raw.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"title": "Page 99", "con')          # interrupted mid-write
+    wiki.pages["Page 99"] = {"revid": 1, "touched": "2024-02-01T00:00:00Z", "text": "new"}
+
+    changes = run(wiki, tmp_path)
+
+    assert changes["added"] == ["Page 99"]
+    with open(tmp_path / "raw.jsonl", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert lines[-2].endswith('"con') and json.loads(lines[-1])["title"] == "Page 99"
+
+
+def test_batched_titles_follow_continuation(wiki):
+    titles = sorted(wiki.pages)[:5]
+    contents = get_pages_content(make_session(1), TokenBucket(1000), titles, wiki.api_url)
+
+    assert set(contents) == set(titles)
+    assert len(extract_calls(wiki)) == 5
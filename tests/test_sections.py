@@ -0,0 +1,11 @@
+from sections import parse_section
+
+
+def test_opening_header_sets_the_chapter():
+    assert parse_section("Jwara Chikitsa", "\n Cikitsa Sthana Chapter 3. Management of Jwara") == {
+        "sthana": "Chikitsa Sthana", "adhyaya": 3, "page_type": "adhyaya"}
+
+
+def test_chapter_mentioned_later_is_ignored():
+    content = "Panchakarma is the fivefold purification; Siddhi Sthana chapter 2 discusses it."
+    assert parse_section("Panchakarma", content) == {"sthana": "", "adhyaya": 0, "page_type": "other"}
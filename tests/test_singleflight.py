@@ -0,0 +1,153 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import FlightTimeout, SingleFlight, normalize_question
+
+
+def run_in_threads(n, target):
+    results, threads = [None] * n, []
+    for i in range(n):
+        def run(i=i):
+            try:
+                results[i] = target()
+            except Exception as e:
+                results[i] = e
+        threads.append(threading.Thread(target=run))
+    for t in threads:
+        t.start()
+    return threads, results
+
+
+def test_normalize_question():
+    assert normalize_question("  What is  VATA?? ") == normalize_question("what is vata")
+
+
+def test_do_coalesces_concurrent_calls():
+    flights, calls, release = SingleFlight(), [], threading.Event()
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return "answer"
+
+    threads, results = run_in_threads(5, lambda: flights.do("q", slow))
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert {answer for answer, _ in results} == {"answer"}
+
+
+def test_do_leader_error_reaches_followers():
+    flights, release = SingleFlight(), threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise RuntimeError("groq down")
+
+    threads, results = run_in_threads(3, lambda: flights.do("q", fail))
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    # Nothing is kept once the call finished
+    assert flights.do("q", lambda: "fresh") == ("fresh", False)
+
+
+def test_do_follower_times_out_behind_a_stuck_leader():
+    flights, release = SingleFlight(timeout=0.2), threading.Event()
+    leader = threading.Thread(target=lambda: flights.do("q", lambda: release.wait(5)))
+    leader.start()
+    time.sleep(0.05)
+
+    with pytest.raises(FlightTimeout):
+        flights.do("q", lambda: "unused")
+    # Past the timeout a new caller runs its own call instead of joining
+    assert flights.do("q", lambda: "fresh") == ("fresh", False)
+    release.set()
+    leader.join()
+
+
+def test_stream_replays_every_event_to_late_joiners():
+    flights, release = SingleFlight(), threading.Event()
+
+    def gen():
+        yield "sources"
+        release.wait(5)
+        yield "token"
+        yield "done"
+
+    events, shared = flights.stream("q", gen)
+    assert not shared and next(events) == "sources"
+    late, shared = flights.stream("q", lambda: iter(["unused"]))
+    assert shared
+    release.set()
+
+    assert list(events) == ["token", "done"]
+    assert list(late) == ["sources", "token", "done"]
+
+
+def test_do_and_stream_never_share_a_call():
+    flights, release = SingleFlight(), threading.Event()
+    leader = threading.Thread(target=lambda: flights.do("q", lambda: release.wait(5)))
+    leader.start()
+    time.sleep(0.05)
+
+    events, shared = flights.stream("q", lambda: iter(["token"]))
+    assert not shared and list(events) == ["token"]
+    release.set()
+    leader.join()
+
+
+def test_stream_leader_error_reaches_followers():
+    flights, release = SingleFlight(), threading.Event()
+
+    def gen():
+        yield "sources"
+        release.wait(5)
+        raise RuntimeError("groq down")
+
+    events, _ = flights.stream("q", gen)
+    follower, _ = flights.stream("q", gen)
+    release.set()
+
+    for stream in (events, follower):
+        assert next(stream) == "sources"
+        with pytest.raises(RuntimeError):
+            next(stream)
+
+
+def test_stream_timeout_is_idle_not_total():
+    flights = SingleFlight(timeout=0.2)
+
+    def steady():
+        for i in range(6):             # 0.6s in total, never 0.2s without an event
+            time.sleep(0.1)
+            yield i
+
+    flights.stream("q", steady)
+    follower, shared = flights.stream("q", steady)
+    assert shared and list(follower) == list(range(6))
+
+
+def test_stream_follower_times_out_when_stalled():
+    flights, release = SingleFlight(timeout=0.2), threading.Event()
+
+    def stalls():
+        yield "sources"
+        release.wait(5)
+        yield "done"
+
+    flights.stream("q", stalls)
+    follower, _ = flights.stream("q", stalls)
+    assert next(follower) == "sources"
+    with pytest.raises(FlightTimeout):
+        next(follower)
+    release.set()